@@ -0,0 +1,154 @@
+import asyncio
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+import blob_utils
+import log_utils
+from single_flight import AsyncSingleFlight, SingleFlight
+
+# "blob" shares cached analyses across every Function App instance, so scaled
+# out instances do not each rerun the same analysis; "memory" keeps them per
+# process, for local runs and tests.
+ANALYSIS_CACHE_BACKEND = os.environ.get("ANALYSIS_CACHE_BACKEND", "blob")
+ANALYSIS_CACHE_CONTAINER = os.environ.get("ANALYSIS_CACHE_CONTAINER", "analysis-cache")
+ANALYSIS_CACHE_MAX_ENTRIES = int(os.environ.get("ANALYSIS_CACHE_MAX_ENTRIES", "256"))
+CACHE_MODE_BYPASS = "bypass"
+CACHE_MODE_REFRESH = "refresh"
+CACHE_MODES = (CACHE_MODE_BYPASS, CACHE_MODE_REFRESH)
+
+def make_key(request, system_prompt, model, max_tokens, temperature, top_p, prompt_format=None):
+    # `request` is an analysis_schema.Request, so field order and defaults are
+    # normalised before hashing and equivalent payloads share a key.
+    canonical = json.dumps(
+        {
+            "request": request.model_dump(mode="json"),
+            "system_prompt": system_prompt,
+            "model": model,
+            "max_tokens": max_tokens,
+            "temperature": temperature,
+            "top_p": top_p,
+            "prompt_format": prompt_format,
+        },
+        sort_keys=True,
+        separators=(",", ":"),
+        ensure_ascii=False
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+class MemoryBackend:
+    def __init__(self, max_entries=ANALYSIS_CACHE_MAX_ENTRIES):
+        self._max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+class BlobBackend:
+    def __init__(self, container_name=ANALYSIS_CACHE_CONTAINER):
+        self._container_name = container_name
+
+    def get(self, key):
+        data = blob_utils.download_blob(
+            client=blob_utils.get_client(),
+            container_name=self._container_name,
+            blob_name=f"{key}.json"
+        )
+        return json.loads(data) if data else None
+
+    def put(self, key, value):
+        blob_utils.upload_blob(
+            client=blob_utils.get_client(),
+            container_name=self._container_name,
+            blob_name=f"{key}.json",
+            content_type="application/json",
+            data=json.dumps(value),
+            compress=blob_utils.BLOB_COMPRESS_ARTIFACTS
+        )
+
+    def delete(self, key):
+        blob_utils.delete_blob(
+            client=blob_utils.get_client(),
+            container_name=self._container_name,
+            blob_name=f"{key}.json"
+        )
+
+class AnalysisCache:
+    def __init__(self, backend):
+        self._backend = backend
+        self._flights = SingleFlight()
+        self._async_flights = AsyncSingleFlight()
+
+    def get(self, key):
+        try:
+            return self._backend.get(key)
+        except Exception as e:
+            log_utils.warning("Analysis cache read failed", key=key, error=e)
+            return None
+
+    def put(self, key, value):
+        try:
+            self._backend.put(key, value)
+        except Exception as e:
+            log_utils.warning("Analysis cache write failed", key=key, error=e)
+
+    def invalidate(self, key):
+        self._backend.delete(key)
+
+    def get_or_compute(self, key, compute):
+        value = self.get(key)
+        if value is not None:
+            log_utils.info("Analysis cache hit", key=key)
+            return value
+        def compute_and_store():
+            # Re-check inside the flight in case a previous leader just stored it.
+            cached = self.get(key)
+            if cached is not None:
+                return cached
+            log_utils.info("Analysis cache miss", key=key)
+            computed = compute()
+            self.put(key, computed)
+            return computed
+        return self._flights.do(key, compute_and_store)
+
+    async def get_or_compute_async(self, key, compute):
+        # Backend calls may block (Blob backend), so they run off the event loop.
+        value = await asyncio.to_thread(self.get, key)
+        if value is not None:
+            log_utils.info("Analysis cache hit", key=key)
+            return value
+        async def compute_and_store():
+            cached = await asyncio.to_thread(self.get, key)
+            if cached is not None:
+                return cached
+            log_utils.info("Analysis cache miss", key=key)
+            computed = await compute()
+            await asyncio.to_thread(self.put, key, computed)
+            return computed
+        return await self._async_flights.do(key, compute_and_store)
+
+def _create_backend(name):
+    if name == "blob":
+        return BlobBackend()
+    if name == "memory":
+        return MemoryBackend()
+    raise ValueError(f"Unknown analysis cache backend '{name}'")
+
+cache = AnalysisCache(_create_backend(ANALYSIS_CACHE_BACKEND))
@@ -0,0 +1,888 @@
+import asyncio
+import contextvars
+import json
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import analysis_cache
+import analysis_schema
+import blob_utils
+import db_utils
+import keyvault_utils
+import log_utils
+import openai_utils
+import prompt_builder
+import retry
+import roi_utils
+import system_message
+
+NUMERIC_MAX_TOKENS = 1024
+EXTRACTION_MAX_TOKENS = 4096
+# Chunk extractions run in parallel, at most this many at once; the OpenAI
+# limiter still paces them against the deployment's quota.
+EXTRACTION_CONCURRENCY = int(os.environ.get("EXTRACTION_CONCURRENCY", "32"))
+# Incremental analysis also extracts costs and benefits form by form, next to
+# the final call, and keeps the extractions with the report so a re-analysis
+# only sends changed forms as they are. The extraction calls are spent on
+# every analysis that is not served from cache, so it is opt-in, for surveys
+# that are re-analysed after small edits. When off, only surveys too large
+# for one call are extracted.
+ANALYSIS_INCREMENTAL = os.environ.get("ANALYSIS_INCREMENTAL", "false").lower() == "true"
+# Total time budget for one analysis, shared by every retried call inside it.
+ANALYSIS_DEADLINE_SECONDS = float(os.environ.get("ANALYSIS_DEADLINE_SECONDS", "120"))
+# Split generation asks for the totals and ROI in one small call, checks them,
+# then asks for the insights, recommendations and summary in parallel calls
+# that are given the checked numbers. Output length drives latency, so an
+# analysis takes about the numeric call plus its slowest section instead of
+# one call writing everything. It sends the prompt once per call, several
+# times the input tokens of one call, so it is opt-in for deployments where
+# latency matters more than quota. When off, one call returns the whole
+# Response.
+ANALYSIS_SPLIT = os.environ.get("ANALYSIS_SPLIT", "false").lower() == "true"
+NUMERIC_FIELDS = ("total_costs", "total_benefits", "roi")
+# (name, response class, request, max_tokens) for each narrative section.
+SECTIONS = (
+    ("insights", analysis_schema.Insights, system_message.INSIGHTS_SECTION_NOTE, 2048),
+    ("recommendations", analysis_schema.Recommendations, system_message.RECOMMENDATIONS_SECTION_NOTE, 2048),
+    ("summary", analysis_schema.Summary, system_message.SUMMARY_SECTION_NOTE, 512)
+)
+
+def _get_openai_client():
+    api_key = keyvault_utils.get_secret(keyvault_utils.get_client(), "OpenAI")
+    return openai_utils.get_client(api_key=api_key)
+
+def _numeric_reask_prompt(request, analysis, amounts):
+    # Returns None when the forms are too large to resend in one call.
+    prompt = prompt_builder.Prompt(
+        system_message.ROI_NUMERIC_REPAIR_SYSTEM_MESSAGE + system_message.COMPACT_FORMS_NOTE,
+        prompt_builder.compact_json({
+            "forms": prompt_builder.compact_forms(request.forms),
+            "previous_totals": {
+                "total_costs": analysis["total_costs"]["value"],
+                "total_benefits": analysis["total_benefits"]["value"],
+                "roi": analysis["roi"]["value"]
+            },
+            "stated_amounts": amounts
+        })
+    )
+    if prompt.tokens() > prompt_builder.PROMPT_MAX_INPUT_TOKENS:
+        log_utils.warning("POST survey analysis numeric re-ask skipped, forms are too large to resend")
+        return None
+    return prompt
+
+def reask_numeric_analysis(openai_client, request, analysis, amounts):
+    prompt = _numeric_reask_prompt(request, analysis, amounts)
+    if prompt is None:
+        return None
+    return json.loads(
+        openai_utils.get_json_response(
+            client=openai_client,
+            system_message=prompt.system_message,
+            user_message=prompt.user_message,
+            response_class=analysis_schema.NumericAnalysis,
+            model=openai_utils.MODEL_TIERS["numeric"],
+            max_tokens=NUMERIC_MAX_TOKENS
+        )
+    )
+
+async def reask_numeric_analysis_async(openai_client, request, analysis, amounts):
+    prompt = _numeric_reask_prompt(request, analysis, amounts)
+    if prompt is None:
+        return None
+    return json.loads(
+        await openai_utils.get_json_response_async(
+            client=openai_client,
+            system_message=prompt.system_message,
+            user_message=prompt.user_message,
+            response_class=analysis_schema.NumericAnalysis,
+            model=openai_utils.MODEL_TIERS["numeric"],
+            max_tokens=NUMERIC_MAX_TOKENS
+        )
+    )
+
+def _check_totals(request, analysis):
+    amounts = roi_utils.extract_form_amounts(request)
+    issues = roi_utils.check_totals(analysis, amounts)
+    if issues:
+        log_utils.warning("POST survey analysis totals failed checks, re-asking for numeric fields", issues=issues)
+    return amounts, issues
+
+def _apply_numeric(analysis, numeric, amounts):
+    if numeric is None:
+        return
+    if roi_utils.check_totals(numeric, amounts):
+        log_utils.error("POST survey analysis numeric re-ask still failed checks, keeping reported totals", numeric=numeric)
+        return
+    analysis["total_costs"] = numeric["total_costs"]
+    analysis["total_benefits"] = numeric["total_benefits"]
+    analysis["roi"] = numeric["roi"]
+
+def _roi_to_rewrite(analysis, openai_response=None):
+    # The ROI implied by the totals when the reported one is off and quoted in
+    # its explanation or the summary, where swapping the value alone would
+    # leave the text contradicting it. An unquoted value is repaired in place.
+    roi = roi_utils.inconsistent_roi(analysis)
+    if roi is None:
+        return None
+    texts = [analysis["roi"]["explanation"]] + ([openai_response["summary"]] if openai_response is not None else [])
+    if roi_utils.quotes_roi(texts, analysis["roi"]["value"]):
+        log_utils.warning("POST survey analysis roi is quoted in its text, re-asking for the explanation", reported=analysis["roi"]["value"], roi=roi)
+        return roi
+    replaced_roi = roi_utils.repair_roi(analysis)
+    log_utils.info("POST survey analysis repaired roi", replaced=replaced_roi, roi=analysis["roi"]["value"], total_costs=analysis["total_costs"]["value"], total_benefits=analysis["total_benefits"]["value"])
+    return None
+
+def _roi_correction(prompt, analysis, roi, openai_response=None):
+    # (prompt, response class, model) asking for the explanation, and the
+    # summary of a whole response, around the recalculated value.
+    numbers = {"total_costs": analysis["total_costs"], "total_benefits": analysis["total_benefits"], "roi": {"value": round(roi, 4)}}
+    if openai_response is None:
+        return prompt_builder.section_prompt(prompt, system_message.ROI_CORRECTION_NOTE, numbers), analysis_schema.Roi, openai_utils.MODEL_TIERS["numeric"]
+    note = system_message.ROI_SUMMARY_CORRECTION_NOTE + prompt_builder.compact_json(openai_response["summary"])
+    return prompt_builder.section_prompt(prompt, note, numbers), analysis_schema.RoiCorrection, openai_utils.MODEL_TIERS["narrative"]
+
+def _apply_roi(analysis, roi, corrected, openai_response=None):
+    # The value is always the recalculated one, whatever the model returned,
+    # and an explanation that still quotes the old figure is replaced by the
+    # plain calculation.
+    reported_roi = analysis["roi"]["value"]
+    explanation = None
+    if corrected is not None:
+        if openai_response is not None:
+            openai_response["summary"] = corrected["summary"]
+            if roi_utils.quotes_roi([corrected["summary"]], reported_roi):
+                log_utils.error("POST survey analysis rewritten summary still quotes the old roi", reported=reported_roi, roi=roi)
+            corrected = corrected["roi"]
+        explanation = corrected["explanation"]
+    if explanation is None or roi_utils.quotes_roi([explanation], reported_roi):
+        explanation = roi_utils.roi_explanation(analysis, roi)
+    analysis["roi"] = {"value": round(roi, 4), "explanation": explanation}
+
+def _repair_roi(openai_client, prompt, analysis, openai_response=None):
+    roi = _roi_to_rewrite(analysis, openai_response)
+    if roi is None:
+        return
+    correction, response_class, model = _roi_correction(prompt, analysis, roi, openai_response)
+    corrected = None
+    try:
+        corrected = json.loads(
+            openai_utils.get_json_response(
+                client=openai_client,
+                system_message=correction.system_message,
+                user_message=correction.user_message,
+                response_class=response_class,
+                model=model,
+                max_tokens=NUMERIC_MAX_TOKENS
+            )
+        )
+    except Exception as e:
+        log_utils.error("POST survey analysis roi explanation re-ask failed, stating the calculation instead", error=e)
+    _apply_roi(analysis, roi, corrected, openai_response)
+
+async def _repair_roi_async(openai_client, prompt, analysis, openai_response=None):
+    roi = _roi_to_rewrite(analysis, openai_response)
+    if roi is None:
+        return
+    correction, response_class, model = _roi_correction(prompt, analysis, roi, openai_response)
+    corrected = None
+    try:
+        corrected = json.loads(
+            await openai_utils.get_json_response_async(
+                client=openai_client,
+                system_message=correction.system_message,
+                user_message=correction.user_message,
+                response_class=response_class,
+                model=model,
+                max_tokens=NUMERIC_MAX_TOKENS
+            )
+        )
+    except Exception as e:
+        log_utils.error("POST survey analysis roi explanation re-ask failed, stating the calculation instead", error=e)
+    _apply_roi(analysis, roi, corrected, openai_response)
+
+def _verify_totals(openai_client, request, analysis):
+    # Deterministic post-processing instead of regenerating the whole answer:
+    # totals that contradict the amounts stated in the forms get one targeted
+    # re-ask for the numeric fields only.
+    amounts, issues = _check_totals(request, analysis)
+    if issues:
+        numeric = None
+        try:
+            numeric = reask_numeric_analysis(openai_client, request, analysis, amounts)
+        except Exception as e:
+            log_utils.error("POST survey analysis numeric re-ask failed, keeping reported totals", error=e)
+        _apply_numeric(analysis, numeric, amounts)
+
+async def _verify_totals_async(openai_client, request, analysis):
+    amounts, issues = _check_totals(request, analysis)
+    if issues:
+        numeric = None
+        try:
+            numeric = await reask_numeric_analysis_async(openai_client, request, analysis, amounts)
+        except Exception as e:
+            log_utils.error("POST survey analysis numeric re-ask failed, keeping reported totals", error=e)
+        _apply_numeric(analysis, numeric, amounts)
+
+def verify_numbers(openai_client, request, analysis, prompt):
+    # ROI is then recomputed locally; when its text quotes the wrong figure,
+    # the explanation is asked for again around the corrected value.
+    _verify_totals(openai_client, request, analysis)
+    _repair_roi(openai_client, prompt, analysis)
+    return analysis
+
+async def verify_numbers_async(openai_client, request, analysis, prompt):
+    await _verify_totals_async(openai_client, request, analysis)
+    await _repair_roi_async(openai_client, prompt, analysis)
+    return analysis
+
+def verify_analysis(openai_client, request, openai_response, prompt):
+    # As verify_numbers, but the summary is rewritten with the explanation.
+    _verify_totals(openai_client, request, openai_response["analysis"])
+    _repair_roi(openai_client, prompt, openai_response["analysis"], openai_response)
+    return openai_response
+
+async def verify_analysis_async(openai_client, request, openai_response, prompt):
+    await _verify_totals_async(openai_client, request, openai_response["analysis"])
+    await _repair_roi_async(openai_client, prompt, openai_response["analysis"], openai_response)
+    return openai_response
+
+EXTRACTION_FIELDS = ("costs", "benefits", "observations")
+
+def _form_extractions(entries, extraction):
+    # Maps the model's per-form ids back to fingerprints; a form it left out
+    # had nothing to extract.
+    by_id = {item["form"]: item for item in extraction["forms"]}
+    return {
+        fingerprint: {field: by_id.get(index, {}).get(field, []) for field in EXTRACTION_FIELDS}
+        for index, (fingerprint, _, _) in enumerate(entries)
+    }
+
+def extract_chunk(openai_client, entries):
+    prompt = prompt_builder.extraction_prompt(entries)
+    extraction = json.loads(
+        openai_utils.get_json_response(
+            client=openai_client,
+            system_message=prompt.system_message,
+            user_message=prompt.user_message,
+            response_class=analysis_schema.Extraction,
+            model=openai_utils.MODEL_TIERS["extraction"],
+            max_tokens=EXTRACTION_MAX_TOKENS
+        )
+    )
+    return _form_extractions(entries, extraction)
+
+async def extract_chunk_async(openai_client, entries, semaphore):
+    prompt = prompt_builder.extraction_prompt(entries)
+    async with semaphore:
+        extraction = json.loads(
+            await openai_utils.get_json_response_async(
+                client=openai_client,
+                system_message=prompt.system_message,
+                user_message=prompt.user_message,
+                response_class=analysis_schema.Extraction,
+                model=openai_utils.MODEL_TIERS["extraction"],
+                max_tokens=EXTRACTION_MAX_TOKENS
+            )
+        )
+    return _form_extractions(entries, extraction)
+
+def extract_forms(openai_client, entries):
+    chunks = prompt_builder.chunk_entries(entries)
+    # Each worker runs in a copy of this context so the analysis deadline applies.
+    contexts = [contextvars.copy_context() for _ in chunks]
+    extracted = {}
+    with ThreadPoolExecutor(max_workers=EXTRACTION_CONCURRENCY) as pool:
+        for forms in pool.map(lambda context, chunk: context.run(extract_chunk, openai_client, chunk), contexts, chunks):
+            extracted.update(forms)
+    return extracted
+
+async def extract_forms_async(openai_client, entries):
+    semaphore = asyncio.Semaphore(EXTRACTION_CONCURRENCY)
+    extracted = {}
+    for forms in await asyncio.gather(*(extract_chunk_async(openai_client, chunk, semaphore) for chunk in prompt_builder.chunk_entries(entries))):
+        extracted.update(forms)
+    return extracted
+
+def _previous_analysis(report, data):
+    if report is None or data is None:
+        return None
+    document = json.loads(data)
+    return {"reportVersion": report["reportVersion"], "request": document.get("request"), "extractions": document.get("extractions")}
+
+def load_previous_analysis(survey_name):
+    # The latest report's request and form extractions, or None. Failing to
+    # load them only costs the reuse, so errors are logged and swallowed.
+    try:
+        report = db_utils.get_latest_report_version(db_utils.get_client(), survey_name)
+        data = None
+        if report is not None:
+            container_name, blob_name = blob_utils.parse_blob_url(report["analysis"])
+            data = blob_utils.download_blob(blob_utils.get_client(), container_name, blob_name)
+        return _previous_analysis(report, data)
+    except Exception as e:
+        log_utils.warning("POST survey analysis previous report not loaded, extracting every form", error=e)
+        return None
+
+async def load_previous_analysis_async(survey_name):
+    try:
+        report = await db_utils.get_latest_report_version_async(db_utils.get_async_client(), survey_name)
+        data = None
+        if report is not None:
+            container_name, blob_name = blob_utils.parse_blob_url(report["analysis"])
+            data = await blob_utils.download_blob_async(blob_utils.get_async_client(), container_name, blob_name)
+        return _previous_analysis(report, data)
+    except Exception as e:
+        log_utils.warning("POST survey analysis previous report not loaded, extracting every form", error=e)
+        return None
+
+def _reusable(entries, previous):
+    # Extractions of forms that are unchanged since the previous report.
+    extractions = (previous or {}).get("extractions") or {}
+    if extractions.get("format") != prompt_builder.EXTRACTION_FORMAT:
+        return {}
+    forms = extractions.get("forms") or {}
+    return {fingerprint: forms[fingerprint] for fingerprint, _, _ in entries if fingerprint in forms}
+
+def _removed_forms(entries, previous):
+    if not previous or not previous.get("request"):
+        return 0
+    current = {fingerprint for fingerprint, _, _ in entries}
+    previous_request = analysis_schema.Request.model_validate(previous["request"])
+    return sum(1 for fingerprint, _, _ in prompt_builder.form_entries(previous_request.forms) if fingerprint not in current)
+
+def _incremental(entries, previous, reused, changed, extracted):
+    # The analysis artifact keeps every extracted form for the next run;
+    # `recomputed` goes on the report version.
+    forms = {**reused, **extracted}
+    return {
+        "extractions": {
+            "format": prompt_builder.EXTRACTION_FORMAT,
+            "forms": {fingerprint: forms[fingerprint] for fingerprint, _, _ in entries if fingerprint in forms}
+        },
+        "recomputed": {
+            "baseReportVersion": previous["reportVersion"] if previous else None,
+            "recomputedForms": [row[0] for _, _, row in changed],
+            "reusedForms": len(reused),
+            "removedForms": _removed_forms(entries, previous),
+            "aggregation": True
+        }
+    }
+
+def reused_incremental(incremental):
+    # A cached response reused for another survey recomputes nothing.
+    if incremental is None:
+        return None
+    return {
+        "extractions": incremental["extractions"],
+        "recomputed": {
+            "baseReportVersion": None,
+            "recomputedForms": [],
+            "reusedForms": len(incremental["extractions"]["forms"]),
+            "removedForms": 0,
+            "aggregation": False
+        }
+    }
+
+def plan_incremental(system_prompt, entries, previous):
+    # Returns (prompt, reused, changed). Unchanged forms are sent as their
+    # stored extractions and changed ones as they are, so the final call does
+    # not wait for any extraction. The prompt is None when that does not fit
+    # one call and the changed forms have to be extracted first.
+    reused = _reusable(entries, previous)
+    changed = [entry for entry in entries if entry[0] not in reused]
+    log_utils.info("POST survey analysis reusing form extractions", reused=len(reused), forms=len(entries))
+    prompt = prompt_builder.aggregate_prompt(system_prompt, list(reused.values()), changed)
+    return (prompt if prompt.tokens() <= prompt_builder.PROMPT_MAX_INPUT_TOKENS else None), reused, changed
+
+def _extracted_prompt(system_prompt, entries, reused, extracted):
+    forms = {**reused, **extracted}
+    return prompt_builder.aggregate_prompt(system_prompt, [forms[fingerprint] for fingerprint, _, _ in entries if fingerprint in forms])
+
+def _extract_for_reuse(openai_client, entries):
+    # Runs alongside the final call. These extractions are only kept for the
+    # next analysis, so failing here does not fail this one.
+    try:
+        return extract_forms(openai_client, entries) if entries else {}
+    except Exception as e:
+        log_utils.warning("POST survey analysis form extraction failed, the forms are extracted next time", error=e)
+        return {}
+
+async def _extract_for_reuse_async(openai_client, entries):
+    try:
+        return await extract_forms_async(openai_client, entries) if entries else {}
+    except Exception as e:
+        log_utils.warning("POST survey analysis form extraction failed, the forms are extracted next time", error=e)
+        return {}
+
+def _generate_whole(openai_client, prompt, request):
+    openai_response = json.loads(
+        openai_utils.get_json_response(
+            client=openai_client,
+            system_message=prompt.system_message,
+            user_message=prompt.user_message,
+            response_class=analysis_schema.Response,
+            model=openai_utils.MODEL_TIERS["analysis"]
+        )
+    )
+    log_utils.verbose("POST survey analysis OpenAI response", response=log_utils.Payload(openai_response))
+    return verify_analysis(openai_client, request, openai_response, prompt)
+
+async def _generate_whole_async(openai_client, prompt, request):
+    openai_response = json.loads(
+        await openai_utils.get_json_response_async(
+            client=openai_client,
+            system_message=prompt.system_message,
+            user_message=prompt.user_message,
+            response_class=analysis_schema.Response,
+            model=openai_utils.MODEL_TIERS["analysis"],
+            hedge=True
+        )
+    )
+    log_utils.verbose("POST survey analysis OpenAI response", response=log_utils.Payload(openai_response))
+    return await verify_analysis_async(openai_client, request, openai_response, prompt)
+
+def _merge_sections(numbers, sections):
+    # Back into the Response schema, so stored analyses and the API are the
+    # same whether or not the generation was split.
+    openai_response = {
+        "analysis": {**numbers, "insights": sections["insights"]["insights"], "recommendations": sections["recommendations"]["recommendations"]},
+        "summary": sections["summary"]["summary"]
+    }
+    analysis_schema.Response.model_validate(openai_response)
+    log_utils.verbose("POST survey analysis OpenAI response", response=log_utils.Payload(openai_response))
+    return openai_response
+
+def _generate_numbers(openai_client, prompt, request):
+    numeric_prompt = prompt_builder.section_prompt(prompt, system_message.NUMERIC_SECTION_NOTE)
+    numeric = json.loads(
+        openai_utils.get_json_response(
+            client=openai_client,
+            system_message=numeric_prompt.system_message,
+            user_message=numeric_prompt.user_message,
+            response_class=analysis_schema.NumericAnalysis,
+            model=openai_utils.MODEL_TIERS["numeric"],
+            max_tokens=NUMERIC_MAX_TOKENS
+        )
+    )
+    numbers = verify_numbers(openai_client, request, numeric, prompt)
+    return {field: numbers[field] for field in NUMERIC_FIELDS}
+
+async def _generate_numbers_async(openai_client, prompt, request):
+    numeric_prompt = prompt_builder.section_prompt(prompt, system_message.NUMERIC_SECTION_NOTE)
+    numeric = json.loads(
+        await openai_utils.get_json_response_async(
+            client=openai_client,
+            system_message=numeric_prompt.system_message,
+            user_message=numeric_prompt.user_message,
+            response_class=analysis_schema.NumericAnalysis,
+            model=openai_utils.MODEL_TIERS["numeric"],
+            max_tokens=NUMERIC_MAX_TOKENS,
+            hedge=True
+        )
+    )
+    numbers = await verify_numbers_async(openai_client, request, numeric, prompt)
+    return {field: numbers[field] for field in NUMERIC_FIELDS}
+
+def _generate_section(openai_client, prompt, numbers, section):
+    _, response_class, note, max_tokens = section
+    section_prompt = prompt_builder.section_prompt(prompt, note, numbers)
+    return json.loads(
+        openai_utils.get_json_response(
+            client=openai_client,
+            system_message=section_prompt.system_message,
+            user_message=section_prompt.user_message,
+            response_class=response_class,
+            model=openai_utils.MODEL_TIERS["narrative"],
+            max_tokens=max_tokens
+        )
+    )
+
+async def _generate_section_async(openai_client, prompt, numbers, section):
+    _, response_class, note, max_tokens = section
+    section_prompt = prompt_builder.section_prompt(prompt, note, numbers)
+    return json.loads(
+        await openai_utils.get_json_response_async(
+            client=openai_client,
+            system_message=section_prompt.system_message,
+            user_message=section_prompt.user_message,
+            response_class=response_class,
+            model=openai_utils.MODEL_TIERS["narrative"],
+            max_tokens=max_tokens,
+            hedge=True
+        )
+    )
+
+def _generate_split(openai_client, prompt, request):
+    numbers = _generate_numbers(openai_client, prompt, request)
+    # Each worker runs in a copy of this context so the analysis deadline applies.
+    contexts = [contextvars.copy_context() for _ in SECTIONS]
+    with ThreadPoolExecutor(max_workers=len(SECTIONS)) as pool:
+        results = list(pool.map(lambda context, section: context.run(_generate_section, openai_client, prompt, numbers, section), contexts, SECTIONS))
+    return _merge_sections(numbers, {name: result for (name, _, _, _), result in zip(SECTIONS, results)})
+
+async def _generate_split_async(openai_client, prompt, request):
+    numbers = await _generate_numbers_async(openai_client, prompt, request)
+    tasks = [asyncio.create_task(_generate_section_async(openai_client, prompt, numbers, section)) for section in SECTIONS]
+    try:
+        results = await asyncio.gather(*tasks)
+    except BaseException:
+        # One failed section fails the analysis; the others are not waited for.
+        for task in tasks:
+            task.cancel()
+        raise
+    return _merge_sections(numbers, {name: result for (name, _, _, _), result in zip(SECTIONS, results)})
+
+def _generate(openai_client, prompt, request):
+    if ANALYSIS_SPLIT:
+        return _generate_split(openai_client, prompt, request)
+    return _generate_whole(openai_client, prompt, request)
+
+async def _generate_async(openai_client, prompt, request):
+    if ANALYSIS_SPLIT:
+        return await _generate_split_async(openai_client, prompt, request)
+    return await _generate_whole_async(openai_client, prompt, request)
+
+def _generation_tokens(prompt_tokens):
+    # A split analysis sends the prompt once per call, each with its own
+    # completion budget.
+    if not ANALYSIS_SPLIT:
+        return prompt_tokens + openai_utils.DEFAULT_MAX_TOKENS
+    return prompt_tokens * (len(SECTIONS) + 1) + NUMERIC_MAX_TOKENS + sum(max_tokens for _, _, _, max_tokens in SECTIONS)
+
+def estimated_tokens(prompt):
+    # Quota one analysis of `prompt` can use.
+    return _generation_tokens(prompt.tokens())
+
+def estimated_analysis_tokens(request, system_prompt):
+    # Quota one analysis of `request` can use, including its form extractions
+    # when it goes through them. Extractions that end up reused are counted
+    # too, since which ones are is only known once the previous report loads.
+    prompt, entries = prompt_builder.plan(request, system_prompt, ANALYSIS_INCREMENTAL)
+    if entries is None:
+        return estimated_tokens(prompt)
+    extraction_tokens = sum(prompt_builder.extraction_prompt(chunk).tokens() + EXTRACTION_MAX_TOKENS for chunk in prompt_builder.chunk_entries(entries))
+    # The final call sends the forms as they are, or their extractions when
+    # that would not fit.
+    final_tokens = min(prompt_builder.aggregate_prompt(system_prompt, [], entries).tokens(), prompt_builder.PROMPT_MAX_INPUT_TOKENS)
+    return extraction_tokens + _generation_tokens(final_tokens)
+
+def generate_analysis(system_prompt, request, survey_name=None):
+    # Returns (openai_response, incremental); incremental is None when the
+    # survey is sent whole without extracting its forms. With a survey name,
+    # extractions of forms unchanged since its latest report are reused.
+    openai_client = _get_openai_client()
+    prompt, entries = prompt_builder.plan(request, system_prompt, ANALYSIS_INCREMENTAL)
+    if entries is None:
+        return _generate(openai_client, prompt, request), None
+    previous = load_previous_analysis(survey_name) if survey_name else None
+    prompt, reused, changed = plan_incremental(system_prompt, entries, previous)
+    if prompt is None:
+        extracted = extract_forms(openai_client, changed)
+        openai_response = _generate(openai_client, _extracted_prompt(system_prompt, entries, reused, extracted), request)
+    else:
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            extraction = pool.submit(contextvars.copy_context().run, _extract_for_reuse, openai_client, changed)
+            openai_response = _generate(openai_client, prompt, request)
+            extracted = extraction.result()
+    return openai_response, _incremental(entries, previous, reused, changed, extracted)
+
+async def generate_analysis_async(system_prompt, request, survey_name=None):
+    api_key = await keyvault_utils.get_secret_async(keyvault_utils.get_async_client(), "OpenAI")
+    openai_client = openai_utils.get_async_client(api_key=api_key)
+    prompt, entries = prompt_builder.plan(request, system_prompt, ANALYSIS_INCREMENTAL)
+    if entries is None:
+        return await _generate_async(openai_client, prompt, request), None
+    previous = await load_previous_analysis_async(survey_name) if survey_name else None
+    prompt, reused, changed = plan_incremental(system_prompt, entries, previous)
+    if prompt is None:
+        extracted = await extract_forms_async(openai_client, changed)
+        openai_response = await _generate_async(openai_client, _extracted_prompt(system_prompt, entries, reused, extracted), request)
+    else:
+        extraction = asyncio.create_task(_extract_for_reuse_async(openai_client, changed))
+        try:
+            openai_response = await _generate_async(openai_client, prompt, request)
+        except BaseException:
+            extraction.cancel()
+            raise
+        extracted = await extraction
+    return openai_response, _incremental(entries, previous, reused, changed, extracted)
+
+def _analysis_document(request_body, system_prompt, openai_response, incremental=None):
+    document = {
+        "response": openai_response["analysis"],
+        "request": request_body,
+        "persona": system_prompt,
+        "summary": openai_response["summary"]
+    }
+    if incremental is not None:
+        document["extractions"] = incremental["extractions"]
+    return json.dumps(document)
+
+def persist_analysis(survey_name, request_body, system_prompt, openai_response, incremental=None):
+    summary = openai_response["summary"]
+    analysis_json = _analysis_document(request_body, system_prompt, openai_response, incremental)
+    blob_client = blob_utils.get_client()
+    prefix = str(uuid.uuid4())
+    analysis_url = blob_utils.upload_blob(
+        client=blob_client,
+        container_name="analysis",
+        blob_name=f"{prefix}.json",
+        content_type="application/json",
+        data=analysis_json,
+        compress=blob_utils.BLOB_COMPRESS_ARTIFACTS
+    )
+    summary_url = blob_utils.upload_blob(
+        client=blob_client,
+        container_name="summary",
+        blob_name=f"{prefix}.txt",
+        content_type="text/plain",
+        data=summary,
+        compress=blob_utils.BLOB_COMPRESS_ARTIFACTS
+    )
+    response = new_report(survey_name, analysis_url, summary_url, incremental)
+    db_utils.put_report_version(
+        client=db_utils.get_client(),
+        surveyName=survey_name,
+        reportVersion=response["reportVersion"],
+        content=response
+    )
+    return response
+
+async def upload_artifacts_async(request_body, system_prompt, openai_response, incremental=None):
+    analysis_json = _analysis_document(request_body, system_prompt, openai_response, incremental)
+    blob_client = blob_utils.get_async_client()
+    prefix = str(uuid.uuid4())
+    return await asyncio.gather(
+        blob_utils.upload_blob_async(
+            client=blob_client,
+            container_name="analysis",
+            blob_name=f"{prefix}.json",
+            content_type="application/json",
+            data=analysis_json,
+            compress=blob_utils.BLOB_COMPRESS_ARTIFACTS
+        ),
+        blob_utils.upload_blob_async(
+            client=blob_client,
+            container_name="summary",
+            blob_name=f"{prefix}.txt",
+            content_type="text/plain",
+            data=openai_response["summary"],
+            compress=blob_utils.BLOB_COMPRESS_ARTIFACTS
+        )
+    )
+
+def new_report(survey_name, analysis_url, summary_url, incremental=None):
+    report = {
+        "surveyName": survey_name,
+        "reportVersion": datetime.now().isoformat(),
+        "summary": summary_url,
+        "analysis": analysis_url,
+    }
+    if incremental is not None:
+        report["recomputed"] = incremental["recomputed"]
+    return report
+
+async def put_report_async(survey_name, analysis_url, summary_url, incremental=None):
+    response = new_report(survey_name, analysis_url, summary_url, incremental)
+    await db_utils.put_report_version_async(
+        client=db_utils.get_async_client(),
+        surveyName=survey_name,
+        reportVersion=response["reportVersion"],
+        content=response
+    )
+    return response
+
+async def persist_analysis_async(survey_name, request_body, system_prompt, openai_response, incremental=None):
+    analysis_url, summary_url = await upload_artifacts_async(request_body, system_prompt, openai_response, incremental)
+    return await put_report_async(survey_name, analysis_url, summary_url, incremental)
+
+def cache_key(request, system_prompt, split=None):
+    # `split` is whether the analysis is generated split, ANALYSIS_SPLIT unless
+    # the caller always generates it one way.
+    prompt_format = prompt_builder.PROMPT_FORMAT
+    if ANALYSIS_INCREMENTAL:
+        prompt_format += ":incremental"
+    if ANALYSIS_SPLIT if split is None else split:
+        prompt_format += ":split"
+    return analysis_cache.make_key(
+        request=request,
+        system_prompt=system_prompt,
+        model=openai_utils.MODEL_TIERS,
+        max_tokens=openai_utils.DEFAULT_MAX_TOKENS,
+        temperature=openai_utils.DEFAULT_TEMPERATURE,
+        top_p=openai_utils.DEFAULT_TOP_P,
+        prompt_format=prompt_format
+    )
+
+def _reuse_from(survey_name, cache_mode):
+    # A refresh recomputes every form instead of reusing previous extractions.
+    return None if cache_mode == analysis_cache.CACHE_MODE_REFRESH else survey_name
+
+def _run_analysis(survey_name, request, request_body, system_prompt, cache_mode=None):
+    def compute():
+        openai_response, incremental = generate_analysis(system_prompt, request, _reuse_from(survey_name, cache_mode))
+        report = persist_analysis(survey_name, request_body, system_prompt, openai_response, incremental)
+        return {"response": openai_response, "incremental": incremental, "reports": {survey_name: report}}
+
+    if cache_mode == analysis_cache.CACHE_MODE_BYPASS:
+        return compute()["reports"][survey_name]
+    key = cache_key(request, system_prompt)
+    if cache_mode == analysis_cache.CACHE_MODE_REFRESH:
+        analysis_cache.cache.invalidate(key)
+    entry = analysis_cache.cache.get_or_compute(key, compute)
+    report = entry["reports"].get(survey_name)
+    if report is None:
+        # Same forms analysed under another survey name: reuse the model output
+        # but give this survey its own artifacts and report version.
+        report = persist_analysis(survey_name, request_body, system_prompt, entry["response"], reused_incremental(entry.get("incremental")))
+        analysis_cache.cache.put(key, {**entry, "reports": {**entry["reports"], survey_name: report}})
+    return report
+
+def run_analysis(survey_name, request, request_body, system_prompt, cache_mode=None):
+    with retry.deadline(ANALYSIS_DEADLINE_SECONDS):
+        return _run_analysis(survey_name, request, request_body, system_prompt, cache_mode)
+
+async def _run_analysis_async(survey_name, request, request_body, system_prompt, cache_mode=None):
+    async def compute():
+        openai_response, incremental = await generate_analysis_async(system_prompt, request, _reuse_from(survey_name, cache_mode))
+        report = await persist_analysis_async(survey_name, request_body, system_prompt, openai_response, incremental)
+        return {"response": openai_response, "incremental": incremental, "reports": {survey_name: report}}
+
+    if cache_mode == analysis_cache.CACHE_MODE_BYPASS:
+        return (await compute())["reports"][survey_name]
+    key = cache_key(request, system_prompt)
+    if cache_mode == analysis_cache.CACHE_MODE_REFRESH:
+        await asyncio.to_thread(analysis_cache.cache.invalidate, key)
+    entry = await analysis_cache.cache.get_or_compute_async(key, compute)
+    report = entry["reports"].get(survey_name)
+    if report is None:
+        report = await persist_analysis_async(survey_name, request_body, system_prompt, entry["response"], reused_incremental(entry.get("incremental")))
+        await asyncio.to_thread(analysis_cache.cache.put, key, {**entry, "reports": {**entry["reports"], survey_name: report}})
+    return report
+
+async def run_analysis_async(survey_name, request, request_body, system_prompt, cache_mode=None):
+    with retry.deadline(ANALYSIS_DEADLINE_SECONDS):
+        return await _run_analysis_async(survey_name, request, request_body, system_prompt, cache_mode)
+
+def _completed_items(partial_items, sent, complete):
+    # The last item of a partial list may still be growing, so it is only
+    # released once the model has moved on to the next item or field.
+    items = partial_items or []
+    ready = len(items) if complete else max(len(items) - 1, 0)
+    return [(i, items[i]) for i in range(sent, ready)]
+
+def _cached_events(openai_response):
+    analysis = openai_response["analysis"]
+    for index, item in enumerate(analysis["insights"]):
+        yield "insight", {"index": index, **item}
+    for index, item in enumerate(analysis["recommendations"]):
+        yield "recommendation", {"index": index, **item}
+    yield "summary", {"delta": openai_response["summary"]}
+    yield "roi", {"total_costs": analysis["total_costs"], "total_benefits": analysis["total_benefits"], "roi": analysis["roi"]}
+
+async def stream_analysis_async(survey_name, request, request_body, system_prompt, cache_mode=None):
+    # Yields (event, data) pairs: summary deltas and each insight/recommendation
+    # as soon as the model produces them, stage markers for the post-processing
+    # steps, and finally the same report payload the non-streaming route returns.
+    # When the ROI check rewrites the summary, a summary event with "replace"
+    # holds the whole corrected text that supersedes the deltas sent so far.
+    key = None
+    if cache_mode != analysis_cache.CACHE_MODE_BYPASS:
+        # Streamed analyses are always generated in one call.
+        key = cache_key(request, system_prompt, split=False)
+        if cache_mode == analysis_cache.CACHE_MODE_REFRESH:
+            await asyncio.to_thread(analysis_cache.cache.invalidate, key)
+        entry = await asyncio.to_thread(analysis_cache.cache.get, key)
+        if entry is not None:
+            yield "stage", {"stage": "cache_hit"}
+            for event in _cached_events(entry["response"]):
+                yield event
+            report = entry["reports"].get(survey_name)
+            if report is None:
+                # As in the non-streaming route, the same forms analysed under
+                # another survey name get their own artifacts and report version.
+                incremental = reused_incremental(entry.get("incremental"))
+                with retry.deadline(ANALYSIS_DEADLINE_SECONDS):
+                    yield "stage", {"stage": "blob_upload"}
+                    analysis_url, summary_url = await upload_artifacts_async(request_body, system_prompt, entry["response"], incremental)
+                    yield "stage", {"stage": "report_versioning"}
+                    report = await put_report_async(survey_name, analysis_url, summary_url, incremental)
+                await asyncio.to_thread(analysis_cache.cache.put, key, {**entry, "reports": {**entry["reports"], survey_name: report}})
+            yield "result", report
+            return
+
+    # The same deadline as the other analysis routes. Extraction for reuse runs
+    # alongside the stream and is stopped with it, whether it fails or the
+    # client goes away.
+    extraction = None
+    try:
+        with retry.deadline(ANALYSIS_DEADLINE_SECONDS):
+            api_key = await keyvault_utils.get_secret_async(keyvault_utils.get_async_client(), "OpenAI")
+            openai_client = openai_utils.get_async_client(api_key=api_key)
+            prompt, entries = prompt_builder.plan(request, system_prompt, ANALYSIS_INCREMENTAL)
+            incremental = None
+            if entries is not None:
+                reuse_from = _reuse_from(survey_name, cache_mode)
+                previous = await load_previous_analysis_async(reuse_from) if reuse_from else None
+                prompt, reused, changed = plan_incremental(system_prompt, entries, previous)
+                if prompt is None:
+                    yield "stage", {"stage": "extraction", "forms": len(changed)}
+                    extracted = await extract_forms_async(openai_client, changed)
+                    prompt = _extracted_prompt(system_prompt, entries, reused, extracted)
+                else:
+                    extraction = asyncio.create_task(_extract_for_reuse_async(openai_client, changed))
+            yield "stage", {"stage": "generation"}
+            sent = {"insights": 0, "recommendations": 0, "summary": 0}
+            content = None
+            async for kind, payload in openai_utils.stream_json_response_async(
+                client=openai_client,
+                system_message=prompt.system_message,
+                user_message=prompt.user_message,
+                response_class=analysis_schema.Response,
+                model=openai_utils.MODEL_TIERS["analysis"]
+            ):
+                final = kind == "final"
+                partial = json.loads(payload) if final else payload
+                if final:
+                    content = payload
+                analysis = partial.get("analysis") or {}
+                # Structured output follows the schema's field order, so a later field
+                # appearing means the list before it is complete.
+                lists = (
+                    ("insights", "insight", final or "recommendations" in analysis or "summary" in partial),
+                    ("recommendations", "recommendation", final or "summary" in partial),
+                )
+                for field, event, complete in lists:
+                    for index, item in _completed_items(analysis.get(field), sent[field], complete):
+                        sent[field] = index + 1
+                        yield event, {"index": index, **item}
+                summary = partial.get("summary") or ""
+                if len(summary) > sent["summary"]:
+                    yield "summary", {"delta": summary[sent["summary"]:]}
+                    sent["summary"] = len(summary)
+
+            yield "stage", {"stage": "validation"}
+            openai_response = analysis_schema.Response.model_validate_json(content).model_dump(mode="json")
+            yield "stage", {"stage": "roi_check"}
+            streamed_summary = openai_response["summary"]
+            await verify_analysis_async(openai_client, request, openai_response, prompt)
+            if openai_response["summary"] != streamed_summary:
+                yield "summary", {"replace": openai_response["summary"]}
+            numbers = openai_response["analysis"]
+            yield "roi", {"total_costs": numbers["total_costs"], "total_benefits": numbers["total_benefits"], "roi": numbers["roi"]}
+            if entries is not None:
+                if extraction is not None:
+                    extracted = await extraction
+                incremental = _incremental(entries, previous, reused, changed, extracted)
+            yield "stage", {"stage": "blob_upload"}
+            analysis_url, summary_url = await upload_artifacts_async(request_body, system_prompt, openai_response, incremental)
+            yield "stage", {"stage": "report_versioning"}
+            report = await put_report_async(survey_name, analysis_url, summary_url, incremental)
+            if key is not None:
+                await asyncio.to_thread(analysis_cache.cache.put, key, {"response": openai_response, "incremental": incremental, "reports": {survey_name: report}})
+            yield "result", report
+    finally:
+        if extraction is not None and not extraction.done():
+            extraction.cancel()
+            await asyncio.gather(extraction, return_exceptions=True)
@@ -29,6 +29,39 @@ class Analysis(BaseModel):
     insights: list[Insight]
     recommendations: list[Recommendation]
 
+class NumericAnalysis(BaseModel):
+    total_costs: TotalCosts
+    total_benefits: TotalBenefits
+    roi: Roi
+
+# One section each of a split analysis; merged back into a Response.
+class Insights(BaseModel):
+    insights: list[Insight]
+
+class Recommendations(BaseModel):
+    recommendations: list[Recommendation]
+
+class Summary(BaseModel):
+    summary: str
+
+# The ROI explanation and summary rewritten around a recalculated ROI.
+class RoiCorrection(BaseModel):
+    roi: Roi
+    summary: str
+
+class LineItem(BaseModel):
+    title: str
+    amount: float
+
+class FormExtraction(BaseModel):
+    form: int
+    costs: list[LineItem]
+    benefits: list[LineItem]
+    observations: list[str]
+
+class Extraction(BaseModel):
+    forms: list[FormExtraction]
+
 class Response(BaseModel):
     analysis: Analysis
     summary: str
@@ -0,0 +1,183 @@
+import asyncio
+import json
+import os
+import time
+import pydantic
+import analysis_cache
+import analysis_pipeline
+import analysis_schema
+import db_utils
+import log_utils
+import retry
+
+BATCH_MAX_ITEMS = int(os.environ.get("BATCH_MAX_ITEMS", "100"))
+BATCH_DEFAULT_CONCURRENCY = int(os.environ.get("BATCH_DEFAULT_CONCURRENCY", "4"))
+BATCH_MAX_CONCURRENCY = int(os.environ.get("BATCH_MAX_CONCURRENCY", "16"))
+# Report versions are written in bulk once this many are pending, or once the
+# oldest pending one has waited BATCH_WRITE_INTERVAL_SECONDS.
+BATCH_WRITE_SIZE = int(os.environ.get("BATCH_WRITE_SIZE", "25"))
+BATCH_WRITE_INTERVAL_SECONDS = float(os.environ.get("BATCH_WRITE_INTERVAL_SECONDS", "1"))
+
+def survey_to_request_body(survey):
+    # Saved surveys hold the frontend's {questionId: answer} responses; the
+    # question labels and sections live in the frontend, so the id stands in
+    # for both. Surveys saved with analysis forms are used as they are.
+    if "forms" in survey:
+        return {"forms": survey["forms"]}
+    forms = []
+    for question_id, answer in (survey.get("responses") or {}).items():
+        if answer is None or answer == "":
+            continue
+        forms.append({
+            "category": "Survey Responses",
+            "title": question_id,
+            "description": question_id.replace("_", " "),
+            "contents": str(answer)
+        })
+    return {"forms": forms}
+
+def _result(survey_name, report=None, error=None, cached=False):
+    return {
+        "surveyName": survey_name,
+        "status": "error" if error else "ok",
+        "cached": cached,
+        "report": report,
+        "error": error
+    }
+
+class _TokenBudget:
+    def __init__(self, limit):
+        self._remaining = limit
+
+    def reserve(self, tokens):
+        if self._remaining is None:
+            return True
+        if tokens > self._remaining:
+            return False
+        self._remaining -= tokens
+        return True
+
+async def _analyse(item, system_prompt, semaphore, budget):
+    survey_name = item["surveyName"]
+    async with semaphore:
+        request_body = item.get("request")
+        if request_body is None:
+            survey = await db_utils.get_survey_async(db_utils.get_async_client(), survey_name)
+            if not survey:
+                return _result(survey_name, error="Survey not found."), None
+            request_body = survey_to_request_body(survey)
+        request_json = json.dumps(request_body)
+        try:
+            request = analysis_schema.Request.model_validate_json(request_json)
+        except pydantic.ValidationError as e:
+            return _result(survey_name, error=f"Request does not follow expected schema: {repr(e)}"), None
+        key = analysis_pipeline.cache_key(request, system_prompt)
+        entry = await asyncio.to_thread(analysis_cache.cache.get, key)
+        if entry is not None and survey_name in entry["reports"]:
+            return _result(survey_name, report=entry["reports"][survey_name], cached=True), None
+        estimated_tokens = analysis_pipeline.estimated_analysis_tokens(request, system_prompt)
+        if not budget.reserve(estimated_tokens):
+            return _result(survey_name, error="Token budget exhausted."), None
+        if entry:
+            openai_response, incremental = entry["response"], analysis_pipeline.reused_incremental(entry.get("incremental"))
+        else:
+            openai_response, incremental = await analysis_pipeline.generate_analysis_async(system_prompt, request, survey_name)
+        analysis_url, summary_url = await analysis_pipeline.upload_artifacts_async(request_body, system_prompt, openai_response, incremental)
+        report = analysis_pipeline.new_report(survey_name, analysis_url, summary_url, incremental)
+        return None, (key, openai_response, incremental, report)
+
+async def _analyse_safely(item, system_prompt, semaphore, budget):
+    try:
+        with retry.deadline(analysis_pipeline.ANALYSIS_DEADLINE_SECONDS):
+            return await _analyse(item, system_prompt, semaphore, budget)
+    except Exception as e:
+        log_utils.error("POST survey analysis batch item error", survey=item["surveyName"], error=e)
+        return _result(item["surveyName"], error=repr(e)), None
+
+async def _flush(pending):
+    reports = [(report["surveyName"], report["reportVersion"], report) for _, _, _, report in pending]
+    try:
+        await db_utils.put_report_versions_async(db_utils.get_async_client(), reports)
+    except Exception as e:
+        log_utils.error("POST survey analysis batch report write error", reports=len(reports), error=e)
+        return [_result(report["surveyName"], error=repr(e)) for _, _, _, report in pending]
+    for key, openai_response, incremental, report in pending:
+        await asyncio.to_thread(analysis_cache.cache.put, key, {"response": openai_response, "incremental": incremental, "reports": {report["surveyName"]: report}})
+    return [_result(report["surveyName"], report=report) for _, _, _, report in pending]
+
+async def run_batch_async(items, system_prompt, max_concurrency=BATCH_DEFAULT_CONCURRENCY, token_budget=None):
+    # Yields one result per item as it finishes. Analyses run under a bounded
+    # semaphore; their report versions are buffered and written in bulk.
+    semaphore = asyncio.Semaphore(max_concurrency)
+    budget = _TokenBudget(token_budget)
+    tasks = {asyncio.create_task(_analyse_safely(item, system_prompt, semaphore, budget)) for item in items}
+    done = set()
+    pending = []
+    oldest_pending = None
+    try:
+        while tasks or pending:
+            if tasks:
+                done, tasks = await asyncio.wait(tasks, timeout=BATCH_WRITE_INTERVAL_SECONDS, return_when=asyncio.FIRST_COMPLETED)
+            while done:
+                result, write = done.pop().result()
+                if result is not None:
+                    yield result
+                else:
+                    pending.append(write)
+                    oldest_pending = oldest_pending or time.monotonic()
+            flush_due = oldest_pending is not None and time.monotonic() - oldest_pending >= BATCH_WRITE_INTERVAL_SECONDS
+            if pending and (not tasks or len(pending) >= BATCH_WRITE_SIZE or flush_due):
+                results = await _flush(pending)
+                pending = []
+                oldest_pending = None
+                for result in results:
+                    yield result
+    finally:
+        # Reached early when the consumer goes away or a write fails: the
+        # analyses still running are stopped so they spend no more quota, and
+        # the finished ones get their report versions written, since their
+        # artifacts are already uploaded.
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        pending += [write for _, write in (task.result() for task in done if not task.cancelled()) if write is not None]
+        if tasks or pending:
+            log_utils.warning("POST survey analysis batch stopped early", cancelled=len(tasks), written=len(pending))
+        if pending:
+            await _flush(pending)
+
+def _survey_names(body):
+    # Returns (names, error) for the optional surveyNames list.
+    names = body.get("surveyNames")
+    if names is None:
+        return [], None
+    if not isinstance(names, list) or not names:
+        return None, "Malformed request, surveyNames must be a non-empty list of survey names."
+    if not all(isinstance(name, str) and name for name in names):
+        return None, "Malformed request, every entry in surveyNames must be a non-empty string."
+    return names, None
+
+def parse_batch_request(body):
+    # Returns (items, error); items are {"surveyName", "request"} with request
+    # None when the survey has to be loaded from Cosmos.
+    if not isinstance(body, dict):
+        return None, "Malformed request, request body must be a JSON object."
+    names, error = _survey_names(body)
+    if error:
+        return None, error
+    items = [{"surveyName": name, "request": None} for name in names]
+    requests = body.get("requests") or []
+    if not isinstance(requests, list):
+        return None, "Malformed request, requests must be a list."
+    for entry in requests:
+        if not isinstance(entry, dict) or not isinstance(entry.get("surveyName"), str) or not entry["surveyName"]:
+            return None, "Malformed request, every entry in requests needs a surveyName."
+        items.append({"surveyName": entry["surveyName"], "request": {"forms": entry.get("forms")}})
+    if not items:
+        return None, "Malformed request, provide surveyNames or requests."
+    if len(items) > BATCH_MAX_ITEMS:
+        return None, f"Malformed request, at most {BATCH_MAX_ITEMS} surveys per batch."
+    names = [item["surveyName"] for item in items]
+    if len(set(names)) != len(names):
+        return None, "Malformed request, survey names in a batch must be unique."
+    return items, None
@@ -0,0 +1,70 @@
+# Compares the sync and async analysis pipelines against in-memory fakes.
+# Run from the api folder: python -m benchmarks.bench_async_analysis
+import argparse
+import asyncio
+import json
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+import analysis_cache
+import analysis_pipeline
+import analysis_schema
+import system_message
+from benchmarks import fakes
+
+REQUEST_BODY = {"forms": [{"category": "Initial Investment Assessment", "title": "upfront_cost", "description": "What is the expected upfront cost?", "contents": "$100,000"}]}
+
+def _args():
+    request_json = json.dumps(REQUEST_BODY)
+    return dict(
+        survey_name="benchmark",
+        request=analysis_schema.Request.model_validate_json(request_json),
+        request_body=REQUEST_BODY,
+        system_prompt=system_message.ROI_EXPERT_SYSTEM_MESSAGE,
+        cache_mode=analysis_cache.CACHE_MODE_BYPASS
+    )
+
+def bench_sync(requests, workers):
+    latencies = []
+    def one(_):
+        start = time.perf_counter()
+        analysis_pipeline.run_analysis(**_args())
+        latencies.append(time.perf_counter() - start)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(one, range(requests)))
+    return latencies, time.perf_counter() - start
+
+async def bench_async(requests, concurrent):
+    latencies = []
+    async def one():
+        start = time.perf_counter()
+        await analysis_pipeline.run_analysis_async(**_args())
+        latencies.append(time.perf_counter() - start)
+    start = time.perf_counter()
+    if concurrent:
+        await asyncio.gather(*(one() for _ in range(requests)))
+    else:
+        for _ in range(requests):
+            await one()
+    return latencies, time.perf_counter() - start
+
+def _report(name, latencies, elapsed):
+    print(f"{name:<28} mean={statistics.mean(latencies) * 1000:8.1f}ms  throughput={len(latencies) / elapsed:7.1f} req/s")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--llm-ms", type=float, default=200)
+    parser.add_argument("--blob-ms", type=float, default=40)
+    parser.add_argument("--cosmos-ms", type=float, default=20)
+    args = parser.parse_args()
+    fakes.install(llm_latency=args.llm_ms / 1000, blob_latency=args.blob_ms / 1000, cosmos_latency=args.cosmos_ms / 1000)
+    # A sync function worker runs one invocation per thread; an async worker
+    # interleaves invocations on its event loop.
+    _report("sync, 1 worker thread", *bench_sync(args.requests, workers=1))
+    _report("async, sequential", *asyncio.run(bench_async(args.requests, concurrent=False)))
+    _report("async, concurrent", *asyncio.run(bench_async(args.requests, concurrent=True)))
+
+if __name__ == "__main__":
+    main()
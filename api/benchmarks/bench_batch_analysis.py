@@ -0,0 +1,42 @@
+# Measures batch analysis throughput against in-memory fakes as the
+# concurrency limit grows. Run from the api folder:
+#   python -m benchmarks.bench_batch_analysis
+import argparse
+import asyncio
+import time
+import analysis_cache
+import batch_analysis
+import db_utils
+import system_message
+from benchmarks import fakes
+
+def _seed_surveys(installed, count):
+    container = installed["cosmos-aio"].containers.setdefault(db_utils.SURVEY_CONTAINER_NAME, {})
+    for i in range(count):
+        name = f"survey-{i}"
+        # Distinct answers so every survey misses the analysis cache.
+        container[name] = {"id": name, db_utils.DATA_KEY: {"name": name, "responses": {"upfront_cost": f"${10000 + i}"}}}
+
+async def _run(count, concurrency):
+    items = [{"surveyName": f"survey-{i}", "request": None} for i in range(count)]
+    start = time.perf_counter()
+    results = [r async for r in batch_analysis.run_batch_async(items, system_message.ROI_EXPERT_SYSTEM_MESSAGE, max_concurrency=concurrency)]
+    elapsed = time.perf_counter() - start
+    errors = sum(1 for r in results if r["status"] != "ok")
+    return elapsed, errors
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--surveys", type=int, default=32)
+    parser.add_argument("--llm-ms", type=float, default=200)
+    args = parser.parse_args()
+    installed = fakes.install(llm_latency=args.llm_ms / 1000, blob_latency=0.04, cosmos_latency=0.02)
+    _seed_surveys(installed, args.surveys)
+    for concurrency in (1, 2, 4, 8, 16):
+        # A cold cache for each run.
+        analysis_cache.cache = analysis_cache.AnalysisCache(analysis_cache.MemoryBackend())
+        elapsed, errors = asyncio.run(_run(args.surveys, concurrency))
+        print(f"concurrency={concurrency:<3} elapsed={elapsed:6.2f}s  throughput={args.surveys / elapsed:6.1f} surveys/s  errors={errors}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+# Measures cold start: how long importing function_app takes, and how long
+# each route's first request takes in a fresh process, against in-memory fakes
+# with no latency, so only imports, client construction and first-use work
+# are timed. Each route runs in its own process, restored from data seeded
+# once. Run from the api folder:
+#   python -m benchmarks.bench_cold_start             # every route, without and after warm-up
+#   python -m benchmarks.bench_cold_start --profile   # import-time profile of function_app
+import argparse
+import asyncio
+import json
+import os
+import pickle
+import subprocess
+import sys
+import tempfile
+import time
+
+API_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# The fakes have no tokens to hand out.
+CHILD_ENV = {"WARMUP_TOKEN_SCOPES": ""}
+
+def _profile(module, top):
+    # python -X importtime reports each import's own and cumulative
+    # microseconds; the largest cumulative entries are the ones to defer.
+    completed = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], cwd=API_DIR, capture_output=True, text=True, check=True)
+    rows = []
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        own, cumulative, name = (part.strip() for part in line[len("import time:"):].split("|"))
+        rows.append((int(cumulative), int(own), name))
+    rows.sort(reverse=True)
+    print(f"{'cumulative ms':>14} {'self ms':>8}  module")
+    for cumulative, own, name in rows[:top]:
+        print(f"{cumulative / 1000:14.1f} {own / 1000:8.1f}  {name}")
+
+def _seed(path):
+    from benchmarks import fakes, loadgen
+    installed = fakes.install()
+    state = asyncio.run(loadgen._seed(loadgen.DEFAULT_SETTINGS["forms"]))
+    with open(path, "wb") as f:
+        pickle.dump({"containers": installed["cosmos"].containers, "blobs": installed["blob"].blobs, "state": state}, f)
+    return [scenario.name for scenario in loadgen._scenarios(state, loadgen.DEFAULT_SETTINGS["forms"])]
+
+def _child(path, route, warm):
+    started = time.perf_counter()
+    import function_app
+    import_seconds = time.perf_counter() - started
+    from benchmarks import fakes, loadgen
+    with open(path, "rb") as f:
+        snapshot = pickle.load(f)
+    fakes.install(containers=snapshot["containers"], blobs=snapshot["blobs"])
+    scenario = next(s for s in loadgen._scenarios(snapshot["state"], loadgen.DEFAULT_SETTINGS["forms"]) if s.name == route)
+    queue = loadgen._configure_jobs()
+
+    async def timed(i):
+        # Building the request is timed too: the import route's body is built
+        # with survey_transfer, which the route would otherwise load.
+        started = time.perf_counter()
+        status, _ = await loadgen._invoke(scenario.handler, scenario.build(i))
+        return time.perf_counter() - started, status
+
+    async def run():
+        warm_up_seconds = None
+        if warm:
+            started = time.perf_counter()
+            await function_app.get_warm_up._function.get_user_function()(None)
+            warm_up_seconds = time.perf_counter() - started
+        first, status = await timed(0)
+        second, _ = await timed(1)
+        return {"import": import_seconds, "warmUp": warm_up_seconds, "first": first, "second": second, "status": status}
+
+    result = asyncio.run(run())
+    queue.shutdown()
+    print(json.dumps(result))
+
+def _run_child(path, route, warm):
+    command = [sys.executable, "-m", "benchmarks.bench_cold_start", "--child", path, "--routes", route] + (["--warm"] if warm else [])
+    completed = subprocess.run(command, cwd=API_DIR, capture_output=True, text=True, env={**os.environ, **CHILD_ENV})
+    if completed.returncode != 0:
+        raise RuntimeError(f"{route} failed: {completed.stderr[-2000:]}")
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--profile", action="store_true")
+    parser.add_argument("--module", default="function_app", help="Module to profile.")
+    parser.add_argument("--top", type=int, default=25)
+    parser.add_argument("--routes", nargs="+", help="Only measure these routes.")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    parser.add_argument("--warm", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        _child(args.child, args.routes[0], args.warm)
+        return
+    if args.profile:
+        _profile(args.module, args.top)
+        return
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "seed.pickle")
+        routes = [route for route in _seed(path) if not args.routes or route in args.routes]
+        print(f"{'route':34} {'status':>6} {'import ms':>10} {'first ms':>9} {'second ms':>10}   {'warm-up ms':>10} {'first after warm-up ms':>23}")
+        for route in routes:
+            cold = _run_child(path, route, warm=False)
+            warm = _run_child(path, route, warm=True)
+            print(
+                f"{route:34} {cold['status']:6d} {cold['import'] * 1000:10.1f} {cold['first'] * 1000:9.1f} {cold['second'] * 1000:10.1f}"
+                f"   {warm['warmUp'] * 1000:10.1f} {warm['first'] * 1000:23.1f}"
+            )
+
+if __name__ == "__main__":
+    main()
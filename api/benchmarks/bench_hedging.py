@@ -0,0 +1,85 @@
+# Compares the analysis call with no per-call timeout, with a timeout and
+# retries, and hedged, against a fake OpenAI whose latency has a long tail.
+# Reports the latency percentiles, OpenAI calls per analysis and how often
+# the hedge was sent and won. Run from the api folder:
+#   python -m benchmarks.bench_hedging
+#   python -m benchmarks.bench_hedging --llm-ms 200:4000 --requests 1000
+import argparse
+import asyncio
+import statistics
+import time
+import analysis_schema
+import openai_utils
+import system_message
+from benchmarks import fakes
+
+USER_MESSAGE = '{"forms":[{"category":"Initial Investment Assessment","title":"upfront_cost","contents":"$100,000"}]}'
+
+def _percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+async def _run(requests, concurrency, hedge):
+    client = openai_utils.get_async_client(fakes.FAKE_API_KEY)
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    errors = []
+
+    async def one():
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                await openai_utils.get_json_response_async(
+                    client=client,
+                    system_message=system_message.ROI_EXPERT_SYSTEM_MESSAGE,
+                    user_message=USER_MESSAGE,
+                    response_class=analysis_schema.Response,
+                    hedge=hedge
+                )
+            except Exception as e:
+                # A tight timeout can exhaust the retries.
+                errors.append(e)
+            latencies.append(time.perf_counter() - started)
+
+    await asyncio.gather(*(one() for _ in range(requests)))
+    return latencies, errors
+
+def _mode(name, args, timeout, hedge):
+    installed = fakes.install(llm_latency=fakes.Latency.parse(args.llm_ms), seed=args.seed)
+    openai_utils.OPENAI_TIMEOUT_SECONDS = timeout
+    openai_utils._hedges.clear()
+    started = time.perf_counter()
+    latencies, errors = asyncio.run(_run(args.requests, args.concurrency, hedge))
+    elapsed = time.perf_counter() - started
+    calls = fakes.call_counts()["openai"]
+    print(
+        f"{name:<26} p50={_percentile(latencies, 0.5) * 1000:7.0f}ms p95={_percentile(latencies, 0.95) * 1000:7.0f}ms"
+        f" p99={_percentile(latencies, 0.99) * 1000:7.0f}ms max={max(latencies) * 1000:7.0f}ms"
+        f" mean={statistics.mean(latencies) * 1000:6.0f}ms errors={len(errors)} calls/req={calls / args.requests:.3f}"
+        f" wall={elapsed:.1f}s models={dict(installed['openai-aio:' + fakes.key_digest(fakes.FAKE_API_KEY)].models)}"
+    )
+    for stats in openai_utils.hedge_stats():
+        print(f"{'':<26} hedge {stats['name']}: delay={stats['delaySeconds'] * 1000:.0f}ms {stats['outcomes']} hedge rate={stats['hedgeRate']:.1%} hedge win rate={stats['hedgeWinRate']:.1%}")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=600)
+    parser.add_argument("--concurrency", type=int, default=40)
+    parser.add_argument("--llm-ms", default="200:3000", help="Median or median:p99 latency of one OpenAI call, in ms.")
+    parser.add_argument("--timeout-seconds", type=float, default=1.0, help="Per-call timeout for the timeout mode.")
+    parser.add_argument("--hedge-model", default="", help="Send hedges to this model instead of the same one.")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    # Scaled to the fake's latencies; the defaults suit real gpt-4o calls.
+    openai_utils.OPENAI_HEDGE_INITIAL_DELAY_SECONDS = 1.0
+    openai_utils.OPENAI_HEDGE_MIN_DELAY_SECONDS = 0.05
+    openai_utils.OPENAI_HEDGE_MODEL = args.hedge_model
+    # Injected timeouts are retried after a short backoff, as in production.
+    openai_utils.OPENAI_RETRY_POLICY.base_delay = 0.05
+    _mode("no per-call timeout", args, timeout=0, hedge=False)
+    _mode(f"{args.timeout_seconds:g}s timeout, retried", args, timeout=args.timeout_seconds, hedge=False)
+    _mode("hedged at p95", args, timeout=0, hedge=True)
+    _mode(f"hedged, {args.timeout_seconds:g}s timeout", args, timeout=args.timeout_seconds, hedge=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+# Re-analyses a survey after editing some of its forms, with incremental
+# analysis (unchanged forms are sent as their stored extractions), with a
+# refresh (nothing is reused) and with ANALYSIS_INCREMENTAL off (the whole
+# survey in one call). Each mode keeps its own survey so their report chains
+# do not mix. The fake model's latency grows with prompt and completion tokens.
+# Run from the api folder: python -m benchmarks.bench_incremental
+import argparse
+import asyncio
+import time
+import analysis_cache
+import analysis_pipeline
+import analysis_schema
+import openai_utils
+import system_message
+from benchmarks import bench_prompt, fakes
+
+SURVEY_NAME = "benchmark"
+
+def _edit(request_body, count, round_number):
+    forms = [dict(form) for form in request_body["forms"]]
+    for form in forms[:count]:
+        form["contents"] = f"${2000 + round_number * 10:,} per year, revised in round {round_number}"
+    return {"forms": forms}
+
+async def _analyse(client, survey_name, request_body, cache_mode):
+    client.prompt_tokens.clear()
+    start = time.perf_counter()
+    report = await analysis_pipeline.run_analysis_async(
+        survey_name=survey_name,
+        request=analysis_schema.Request.model_validate(request_body),
+        request_body=request_body,
+        system_prompt=system_message.ROI_EXPERT_SYSTEM_MESSAGE,
+        cache_mode=cache_mode
+    )
+    return time.perf_counter() - start, sum(client.prompt_tokens), report.get("recomputed")
+
+def _report(name, elapsed, tokens, recomputed):
+    extracted = f"  {len(recomputed['recomputedForms'])} forms sent raw, {recomputed['reusedForms']} reused" if recomputed else ""
+    print(f"  {name:<16} {elapsed:6.2f}s  {tokens:7d} prompt tokens{extracted}")
+
+async def _run(forms, edits):
+    client = openai_utils.get_async_client(api_key=fakes.FAKE_API_KEY)
+    request_body = bench_prompt._request_body(forms)
+    print(f"first analysis of {forms} forms")
+    _report("incremental", *await _analyse(client, f"{SURVEY_NAME}-incremental", request_body, analysis_cache.CACHE_MODE_BYPASS))
+    for round_number, count in enumerate(edits, start=1):
+        request_body = _edit(request_body, count, round_number)
+        print(f"{count} forms edited")
+        _report("incremental", *await _analyse(client, f"{SURVEY_NAME}-incremental", request_body, analysis_cache.CACHE_MODE_BYPASS))
+        _report("refresh", *await _analyse(client, f"{SURVEY_NAME}-refresh", request_body, analysis_cache.CACHE_MODE_REFRESH))
+        analysis_pipeline.ANALYSIS_INCREMENTAL = False
+        _report("single call", *await _analyse(client, f"{SURVEY_NAME}-single", request_body, analysis_cache.CACHE_MODE_BYPASS))
+        analysis_pipeline.ANALYSIS_INCREMENTAL = True
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--forms", type=int, default=60)
+    parser.add_argument("--edits", type=int, nargs="+", default=[1, 5, 20])
+    parser.add_argument("--llm-ms", type=float, default=300)
+    parser.add_argument("--input-us-per-token", type=float, default=20)
+    parser.add_argument("--output-ms-per-token", type=float, default=15)
+    args = parser.parse_args()
+    fakes.install(
+        llm_latency=args.llm_ms / 1000,
+        llm_input_token_latency=args.input_us_per_token / 1e6,
+        llm_output_token_latency=args.output_ms_per_token / 1000
+    )
+    analysis_pipeline.ANALYSIS_INCREMENTAL = True
+    asyncio.run(_run(args.forms, args.edits))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+# Compares the routes' old eager f-string logging of whole bodies with
+# log_utils records (lazy, payloads capped and hashed, verbose records sampled
+# per request, console output behind a queue) for what each request logs:
+# a survey for GET survey, and the OpenAI response and report for an analysis.
+# Reports CPU per request on the request's thread and in the whole process,
+# and bytes written. Run from the api folder: python -m benchmarks.bench_logging
+import argparse
+import io
+import json
+import logging
+import time
+import log_utils
+import tracing
+from benchmarks import bench_split_generation
+
+class _CountingStream(io.TextIOBase):
+    # Stands in for the console: counts what would have been written.
+    def __init__(self):
+        self.bytes = 0
+
+    def write(self, text):
+        self.bytes += len(text.encode("utf-8"))
+        return len(text)
+
+def _survey(forms):
+    return {"name": "benchmark", "responses": {f"question_{i}": f"Answer {i}: the team expects a cost of ${1000 * i} and weekly check-ins with the sponsor." for i in range(forms)}}
+
+def _report():
+    return {"surveyName": "benchmark", "reportVersion": "2025-01-01T00:00:00.000000", "analysisUrl": "https://example.blob.core.windows.net/analysis/00000000-0000-0000-0000-000000000000.json", "summaryUrl": "https://example.blob.core.windows.net/summary/00000000-0000-0000-0000-000000000000.txt"}
+
+def _eager(route, survey, response, report):
+    # The statements the routes and pipeline had before log_utils.
+    if route == "get_survey":
+        logging.info(f"GET survey response: {survey}")
+    else:
+        logging.info(f"POST survey analysis OpenAI response: {response}")
+        logging.info(f"POST survey analysis response: {report}")
+
+def _structured(route, survey, response, report):
+    if route == "get_survey":
+        log_utils.verbose("GET survey response", survey="benchmark", response=log_utils.Payload(survey))
+    else:
+        log_utils.verbose("POST survey analysis OpenAI response", response=log_utils.Payload(response))
+        log_utils.verbose("POST survey analysis response", survey="benchmark", response=log_utils.Payload(report))
+
+def _run(route, statements, requests, queued):
+    stream = _CountingStream()
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s %(message)s"))
+    root = logging.getLogger()
+    previous = root.handlers[:], root.level
+    root.handlers = [handler]
+    root.setLevel(logging.INFO)
+    if queued:
+        log_utils.configure()
+    survey, response, report = _survey(60), bench_split_generation._response(10), _report()
+    thread_started, process_started = time.thread_time(), time.process_time()
+    for _ in range(requests):
+        with tracing.span("http", route):
+            statements(route, survey, response, report)
+    thread_cpu = time.thread_time() - thread_started
+    log_utils.shutdown()
+    process_cpu = time.process_time() - process_started
+    root.handlers, level = previous
+    root.setLevel(level)
+    return thread_cpu / requests, process_cpu / requests, stream.bytes / requests
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=2000)
+    args = parser.parse_args()
+    print(f"{'route':<22} {'logging':<34} {'request CPU us':>15} {'process CPU us':>15} {'bytes/req':>10}")
+    for route in ("get_survey", "post_survey_analysis"):
+        modes = [
+            ("eager f-strings", _eager, False, None),
+            ("log_utils, every request", _structured, False, 1.0),
+            ("log_utils, 5% sampled", _structured, False, 0.05),
+            ("log_utils, 5% sampled, queued", _structured, True, 0.05)
+        ]
+        for name, statements, queued, rate in modes:
+            if rate is not None:
+                log_utils.LOG_SAMPLE_RATES[route] = rate
+            thread_cpu, process_cpu, written = _run(route, statements, args.requests, queued)
+            print(f"{route:<22} {name:<34} {thread_cpu * 1e6:15.1f} {process_cpu * 1e6:15.1f} {written:10.0f}")
+
+if __name__ == "__main__":
+    main()
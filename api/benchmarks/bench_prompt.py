@@ -0,0 +1,78 @@
+# Compares the prompt sent for a survey before compaction (json.dumps of the
+# request body in one call) with generate_analysis_async: the compact prompt
+# and, above PROMPT_MAX_INPUT_TOKENS, map-reduce. The fake model's latency grows with
+# prompt and completion tokens. Run from the api folder:
+#   python -m benchmarks.bench_prompt
+import argparse
+import asyncio
+import json
+import time
+import analysis_pipeline
+import analysis_schema
+import openai_utils
+import prompt_builder
+import system_message
+from benchmarks import fakes
+
+# gpt-4o context window, less the completion budget of the analysis call.
+CONTEXT_WINDOW_TOKENS = 128000 - openai_utils.DEFAULT_MAX_TOKENS
+CATEGORIES = ("Initial Investment Assessment", "Operational Impact", "Stakeholder Readiness", "Training and Adoption", "Risk and Compliance")
+
+def _request_body(count):
+    return {"forms": [{
+        "category": CATEGORIES[i % len(CATEGORIES)],
+        "title": f"question_{i}",
+        "description": f"What is the expected cost or benefit for item {i}?",
+        "contents": f"${1000 + i * 10:,} per year for the {CATEGORIES[i % len(CATEGORIES)].lower()} workstream"
+    } for i in range(count)]}
+
+async def _current(client, request):
+    start = time.perf_counter()
+    prompt = prompt_builder.Prompt(system_message.ROI_EXPERT_SYSTEM_MESSAGE, json.dumps(request.model_dump(mode="json")))
+    openai_response = json.loads(await openai_utils.get_json_response_async(
+        client=client,
+        system_message=prompt.system_message,
+        user_message=prompt.user_message,
+        response_class=analysis_schema.Response
+    ))
+    await analysis_pipeline.verify_analysis_async(client, request, openai_response, prompt)
+    return time.perf_counter() - start
+
+async def _compact(request):
+    start = time.perf_counter()
+    await analysis_pipeline.generate_analysis_async(system_message.ROI_EXPERT_SYSTEM_MESSAGE, request)
+    return time.perf_counter() - start
+
+async def _run(sizes):
+    client = openai_utils.get_async_client(api_key=fakes.FAKE_API_KEY)
+    for size in sizes:
+        request_body = _request_body(size)
+        request = analysis_schema.Request.model_validate(request_body)
+        client.prompt_tokens.clear()
+        current_elapsed = await _current(client, request)
+        current_tokens = client.prompt_tokens[0]
+        client.prompt_tokens.clear()
+        compact_elapsed = await _compact(request)
+        calls = len(client.prompt_tokens)
+        overflow = "  (over the context window)" if current_tokens > CONTEXT_WINDOW_TOKENS else ""
+        print(f"{size:6d} forms  current: {current_tokens:8d} tokens {current_elapsed:6.2f}s{overflow}")
+        print(f"{'':13}compact: {sum(client.prompt_tokens):8d} tokens {compact_elapsed:6.2f}s  in {calls} calls, largest prompt {max(client.prompt_tokens)} tokens")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--forms", type=int, nargs="+", default=[20, 200, 2000, 6000])
+    parser.add_argument("--llm-ms", type=float, default=300)
+    parser.add_argument("--input-us-per-token", type=float, default=20)
+    parser.add_argument("--output-ms-per-token", type=float, default=15)
+    parser.add_argument("--incremental", action="store_true", help="Extract every survey form by form, as incremental analysis does.")
+    args = parser.parse_args()
+    analysis_pipeline.ANALYSIS_INCREMENTAL = args.incremental
+    fakes.install(
+        llm_latency=args.llm_ms / 1000,
+        llm_input_token_latency=args.input_us_per_token / 1e6,
+        llm_output_token_latency=args.output_ms_per_token / 1000
+    )
+    asyncio.run(_run(args.forms))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+# Compares generating the analysis in one call with split generation (numeric
+# call, then insights, recommendations and summary in parallel) against a
+# fake OpenAI whose latency grows with prompt and completion tokens, using a
+# response about the size gpt-4o writes for a real survey. Token latencies
+# default to a tenth of gpt-4o's, so the run stays short. Run from the api
+# folder: python -m benchmarks.bench_split_generation
+import argparse
+import asyncio
+import json
+import statistics
+import time
+import analysis_pipeline
+import analysis_schema
+import openai_utils
+import prompt_builder
+import system_message
+from benchmarks import fakes
+
+REQUEST_BODY = {"forms": [
+    {"category": "Initial Investment Assessment", "title": "upfront_cost", "description": "What is the expected upfront cost?", "contents": "$100,000"},
+    {"category": "Operational Impact", "title": "savings", "description": "What savings do you expect over three years?", "contents": "$250,000 in productivity savings"},
+    {"category": "Stakeholder Readiness", "title": "sponsor", "description": "Is there an executive sponsor?", "contents": "Yes, the COO sponsors the rollout and meets the team weekly."}
+]}
+PARAGRAPH = ("Executive sponsorship is in place and the rollout is paced over three quarters, which lowers adoption risk. "
+             "Budget contingency for training and a measured pilot will protect the expected productivity savings. ") * 2
+
+def _response(items):
+    # About 2,800 completion tokens with ten insights and recommendations.
+    def entries(kind):
+        return [{"title": f"{kind} {i}", "description": f"Why {kind.lower()} {i} matters", "contents": PARAGRAPH} for i in range(items)]
+    return {
+        "analysis": {
+            "total_costs": {"value": 100000.0, "explanation": "The upfront cost stated in the initial investment assessment."},
+            "total_benefits": {"value": 250000.0, "explanation": "Productivity savings over three years."},
+            "roi": {"value": 1.5, "explanation": "(250,000 - 100,000) / 100,000 = 1.5, or 150%."},
+            "insights": entries("Insight"),
+            "recommendations": entries("Recommendation")
+        },
+        "summary": " ".join([PARAGRAPH] * 2)
+    }
+
+async def _run(requests, split):
+    analysis_pipeline.ANALYSIS_SPLIT = split
+    client = openai_utils.get_async_client(fakes.FAKE_API_KEY)
+    request = analysis_schema.Request.model_validate(REQUEST_BODY)
+    prompt = prompt_builder.forms_prompt(system_message.ROI_EXPERT_SYSTEM_MESSAGE, prompt_builder.compact_forms(request.forms))
+    latencies = []
+    for _ in range(requests):
+        started = time.perf_counter()
+        await analysis_pipeline._generate_async(client, prompt, request)
+        latencies.append(time.perf_counter() - started)
+    return latencies, analysis_pipeline.estimated_tokens(prompt)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=5)
+    parser.add_argument("--items", type=int, default=10, help="Insights and recommendations in the response.")
+    parser.add_argument("--llm-ms", type=float, default=30, help="Fixed latency of one call.")
+    parser.add_argument("--input-token-ms", type=float, default=0.02)
+    parser.add_argument("--output-token-ms", type=float, default=1.5)
+    args = parser.parse_args()
+    response = _response(args.items)
+    print(f"response: {openai_utils.count_tokens(json.dumps(response))} completion tokens")
+    for name, split in (("one call", False), ("split", True)):
+        installed = fakes.install(llm_latency=args.llm_ms / 1000, llm_input_token_latency=args.input_token_ms / 1000, llm_output_token_latency=args.output_token_ms / 1000)
+        client = installed[f"openai-aio:{fakes.key_digest(fakes.FAKE_API_KEY)}"]
+        client.response = response
+        latencies, budget = asyncio.run(_run(args.requests, split))
+        print(
+            f"{name:<10} mean={statistics.mean(latencies) * 1000:7.1f}ms max={max(latencies) * 1000:7.1f}ms"
+            f" calls/analysis={fakes.call_counts()['openai'] / args.requests:.1f}"
+            f" prompt tokens/analysis={sum(client.prompt_tokens) / args.requests:.0f} quota reserved={budget}"
+        )
+
+if __name__ == "__main__":
+    main()
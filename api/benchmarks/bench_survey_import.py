@@ -0,0 +1,47 @@
+# Compares bulk NDJSON survey import with one put_survey call per survey (what
+# a PUT survey request does) against in-memory fakes. Run from the api folder:
+#   python -m benchmarks.bench_survey_import
+import argparse
+import asyncio
+import time
+import db_utils
+import survey_transfer
+from benchmarks import fakes
+
+def _survey(i):
+    return {"name": f"survey-{i}", "responses": {"upfront_cost": f"${10000 + i}", "team_size": str(i % 50)}}
+
+async def _body(count, chunk_bytes=64 * 1024):
+    # Arrives in fixed-size chunks that split lines, like a request stream.
+    data = "".join(survey_transfer.survey_line(f"survey-{i}", _survey(i)) for i in range(count)).encode("utf-8")
+    for start in range(0, len(data), chunk_bytes):
+        yield data[start:start + chunk_bytes]
+
+async def _import(count):
+    start = time.perf_counter()
+    summary = None
+    async for result in survey_transfer.import_surveys_async(_body(count)):
+        summary = result.get("summary", summary)
+    return time.perf_counter() - start, summary
+
+def _single_puts(count):
+    client = db_utils.get_client()
+    start = time.perf_counter()
+    for i in range(count):
+        db_utils.put_survey(client, f"survey-{i}", _survey(i))
+    return time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--surveys", type=int, default=10000)
+    parser.add_argument("--puts", type=int, default=300)
+    parser.add_argument("--cosmos-ms", type=float, default=10)
+    args = parser.parse_args()
+    fakes.install(cosmos_latency=args.cosmos_ms / 1000)
+    put_elapsed = _single_puts(args.puts)
+    print(f"single puts: {args.puts} surveys in {put_elapsed:6.2f}s  ({args.puts / put_elapsed:8.1f} surveys/s)")
+    import_elapsed, summary = asyncio.run(_import(args.surveys))
+    print(f"bulk import: {args.surveys} surveys in {import_elapsed:6.2f}s  ({args.surveys / import_elapsed:8.1f} surveys/s)  {summary}")
+
+if __name__ == "__main__":
+    main()
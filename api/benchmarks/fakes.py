@@ -0,0 +1,671 @@
+import asyncio
+import json
+import math
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timezone
+from types import SimpleNamespace
+import jiter
+import lazy_modules
+from client_registry import registry, key_digest
+
+# Lazy like the app's own imports, so the fakes can be installed in a cold
+# process without loading what the route under test would load itself.
+analysis_schema = lazy_modules.LazyModule("analysis_schema")
+db_utils = lazy_modules.LazyModule("db_utils")
+openai_utils = lazy_modules.LazyModule("openai_utils")
+
+FAKE_API_KEY = "fake-openai-key"
+# z-score of the 99th percentile of a normal distribution.
+P99_Z = 2.326
+DOWNLOAD_CHUNK_BYTES = 64 * 1024
+
+CANNED_RESPONSE = {
+    "analysis": {
+        "total_costs": {"value": 100000.0, "explanation": "Upfront, setup and training costs."},
+        "total_benefits": {"value": 250000.0, "explanation": "Productivity savings over three years."},
+        "roi": {"value": 1.5, "explanation": "ROI of 1.5 (150%)."},
+        "insights": [{"title": f"Insight {i}", "description": "Description", "contents": "Contents"} for i in range(3)],
+        "recommendations": [{"title": f"Recommendation {i}", "description": "Description", "contents": "Contents"} for i in range(3)]
+    },
+    "summary": "The initiative appears financially viable with an ROI of 150%."
+}
+
+def _extraction(user_message):
+    # One entry per form id in the extraction layout, alternating costs and
+    # benefits, so completion size grows with the number of forms sent.
+    ids = [row[0] for rows in json.loads(user_message).values() for row in rows]
+    return {"forms": [{
+        "form": form_id,
+        "costs": [{"title": f"Cost {form_id}", "amount": 1000.0}] if form_id % 2 == 0 else [],
+        "benefits": [{"title": f"Benefit {form_id}", "amount": 2500.0}] if form_id % 2 else [],
+        "observations": []
+    } for form_id in ids]}
+
+class Latency:
+    # Call latency in seconds: fixed, or lognormal with the given median and
+    # 99th percentile, which has the long tail real services show.
+    def __init__(self, median=0.0, p99=None):
+        self.median = median
+        self.p99 = p99
+        self._sigma = math.log(p99 / median) / P99_Z if p99 and median > 0 and p99 > median else 0.0
+
+    @classmethod
+    def parse(cls, text):
+        # "200" is a fixed 200ms, "200:900" a median of 200ms with a p99 of 900ms.
+        median, _, p99 = str(text).partition(":")
+        return cls(float(median) / 1000, float(p99) / 1000 if p99 else None)
+
+    def sample(self, rng):
+        if not self._sigma:
+            return self.median
+        return rng.lognormvariate(math.log(self.median), self._sigma)
+
+def _latency(value):
+    return value if isinstance(value, Latency) else Latency(value or 0.0)
+
+class _FakeResponse:
+    # Just enough of an HTTP response for the SDK exception types and
+    # retry.retry_after_of.
+    def __init__(self, status_code, reason, headers=None):
+        self.status_code = status_code
+        self.reason = reason
+        self.headers = headers or {}
+        self.request = SimpleNamespace(method="POST", url="https://fake.invalid")
+
+    def text(self, encoding=None):
+        return ""
+
+def _azure_error(status_code, reason, headers=None):
+    from azure.core.exceptions import HttpResponseError
+    return HttpResponseError(message=f"{reason} (injected)", response=_FakeResponse(status_code, reason, headers))
+
+def _cosmos_error(status_code, reason, headers=None):
+    from azure.cosmos.exceptions import CosmosHttpResponseError
+    error = CosmosHttpResponseError(status_code=status_code, message=f"{reason} (injected)")
+    error.headers = headers or {}
+    return error
+
+def _openai_error(status_code, reason, headers=None):
+    import openai
+    error_class = openai.RateLimitError if status_code == 429 else openai.InternalServerError
+    return error_class(f"{reason} (injected)", response=_FakeResponse(status_code, reason, headers), body=None)
+
+def _openai_timeout():
+    import openai
+    return openai.APITimeoutError(request=SimpleNamespace(method="POST", url="https://fake.invalid"))
+
+# Errors each dependency raises for an injected throttle or failure, with the
+# retry hint header it would send.
+ERROR_FACTORIES = {
+    "cosmos": (_cosmos_error, "x-ms-retry-after-ms"),
+    "blob": (_azure_error, "Retry-After"),
+    "keyvault": (_azure_error, "Retry-After"),
+    "openai": (_openai_error, "retry-after-ms")
+}
+# Errors raised when a call is slower than the timeout its caller passed.
+TIMEOUT_FACTORIES = {
+    "openai": _openai_timeout
+}
+
+class Service:
+    # One fake dependency: samples each call's latency, counts calls and
+    # injects throttling (429 with a retry hint) and failures (5xx).
+    def __init__(self, name, latency=0.0, error_rate=0.0, throttle_rate=0.0, retry_after=0.05, seed=None):
+        self.name = name
+        self.latency = _latency(latency)
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.counts = Counter()
+
+    def _begin(self, extra=0.0):
+        # Returns (delay, error or None).
+        with self._lock:
+            self.counts["calls"] += 1
+            delay = self.latency.sample(self._rng) + extra
+            draw = self._rng.random()
+            if draw < self.throttle_rate:
+                self.counts["throttled"] += 1
+                return delay, self._error(429, "Too Many Requests")
+            if draw < self.throttle_rate + self.error_rate:
+                self.counts["failed"] += 1
+                return delay, self._error(503, "Service Unavailable")
+        return delay, None
+
+    def _error(self, status_code, reason):
+        factory, header = ERROR_FACTORIES.get(self.name, (_azure_error, "Retry-After"))
+        if status_code != 429:
+            return factory(status_code, reason)
+        value = str(int(self.retry_after * 1000)) if header.endswith("-ms") else str(max(int(math.ceil(self.retry_after)), 1))
+        return factory(status_code, reason, {header: value})
+
+    def _timed_out(self, delay, timeout):
+        # The SDKs' "not given" sentinels are not numbers.
+        if isinstance(timeout, (int, float)) and delay > timeout:
+            with self._lock:
+                self.counts["timedOut"] += 1
+            return True
+        return False
+
+    def _timeout(self):
+        return TIMEOUT_FACTORIES.get(self.name, TimeoutError)()
+
+    def call(self, extra=0.0, timeout=None):
+        delay, error = self._begin(extra)
+        if self._timed_out(delay, timeout):
+            time.sleep(timeout)
+            raise self._timeout()
+        time.sleep(delay)
+        if error is not None:
+            raise error
+
+    async def call_async(self, extra=0.0, timeout=None):
+        delay, error = self._begin(extra)
+        if self._timed_out(delay, timeout):
+            await asyncio.sleep(timeout)
+            raise self._timeout()
+        await asyncio.sleep(delay)
+        if error is not None:
+            raise error
+
+def _not_found():
+    from azure.cosmos.exceptions import CosmosResourceNotFoundError
+    return CosmosResourceNotFoundError(message="Entity with the specified id does not exist in the system.")
+
+def _exists():
+    from azure.cosmos.exceptions import CosmosResourceExistsError
+    return CosmosResourceExistsError(status_code=409, message="Entity with the specified id already exists in the system.")
+
+def _precondition_failed():
+    from azure.cosmos.exceptions import CosmosAccessConditionFailedError
+    return CosmosAccessConditionFailedError(status_code=412, message="The operation did not meet the etag precondition.")
+
+def _in_partition(item, partition_key):
+    if partition_key is None:
+        return True
+    return partition_key in (
+        item.get(db_utils.SURVEY_PARTITION_KEY),
+        item.get(db_utils.CATALOGUE_PARTITION_KEY),
+        item.get(db_utils.REPORT_PARTITION_KEY),
+        item.get(db_utils.ID_KEY)
+    )
+
+def _report_versions(items, values):
+    versions = [item for item in items if item.get(db_utils.REPORT_PARTITION_KEY) == values["@surveyName"]]
+    if "@since" in values:
+        versions = [item for item in versions if item[db_utils.REPORT_VERSION_KEY] >= values["@since"]]
+    if "@before" in values:
+        versions = [item for item in versions if item[db_utils.REPORT_VERSION_KEY] < values["@before"]]
+    versions.sort(key=lambda item: item[db_utils.REPORT_VERSION_KEY], reverse=True)
+    return versions[:values["@limit"]] if "@limit" in values else versions
+
+class FakePages:
+    # Offsets into the result list serve as continuation tokens.
+    def __init__(self, items, page_size, continuation_token):
+        self._items = items
+        self._page_size = page_size or len(items) or 1
+        self._offset = int(continuation_token) if continuation_token else 0
+        self._done = False
+        self.continuation_token = None
+
+    def _next_page(self):
+        if self._done:
+            return None
+        page = self._items[self._offset:self._offset + self._page_size]
+        self._offset += self._page_size
+        self._done = self._offset >= len(self._items)
+        self.continuation_token = None if self._done else str(self._offset)
+        return page
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        page = self._next_page()
+        if page is None:
+            raise StopIteration
+        return iter(page)
+
+async def _aiter(items):
+    for item in items:
+        yield item
+
+class FakeAsyncPages(FakePages):
+    # Each page is a round trip, as with the async SDK.
+    def __init__(self, service, items, page_size, continuation_token):
+        super().__init__(items, page_size, continuation_token)
+        self._service = service
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._done:
+            raise StopAsyncIteration
+        await self._service.call_async()
+        return _aiter(self._next_page())
+
+class FakeItemPaged:
+    def __init__(self, items, page_size):
+        self._items = items
+        self._page_size = page_size
+
+    def __iter__(self):
+        return iter(self._items)
+
+    def by_page(self, continuation_token=None):
+        return FakePages(self._items, self._page_size, continuation_token)
+
+class FakeAsyncItemPaged(FakeItemPaged):
+    # The async SDK returns its pager synchronously and pays the round trip
+    # when it is iterated.
+    def __init__(self, service, items, page_size):
+        super().__init__(items, page_size)
+        self._service = service
+
+    async def _iterate(self):
+        await self._service.call_async()
+        for item in self._items:
+            yield item
+
+    def __aiter__(self):
+        return self._iterate()
+
+    def by_page(self, continuation_token=None):
+        return FakeAsyncPages(self._service, self._items, self._page_size, continuation_token)
+
+class FakeContainer:
+    def __init__(self, service, items):
+        self._service = service
+        self._items = items
+
+    def _query(self, query, parameters, partition_key):
+        # Only the queries db_utils sends are understood.
+        values = {parameter["name"]: parameter["value"] for parameter in parameters or []}
+        items = [item for item in list(self._items.values()) if _in_partition(item, partition_key)]
+        if query == db_utils.SURVEY_QUERY:
+            return [{db_utils.ID_KEY: item[db_utils.ID_KEY]} for item in items]
+        if query == db_utils.SURVEY_EXPORT_QUERY:
+            return [{db_utils.ID_KEY: item[db_utils.ID_KEY], db_utils.DATA_KEY: item[db_utils.DATA_KEY]} for item in items]
+        if query == "SELECT * FROM c":
+            return [dict(item) for item in items]
+        if query == db_utils.REPORT_LATEST_QUERY:
+            versions = _report_versions(items, values)
+            return [{db_utils.DATA_KEY: versions[0][db_utils.DATA_KEY]}] if versions else []
+        if query.startswith("SELECT ") and "c.reportVersion FROM c WHERE c.surveyName = @surveyName" in query:
+            return [{db_utils.REPORT_VERSION_KEY: item[db_utils.REPORT_VERSION_KEY]} for item in _report_versions(items, values)]
+        raise NotImplementedError(f"FakeContainer does not support the query: {query}")
+
+    def _write(self, body):
+        item = dict(body, _etag=f'"{uuid.uuid4()}"')
+        self._items[item[db_utils.ID_KEY]] = item
+        return dict(item)
+
+    def _read(self, item):
+        if item not in self._items:
+            raise _not_found()
+        return dict(self._items[item])
+
+    def _create(self, body):
+        if body[db_utils.ID_KEY] in self._items:
+            raise _exists()
+        return self._write(body)
+
+    def _replace(self, item, body, etag):
+        current = self._read(item)
+        if etag is not None and current["_etag"] != etag:
+            raise _precondition_failed()
+        return self._write(body)
+
+    def _delete(self, item):
+        if self._items.pop(item, None) is None:
+            raise _not_found()
+
+    def _batch(self, batch_operations):
+        for _, (body,) in batch_operations:
+            self._write(body)
+        return [{"statusCode": 200} for _ in batch_operations]
+
+    def query_items(self, query, parameters=None, partition_key=None, max_item_count=None, **kwargs):
+        self._service.call()
+        return FakeItemPaged(self._query(query, parameters, partition_key), max_item_count)
+
+    def upsert_item(self, body, **kwargs):
+        self._service.call()
+        return self._write(body)
+
+    def create_item(self, body, **kwargs):
+        self._service.call()
+        return self._create(body)
+
+    def replace_item(self, item, body, etag=None, match_condition=None, **kwargs):
+        self._service.call()
+        return self._replace(item, body, etag)
+
+    def read_item(self, item, partition_key, **kwargs):
+        self._service.call()
+        return self._read(item)
+
+    def delete_item(self, item, partition_key, **kwargs):
+        self._service.call()
+        self._delete(item)
+
+    def execute_item_batch(self, batch_operations, partition_key, **kwargs):
+        self._service.call()
+        return self._batch(batch_operations)
+
+class FakeAsyncContainer(FakeContainer):
+    def query_items(self, query, parameters=None, partition_key=None, max_item_count=None, **kwargs):
+        return FakeAsyncItemPaged(self._service, self._query(query, parameters, partition_key), max_item_count)
+
+    async def upsert_item(self, body, **kwargs):
+        await self._service.call_async()
+        return self._write(body)
+
+    async def create_item(self, body, **kwargs):
+        await self._service.call_async()
+        return self._create(body)
+
+    async def replace_item(self, item, body, etag=None, match_condition=None, **kwargs):
+        await self._service.call_async()
+        return self._replace(item, body, etag)
+
+    async def read_item(self, item, partition_key, **kwargs):
+        await self._service.call_async()
+        return self._read(item)
+
+    async def delete_item(self, item, partition_key, **kwargs):
+        await self._service.call_async()
+        self._delete(item)
+
+    async def execute_item_batch(self, batch_operations, partition_key, **kwargs):
+        await self._service.call_async()
+        return self._batch(batch_operations)
+
+class FakeCosmosClient:
+    container_class = FakeContainer
+
+    def __init__(self, service, containers=None):
+        self.service = service
+        self.containers = {} if containers is None else containers
+
+    def get_database_client(self, database):
+        return self
+
+    def get_container_client(self, container):
+        return self.container_class(self.service, self.containers.setdefault(container, {}))
+
+class FakeAsyncCosmosClient(FakeCosmosClient):
+    container_class = FakeAsyncContainer
+
+class _Blob:
+    def __init__(self, data, content_settings):
+        self.data = data
+        # Plain values rather than the SDK's ContentSettings, so stores can be
+        # pickled and restored without importing azure.storage.blob.
+        self.content_settings = SimpleNamespace(
+            content_encoding=getattr(content_settings, "content_encoding", None),
+            content_type=getattr(content_settings, "content_type", None)
+        )
+        self.etag = f'"{uuid.uuid4()}"'
+        self.last_modified = datetime.now(timezone.utc)
+
+class FakeDownloader:
+    def __init__(self, blob, offset=None, length=None):
+        start = offset or 0
+        end = len(blob.data) if length is None else min(start + length, len(blob.data))
+        self._data = blob.data[start:end]
+        self.size = len(self._data)
+        content_range = f"bytes {start}-{end - 1}/{len(blob.data)}" if offset is not None else None
+        self.properties = SimpleNamespace(
+            content_settings=blob.content_settings,
+            etag=blob.etag,
+            last_modified=blob.last_modified,
+            content_range=content_range
+        )
+
+    def readall(self):
+        return self._data
+
+    def chunks(self):
+        return iter([self._data[start:start + DOWNLOAD_CHUNK_BYTES] for start in range(0, self.size, DOWNLOAD_CHUNK_BYTES)])
+
+class FakeAsyncDownloader(FakeDownloader):
+    async def readall(self):
+        return self._data
+
+    def chunks(self):
+        return _aiter([self._data[start:start + DOWNLOAD_CHUNK_BYTES] for start in range(0, self.size, DOWNLOAD_CHUNK_BYTES)])
+
+def _blob_not_found():
+    from azure.core.exceptions import ResourceNotFoundError
+    return ResourceNotFoundError(message="The specified blob does not exist.")
+
+def _blob_not_modified():
+    from azure.core.exceptions import ResourceNotModifiedError
+    return ResourceNotModifiedError(message="The condition specified using HTTP conditional header(s) is not met.")
+
+class FakeBlobClient:
+    downloader_class = FakeDownloader
+
+    def __init__(self, service, blobs, container, blob):
+        self._service = service
+        self._blobs = blobs
+        self._key = (container, blob)
+        self.url = f"https://fake.blob.core.windows.net/{container}/{blob}"
+
+    def _upload(self, data, content_settings):
+        self._blobs[self._key] = _Blob(data.encode("utf-8") if isinstance(data, str) else bytes(data), content_settings)
+
+    def _download(self, offset=None, length=None, etag=None, match_condition=None):
+        blob = self._blobs.get(self._key)
+        if blob is None:
+            raise _blob_not_found()
+        if etag is not None and etag == blob.etag:
+            raise _blob_not_modified()
+        if offset is not None and offset >= len(blob.data):
+            raise _azure_error(416, "Range Not Satisfiable")
+        return self.downloader_class(blob, offset, length)
+
+    def _delete(self):
+        if self._blobs.pop(self._key, None) is None:
+            raise _blob_not_found()
+
+    def upload_blob(self, data, overwrite=True, content_settings=None, **kwargs):
+        self._service.call()
+        self._upload(data, content_settings)
+
+    def download_blob(self, offset=None, length=None, decompress=True, etag=None, match_condition=None, **kwargs):
+        self._service.call()
+        return self._download(offset, length, etag, match_condition)
+
+    def delete_blob(self, **kwargs):
+        self._service.call()
+        self._delete()
+
+class FakeAsyncBlobClient(FakeBlobClient):
+    downloader_class = FakeAsyncDownloader
+
+    async def upload_blob(self, data, overwrite=True, content_settings=None, **kwargs):
+        await self._service.call_async()
+        self._upload(data, content_settings)
+
+    async def download_blob(self, offset=None, length=None, decompress=True, etag=None, match_condition=None, **kwargs):
+        await self._service.call_async()
+        return self._download(offset, length, etag, match_condition)
+
+    async def delete_blob(self, **kwargs):
+        await self._service.call_async()
+        self._delete()
+
+class FakeBlobServiceClient:
+    blob_client_class = FakeBlobClient
+
+    def __init__(self, service, blobs=None):
+        self.service = service
+        self.blobs = {} if blobs is None else blobs
+
+    def get_blob_client(self, container, blob):
+        return self.blob_client_class(self.service, self.blobs, container, blob)
+
+class FakeAsyncBlobServiceClient(FakeBlobServiceClient):
+    blob_client_class = FakeAsyncBlobClient
+
+class FakeSecretClient:
+    def __init__(self, service):
+        self.service = service
+
+    def get_secret(self, name):
+        self.service.call()
+        return SimpleNamespace(value=FAKE_API_KEY)
+
+class FakeAsyncSecretClient(FakeSecretClient):
+    async def get_secret(self, name):
+        await self.service.call_async()
+        return SimpleNamespace(value=FAKE_API_KEY)
+
+def _completion(response, prompt_tokens=0, completion_tokens=0):
+    return SimpleNamespace(
+        choices=[SimpleNamespace(message=SimpleNamespace(content=json.dumps(response)))],
+        usage=SimpleNamespace(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens, total_tokens=prompt_tokens + completion_tokens)
+    )
+
+class FakeOpenAI:
+    # Each call costs the service's sampled latency plus, optionally, a cost
+    # per prompt token (prefill) and per completion token (decoding), so
+    # prompt size shows up in benchmarks.
+    def __init__(self, service, response=CANNED_RESPONSE, input_token_latency=0.0, output_token_latency=0.0):
+        self.service = service
+        self.response = response
+        self.input_token_latency = input_token_latency
+        self.output_token_latency = output_token_latency
+        self.prompt_tokens = []
+        self.models = Counter()
+        self.beta = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(parse=self._parse)))
+
+    def _response(self, kwargs):
+        response_format = kwargs.get("response_format")
+        if response_format is analysis_schema.Extraction:
+            return _extraction(kwargs["messages"][-1]["content"])
+        if response_format is analysis_schema.NumericAnalysis:
+            return {field: self.response["analysis"][field] for field in ("total_costs", "total_benefits", "roi")}
+        if response_format is analysis_schema.Insights:
+            return {"insights": self.response["analysis"]["insights"]}
+        if response_format is analysis_schema.Recommendations:
+            return {"recommendations": self.response["analysis"]["recommendations"]}
+        if response_format is analysis_schema.Summary:
+            return {"summary": self.response["summary"]}
+        if response_format is analysis_schema.Roi:
+            return self.response["analysis"]["roi"]
+        if response_format is analysis_schema.RoiCorrection:
+            return {"roi": self.response["analysis"]["roi"], "summary": self.response["summary"]}
+        return self.response
+
+    def _call(self, kwargs):
+        # Returns (token latency, completion) with usage filled in.
+        response = self._response(kwargs)
+        prompt_tokens = sum(openai_utils.count_tokens(message["content"]) for message in kwargs.get("messages", []))
+        self.prompt_tokens.append(prompt_tokens)
+        self.models[kwargs.get("model")] += 1
+        completion_tokens = openai_utils.count_tokens(json.dumps(response))
+        latency = prompt_tokens * self.input_token_latency + completion_tokens * self.output_token_latency
+        return latency, _completion(response, prompt_tokens, completion_tokens)
+
+    def _parse(self, **kwargs):
+        latency, completion = self._call(kwargs)
+        self.service.call(latency, kwargs.get("timeout"))
+        return completion
+
+class FakeAsyncStream:
+    def __init__(self, client, chunk_size=16):
+        self._client = client
+        self._content = json.dumps(client.response)
+        self._chunk_size = chunk_size
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    async def __aiter__(self):
+        # Spreads the sampled latency over the chunks and parses each
+        # snapshot the way the SDK does, so partial objects look realistic.
+        delay, error = self._client.service._begin()
+        if error is not None:
+            raise error
+        chunks = range(0, len(self._content), self._chunk_size)
+        for end in chunks:
+            await asyncio.sleep(delay / len(chunks))
+            snapshot = self._content[:end + self._chunk_size]
+            yield SimpleNamespace(type="content.delta", delta=snapshot[end:], snapshot=snapshot, parsed=jiter.from_json(snapshot.encode("utf-8"), partial_mode="trailing-strings"))
+
+    async def get_final_completion(self):
+        return _completion(self._client.response)
+
+class FakeAsyncOpenAI(FakeOpenAI):
+    def __init__(self, service, response=CANNED_RESPONSE, input_token_latency=0.0, output_token_latency=0.0):
+        super().__init__(service, response, input_token_latency, output_token_latency)
+        self.beta.chat.completions.stream = self._stream
+
+    async def _parse(self, **kwargs):
+        latency, completion = self._call(kwargs)
+        await self.service.call_async(latency, kwargs.get("timeout"))
+        return completion
+
+    def _stream(self, **kwargs):
+        return FakeAsyncStream(self)
+
+services = {}
+
+def install(
+    llm_latency=0.0,
+    blob_latency=0.0,
+    cosmos_latency=0.0,
+    keyvault_latency=0.0,
+    llm_input_token_latency=0.0,
+    llm_output_token_latency=0.0,
+    error_rate=0.0,
+    throttle_rate=0.0,
+    seed=None,
+    containers=None,
+    blobs=None
+):
+    # Registers fakes under the keys the helper modules' get_client() functions
+    # use. Latencies are seconds or a Latency; the error and throttle rates
+    # apply to every call of every dependency. Sync and async clients of a
+    # dependency share one store; pass containers and blobs from an earlier
+    # install to start from its data.
+    rng = random.Random(seed)
+    services.clear()
+    for name, latency in (("blob", blob_latency), ("cosmos", cosmos_latency), ("keyvault", keyvault_latency), ("openai", llm_latency)):
+        services[name] = Service(name, latency, error_rate, throttle_rate, seed=rng.random())
+    containers = {} if containers is None else containers
+    blobs = {} if blobs is None else blobs
+    digest = key_digest(FAKE_API_KEY)
+    fakes = {
+        "blob": FakeBlobServiceClient(services["blob"], blobs),
+        "blob-aio": FakeAsyncBlobServiceClient(services["blob"], blobs),
+        "cosmos": FakeCosmosClient(services["cosmos"], containers),
+        "cosmos-aio": FakeAsyncCosmosClient(services["cosmos"], containers),
+        "keyvault": FakeSecretClient(services["keyvault"]),
+        "keyvault-aio": FakeAsyncSecretClient(services["keyvault"]),
+        f"openai:{digest}": FakeOpenAI(services["openai"], input_token_latency=llm_input_token_latency, output_token_latency=llm_output_token_latency),
+        f"openai-aio:{digest}": FakeAsyncOpenAI(services["openai"], input_token_latency=llm_input_token_latency, output_token_latency=llm_output_token_latency),
+    }
+    for key, client in fakes.items():
+        registry.register(key, client)
+    if "keyvault_utils" in sys.modules:
+        sys.modules["keyvault_utils"].invalidate_secret()
+    return fakes
+
+def call_counts():
+    # {dependency: calls} across every installed fake, retries included.
+    return {name: service.counts["calls"] for name, service in services.items()}
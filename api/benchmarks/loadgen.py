@@ -0,0 +1,323 @@
+# Drives every HTTP route in-process against the in-memory fakes, one route at
+# a time at a target concurrency, and reports throughput, p50/p95/p99 latency
+# and dependency calls per request. Needs no network access. Run from the api
+# folder:
+#   python -m benchmarks.loadgen                    # print the report
+#   python -m benchmarks.loadgen --write-baseline   # record benchmarks/baseline.json
+#   python -m benchmarks.loadgen --check            # rerun with the baseline's settings, exit 1 on a regression
+# Latencies are milliseconds, "median" or "median:p99" for a lognormal tail.
+import argparse
+import asyncio
+import inspect
+import json
+import logging
+import os
+import sys
+import time
+from urllib.parse import urlencode
+from starlette.requests import Request
+import function_app
+import job_queue
+import lazy_modules
+import system_message
+import warmup
+from benchmarks import fakes
+
+# Lazy so bench_cold_start can build requests in a cold process.
+analysis_pipeline = lazy_modules.LazyModule("analysis_pipeline")
+analysis_schema = lazy_modules.LazyModule("analysis_schema")
+db_utils = lazy_modules.LazyModule("db_utils")
+survey_transfer = lazy_modules.LazyModule("survey_transfer")
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+DEFAULT_SETTINGS = {
+    "requests": 40,
+    "concurrency": 8,
+    "forms": 12,
+    "llm_ms": "300:1200",
+    "cosmos_ms": "8:40",
+    "blob_ms": "15:60",
+    "keyvault_ms": "20:80",
+    "error_rate": 0.0,
+    "throttle_rate": 0.0,
+    "seed": 1
+}
+# A route regresses when its p95 grows, or its throughput drops, by more than
+# the tolerance, or when it makes more dependency calls. Differences in p95
+# below the slack are scheduling noise; an added round trip is caught by the
+# call counts instead.
+DEFAULT_TOLERANCE = 0.5
+LATENCY_SLACK_SECONDS = 0.015
+CALLS_SLACK = 0.05
+SEED_SURVEYS = 20
+IMPORT_BATCH = 10
+BATCH_SIZE = 3
+CATEGORIES = ("Initial Investment Assessment", "Operational Impact", "Stakeholder Readiness")
+
+def _survey(i):
+    return {"name": f"load-{i}", "responses": {"upfront_cost": f"${10000 + i}", "team_size": str(i % 50)}}
+
+def _analysis_body(forms, variant=0):
+    return {"forms": [{
+        "category": CATEGORIES[i % len(CATEGORIES)],
+        "title": f"question_{i}",
+        "description": f"What is the expected cost or benefit for item {i}?",
+        "contents": f"${1000 + i * 10 + variant:,} per year"
+    } for i in range(forms)]}
+
+def _asgi_request(method, route, params=None, body=b"", headers=None):
+    # The FastAPI extension hands every route a starlette Request; this builds
+    # one from an ASGI scope whose body arrives in one message.
+    if not isinstance(body, bytes):
+        body = json.dumps(body).encode("utf-8")
+    scope = {
+        "type": "http",
+        "method": method,
+        "path": f"/api/{route}",
+        "query_string": urlencode(params or {}).encode("latin-1"),
+        "headers": [(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in (headers or {}).items()]
+    }
+    sent = False
+
+    async def receive():
+        nonlocal sent
+        if sent:
+            return {"type": "http.disconnect"}
+        sent = True
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    return Request(scope, receive)
+
+async def _read(response):
+    # Returns (status, body bytes), consuming streamed bodies as a client would.
+    if hasattr(response, "body_iterator"):
+        chunks = [chunk.encode("utf-8") if isinstance(chunk, str) else chunk async for chunk in response.body_iterator]
+        return response.status_code, b"".join(chunks)
+    return response.status_code, response.body
+
+async def _invoke(handler, request):
+    if inspect.iscoroutinefunction(handler):
+        response = await handler(request)
+    else:
+        response = await asyncio.to_thread(handler, request)
+    return await _read(response)
+
+class Scenario:
+    # build(i) returns the i-th request; a response is ok when its status is
+    # in `statuses` and its body carries no in-band error.
+    def __init__(self, name, function, build, statuses=(200,), in_band_error=None):
+        self.name = name
+        # Route decorators leave a FunctionBuilder; the handler sits behind it.
+        self.handler = getattr(function_app, function)._function.get_user_function()
+        self.build = build
+        self.statuses = statuses
+        self.in_band_error = in_band_error
+
+    def ok(self, status, body):
+        if status not in self.statuses:
+            return False
+        return self.in_band_error is None or self.in_band_error not in body
+
+def _scenarios(state, forms):
+    survey = lambda i: f"load-{i % SEED_SURVEYS}"
+    report = {"surveyName": state["reportSurvey"], "reportVersion": state["reportVersion"]}
+    ndjson_error = b'{"error"'
+
+    def import_body(i):
+        lines = (survey_transfer.survey_line(f"import-{i}-{j}", _survey(j)) for j in range(IMPORT_BATCH))
+        return "".join(lines).encode("utf-8")
+
+    def batch_body(i):
+        # Distinct forms per item, so concurrent batches never share a cache
+        # entry and call counts do not depend on scheduling.
+        return {"requests": [{"surveyName": survey(i + j), **_analysis_body(forms, (BATCH_SIZE * i + j) * 1000)} for j in range(BATCH_SIZE)]}
+
+    return [
+        Scenario("ListSurveys", "get_surveys", lambda i: _asgi_request("GET", "surveys", {"pageSize": "10"})),
+        Scenario("GetSurvey", "get_survey", lambda i: _asgi_request("GET", "survey", {"surveyName": survey(i)})),
+        Scenario("UpsertSurvey", "upsert_survey", lambda i: _asgi_request("PUT", "survey", {"surveyName": f"put-{i}"}, _survey(i))),
+        Scenario("DeleteSurvey", "delete_survey", lambda i: _asgi_request("DELETE", "survey", {"surveyName": f"put-{i}"})),
+        Scenario("ImportSurveys", "import_surveys", lambda i: _asgi_request("POST", "surveys/import", body=import_body(i)), in_band_error=ndjson_error),
+        Scenario("ExportSurveys", "export_surveys", lambda i: _asgi_request("GET", "surveys/export"), in_band_error=ndjson_error),
+        # The seeded survey's analysis is cached, so this is the cache-hit path.
+        Scenario("PostSurveyAnalysis", "post_survey_analysis", lambda i: _asgi_request("POST", "survey/analysis", {"surveyName": state["reportSurvey"]}, _analysis_body(forms))),
+        Scenario("PostSurveyAnalysis?cache=bypass", "post_survey_analysis", lambda i: _asgi_request("POST", "survey/analysis", {"surveyName": survey(i), "cache": "bypass"}, _analysis_body(forms, i))),
+        Scenario("PostSurveyAnalysis?mode=job", "post_survey_analysis", lambda i: _asgi_request("POST", "survey/analysis", {"surveyName": survey(i), "mode": "job"}, _analysis_body(forms, i)), statuses=(202,)),
+        Scenario("StreamSurveyAnalysis", "stream_survey_analysis", lambda i: _asgi_request("POST", "survey/analysis/stream", {"surveyName": survey(i), "cache": "bypass"}, _analysis_body(forms, i)), in_band_error=b"event: error"),
+        Scenario("PostSurveyAnalysisBatch", "post_survey_analysis_batch", lambda i: _asgi_request("POST", "survey/analysis/batch", body=batch_body(i)), in_band_error=b'"status": "error"'),
+        Scenario("GetSurveyAnalysisJob", "get_survey_analysis_job", lambda i: _asgi_request("GET", "survey/analysis/job", {"jobId": state["jobId"]})),
+        # The seeded job is done, so a retry reports it unchanged with 409.
+        Scenario("RetrySurveyAnalysisJob", "retry_survey_analysis_job", lambda i: _asgi_request("POST", "survey/analysis/job/retry", {"jobId": state["jobId"]}), statuses=(409,)),
+        Scenario("GetOpenAIRateLimitStats", "get_openai_rate_limit_stats", lambda i: _asgi_request("GET", "openai/ratelimit")),
+        Scenario("GetOpenAIHedgeStats", "get_openai_hedge_stats", lambda i: _asgi_request("GET", "openai/hedges")),
+        Scenario("GetMetrics", "get_metrics", lambda i: _asgi_request("GET", "metrics")),
+        Scenario("GetWarmUp", "get_warm_up", lambda i: _asgi_request("GET", "warmup")),
+        Scenario("ListReportVersions", "get_report_versions", lambda i: _asgi_request("GET", "report/versions", {"surveyName": state["reportSurvey"]})),
+        Scenario("GetReportVersion", "get_report_version", lambda i: _asgi_request("GET", "report/version", report)),
+        Scenario("GetReportContent", "get_report_content", lambda i: _asgi_request("GET", "report/content", report)),
+        Scenario("GetReportContent?part=analysis", "get_report_content", lambda i: _asgi_request("GET", "report/content", dict(report, part="analysis"), headers={"Accept-Encoding": "gzip"}))
+    ]
+
+def _configure_jobs():
+    # Jobs are stored through the Cosmos fake and run on local worker threads
+    # instead of a Storage queue trigger.
+    queue = job_queue.LocalJobQueue()
+    job_queue.configure(job_queue.CosmosJobStore(), queue)
+    return queue
+
+async def _seed(forms):
+    client = db_utils.get_client()
+    for i in range(SEED_SURVEYS):
+        await asyncio.to_thread(db_utils.put_survey, client, f"load-{i}", _survey(i))
+    body = _analysis_body(forms)
+    report = await analysis_pipeline.run_analysis_async(
+        survey_name="load-0",
+        request=analysis_schema.Request.model_validate(body),
+        request_body=body,
+        system_prompt=system_message.ROI_EXPERT_SYSTEM_MESSAGE
+    )
+    queue = _configure_jobs()
+    job = await asyncio.to_thread(job_queue.submit_job, "load-0", body, system_message.ROI_EXPERT_SYSTEM_MESSAGE)
+    await asyncio.to_thread(queue.shutdown)
+    return {"reportSurvey": "load-0", "reportVersion": report["reportVersion"], "jobId": job["id"]}
+
+def _percentile(values, fraction):
+    # Nearest rank.
+    ordered = sorted(values)
+    return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
+
+async def _run_scenario(scenario, requests, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    errors = 0
+    queue = _configure_jobs()
+    before = fakes.call_counts()
+
+    async def one(i):
+        nonlocal errors
+        async with semaphore:
+            request = scenario.build(i)
+            start = time.perf_counter()
+            try:
+                status, body = await _invoke(scenario.handler, request)
+                failed = not scenario.ok(status, body)
+            except Exception as e:
+                logging.error(f"{scenario.name} request failed: {repr(e)}")
+                failed = True
+            latencies.append(time.perf_counter() - start)
+            errors += failed
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(requests)))
+    elapsed = time.perf_counter() - start
+    # Queued analysis jobs finish before their dependency calls are counted.
+    await asyncio.to_thread(queue.shutdown)
+    after = fakes.call_counts()
+    return {
+        "requests": requests,
+        "errors": errors,
+        "throughput": round(requests / elapsed, 2),
+        "p50": round(_percentile(latencies, 0.50), 4),
+        "p95": round(_percentile(latencies, 0.95), 4),
+        "p99": round(_percentile(latencies, 0.99), 4),
+        "calls": {name: round((after[name] - before.get(name, 0)) / requests, 2) for name in sorted(after)}
+    }
+
+async def _run(settings, only=None):
+    state = await _seed(settings["forms"])
+    results = {}
+    for scenario in _scenarios(state, settings["forms"]):
+        if only and scenario.name not in only:
+            continue
+        results[scenario.name] = await _run_scenario(scenario, settings["requests"], settings["concurrency"])
+    return results
+
+def _install(settings):
+    # The fakes have no tokens to hand out.
+    warmup.WARMUP_TOKEN_SCOPES = ()
+    fakes.install(
+        llm_latency=fakes.Latency.parse(settings["llm_ms"]),
+        cosmos_latency=fakes.Latency.parse(settings["cosmos_ms"]),
+        blob_latency=fakes.Latency.parse(settings["blob_ms"]),
+        keyvault_latency=fakes.Latency.parse(settings["keyvault_ms"]),
+        error_rate=settings["error_rate"],
+        throttle_rate=settings["throttle_rate"],
+        seed=settings["seed"]
+    )
+
+def _print(results):
+    dependencies = sorted({name for result in results.values() for name in result["calls"]})
+    print(f"{'route':34} {'req':>4} {'err':>4} {'req/s':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}  calls/req " + " ".join(f"{name:>8}" for name in dependencies))
+    for name, result in results.items():
+        calls = " ".join(f"{result['calls'].get(dependency, 0):8.2f}" for dependency in dependencies)
+        print(
+            f"{name:34} {result['requests']:4d} {result['errors']:4d} {result['throughput']:7.1f} "
+            f"{result['p50'] * 1000:8.1f} {result['p95'] * 1000:8.1f} {result['p99'] * 1000:8.1f}            {calls}"
+        )
+
+def _regressions(baseline, results, tolerance):
+    found = []
+    for name, expected in baseline.items():
+        result = results.get(name)
+        if result is None:
+            found.append(f"{name}: not run")
+            continue
+        if result["errors"] > expected["errors"]:
+            found.append(f"{name}: {result['errors']} errors, baseline {expected['errors']}")
+        if result["p95"] > expected["p95"] * (1 + tolerance) + LATENCY_SLACK_SECONDS:
+            found.append(f"{name}: p95 {result['p95'] * 1000:.1f}ms, baseline {expected['p95'] * 1000:.1f}ms")
+        # Compared as the phase's duration, so routes that take a millisecond
+        # are not flagged for noise.
+        elapsed, expected_elapsed = result["requests"] / result["throughput"], expected["requests"] / expected["throughput"]
+        if result["throughput"] < expected["throughput"] * (1 - tolerance) and elapsed - expected_elapsed > LATENCY_SLACK_SECONDS:
+            found.append(f"{name}: {result['throughput']} req/s, baseline {expected['throughput']} req/s")
+        for dependency, calls in result["calls"].items():
+            if calls > expected["calls"].get(dependency, 0) + CALLS_SLACK:
+                found.append(f"{name}: {calls} {dependency} calls/req, baseline {expected['calls'].get(dependency, 0)}")
+    return found
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=DEFAULT_SETTINGS["requests"], help="Requests per route.")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_SETTINGS["concurrency"])
+    parser.add_argument("--forms", type=int, default=DEFAULT_SETTINGS["forms"], help="Forms per analysis request.")
+    parser.add_argument("--llm-ms", default=DEFAULT_SETTINGS["llm_ms"])
+    parser.add_argument("--cosmos-ms", default=DEFAULT_SETTINGS["cosmos_ms"])
+    parser.add_argument("--blob-ms", default=DEFAULT_SETTINGS["blob_ms"])
+    parser.add_argument("--keyvault-ms", default=DEFAULT_SETTINGS["keyvault_ms"])
+    parser.add_argument("--error-rate", type=float, default=DEFAULT_SETTINGS["error_rate"], help="Share of dependency calls failing with a 5xx.")
+    parser.add_argument("--throttle-rate", type=float, default=DEFAULT_SETTINGS["throttle_rate"], help="Share of dependency calls throttled with a 429.")
+    parser.add_argument("--seed", type=int, default=DEFAULT_SETTINGS["seed"])
+    parser.add_argument("--routes", nargs="+", help="Only run these routes.")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--write-baseline", action="store_true")
+    parser.add_argument("--check", action="store_true", help="Rerun with the baseline's settings and compare.")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.CRITICAL)
+    baseline = None
+    if args.check:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        settings = baseline["settings"]
+    else:
+        settings = {name: getattr(args, name) for name in DEFAULT_SETTINGS}
+    _install(settings)
+    results = asyncio.run(_run(settings, args.routes))
+    _print(results)
+    if args.write_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump({"settings": settings, "routes": results}, f, indent=2)
+            f.write("\n")
+        print(f"wrote {args.baseline}")
+    if baseline is not None:
+        expected = {name: result for name, result in baseline["routes"].items() if not args.routes or name in args.routes}
+        regressions = _regressions(expected, results, args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+        print(f"no regressions against {args.baseline}")
+
+if __name__ == "__main__":
+    main()
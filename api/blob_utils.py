@@ -1,15 +1,108 @@
-import os, uuid
-from azure.identity import DefaultAzureCredential
+import os
+import gzip
+from urllib.parse import unquote, urlparse
+from azure.core import MatchConditions
+from azure.core.exceptions import ResourceNotFoundError, ServiceRequestError, ServiceResponseError
 from azure.storage.blob import BlobServiceClient, ContentSettings
-from retry import exponential_backoff
+import tracing
+from client_registry import registry, evict_on
+from retry import RetryPolicy, is_transient_azure_error
 
 BLOB_ENDPOINT = "https://changeaiblob.blob.core.windows.net"
+# Blobs smaller than this are stored as they are; gzip gains little on them.
+BLOB_GZIP_MIN_BYTES = int(os.environ.get("BLOB_GZIP_MIN_BYTES", "1024"))
+CONTENT_ENCODING_GZIP = "gzip"
+BLOB_COMPRESS_ARTIFACTS = os.environ.get("BLOB_COMPRESS_ARTIFACTS", "true").lower() == "true"
+BLOB_RETRY_POLICY = RetryPolicy("blob", is_retryable=is_transient_azure_error, retries=3, base_delay=0.2, max_delay=5.0)
+
+def _encode(data, compress):
+    # Returns (bytes, content_encoding); content_encoding is None when stored as is.
+    body = data.encode("utf-8") if isinstance(data, str) else data
+    if compress and len(body) >= BLOB_GZIP_MIN_BYTES:
+        return gzip.compress(body, compresslevel=6), CONTENT_ENCODING_GZIP
+    return body, None
+
+def is_gzip(properties):
+    return properties.content_settings.content_encoding == CONTENT_ENCODING_GZIP
+
+def parse_blob_url(url):
+    # Returns (container_name, blob_name) for a blob URL returned by upload_blob.
+    container_name, _, blob_name = unquote(urlparse(url).path).lstrip("/").partition("/")
+    if not container_name or not blob_name:
+        raise ValueError(f"Not a blob URL: {url}")
+    return container_name, blob_name
 
 def get_client():
-    return BlobServiceClient(BLOB_ENDPOINT, credential=DefaultAzureCredential())
+    return registry.get("blob", lambda: BlobServiceClient(BLOB_ENDPOINT, credential=registry.get_credential(), raw_response_hook=tracing.record_azure_response))
+
+def get_async_client():
+    from azure.storage.blob.aio import BlobServiceClient as AsyncBlobServiceClient
+    return registry.get("blob-aio", lambda: AsyncBlobServiceClient(BLOB_ENDPOINT, credential=registry.get_async_credential(), raw_response_hook=tracing.record_azure_response))
 
-@exponential_backoff(initial_delay=1, retries=3)
-def upload_blob(client, container_name, blob_name, content_type, data):
+@tracing.traced("blob")
+@evict_on(ServiceRequestError, ServiceResponseError)
+@BLOB_RETRY_POLICY
+def upload_blob(client, container_name, blob_name, content_type, data, compress=False):
+    body, content_encoding = _encode(data, compress)
     blob_client = client.get_blob_client(container=container_name, blob=blob_name)
-    blob_client.upload_blob(data, overwrite=True, content_settings=ContentSettings(content_type=content_type))
+    blob_client.upload_blob(body, overwrite=True, content_settings=ContentSettings(content_type=content_type, content_encoding=content_encoding))
     return blob_client.url
+
+@tracing.traced("blob")
+@evict_on(ServiceRequestError, ServiceResponseError)
+@BLOB_RETRY_POLICY
+async def upload_blob_async(client, container_name, blob_name, content_type, data, compress=False):
+    body, content_encoding = _encode(data, compress)
+    blob_client = client.get_blob_client(container=container_name, blob=blob_name)
+    await blob_client.upload_blob(body, overwrite=True, content_settings=ContentSettings(content_type=content_type, content_encoding=content_encoding))
+    return blob_client.url
+
+@tracing.traced("blob")
+@evict_on(ServiceRequestError, ServiceResponseError)
+@BLOB_RETRY_POLICY
+def download_blob(client, container_name, blob_name):
+    blob_client = client.get_blob_client(container=container_name, blob=blob_name)
+    try:
+        # The SDK would otherwise decode gzip transparently, but only for some
+        # transports; decoding here keeps compressed and plain blobs alike.
+        downloader = blob_client.download_blob(decompress=False)
+        data = downloader.readall()
+    except ResourceNotFoundError:
+        return None
+    return gzip.decompress(data) if is_gzip(downloader.properties) else data
+
+@tracing.traced("blob")
+@evict_on(ServiceRequestError, ServiceResponseError)
+@BLOB_RETRY_POLICY
+async def download_blob_async(client, container_name, blob_name):
+    blob_client = client.get_blob_client(container=container_name, blob=blob_name)
+    try:
+        downloader = await blob_client.download_blob(decompress=False)
+        data = await downloader.readall()
+    except ResourceNotFoundError:
+        return None
+    return gzip.decompress(data) if is_gzip(downloader.properties) else data
+
+@tracing.traced("blob")
+@evict_on(ServiceRequestError, ServiceResponseError)
+@BLOB_RETRY_POLICY
+async def open_blob_async(client, container_name, blob_name, offset=None, length=None, if_none_match=None):
+    # Starts a download of the stored (possibly gzip encoded) bytes and returns
+    # the downloader, or None if the blob does not exist. Raises
+    # ResourceNotModifiedError when the blob still has the if_none_match etag.
+    blob_client = client.get_blob_client(container=container_name, blob=blob_name)
+    conditions = {"etag": if_none_match, "match_condition": MatchConditions.IfModified} if if_none_match else {}
+    try:
+        return await blob_client.download_blob(offset=offset, length=length, decompress=False, **conditions)
+    except ResourceNotFoundError:
+        return None
+
+@tracing.traced("blob")
+@evict_on(ServiceRequestError, ServiceResponseError)
+@BLOB_RETRY_POLICY
+def delete_blob(client, container_name, blob_name):
+    blob_client = client.get_blob_client(container=container_name, blob=blob_name)
+    try:
+        blob_client.delete_blob()
+    except ResourceNotFoundError:
+        return None
@@ -0,0 +1,166 @@
+import asyncio
+import atexit
+import functools
+import hashlib
+import inspect
+import threading
+import log_utils
+
+# One long-lived client per service per worker process. Azure SDK and OpenAI
+# clients are thread-safe and keep their HTTP connection pools warm, and the
+# shared DefaultAzureCredential caches tokens across every Azure client.
+
+def key_digest(secret):
+    # Clients built from a secret are keyed by a digest of it, so a rotated
+    # secret gets its own client.
+    return hashlib.sha256(secret.encode("utf-8")).hexdigest()[:16]
+
+class ClientRegistry:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._clients = {}
+        self._credential = None
+        self._async_credential = None
+        self._closed = False
+
+    def get_credential(self):
+        credential = self._credential
+        if credential is not None:
+            return credential
+        with self._lock:
+            if self._credential is None:
+                # Imported here, like the SDK clients, so importing the app does
+                # not pay for azure.identity.
+                from azure.identity import DefaultAzureCredential
+                self._credential = DefaultAzureCredential()
+            return self._credential
+
+    def get_async_credential(self):
+        credential = self._async_credential
+        if credential is not None:
+            return credential
+        with self._lock:
+            if self._async_credential is None:
+                from azure.identity.aio import DefaultAzureCredential as AsyncDefaultAzureCredential
+                self._async_credential = AsyncDefaultAzureCredential()
+            return self._async_credential
+
+    def register(self, key, client):
+        # Installs a pre-built client, e.g. an in-memory fake for benchmarks.
+        with self._lock:
+            self._clients[key] = client
+
+    def get(self, key, factory):
+        client = self._clients.get(key)
+        if client is not None:
+            return client
+        with self._lock:
+            client = self._clients.get(key)
+            if client is None:
+                if self._closed:
+                    raise RuntimeError(f"Client registry is closed, cannot create client '{key}'")
+                client = factory()
+                self._clients[key] = client
+                log_utils.info("Client registry created client", key=key)
+            return client
+
+    def evict(self, key):
+        # Evicted clients are not closed here: other threads may still be
+        # finishing requests on them, so they are left to the garbage collector.
+        with self._lock:
+            client = self._clients.pop(key, None)
+        if client is not None:
+            log_utils.warning("Client registry evicted client", key=key)
+
+    def evict_client(self, client):
+        with self._lock:
+            keys = [k for k, c in self._clients.items() if c is client]
+        for key in keys:
+            self.evict(key)
+
+    def _drain(self):
+        with self._lock:
+            self._closed = True
+            resources = list(self._clients.values())
+            self._clients.clear()
+            resources += [c for c in (self._credential, self._async_credential) if c is not None]
+            self._credential = None
+            self._async_credential = None
+        return resources
+
+    def close(self):
+        # Async clients need a running loop to close; at interpreter exit there
+        # is none, so their pending close coroutines are discarded.
+        for resource in self._drain():
+            _close_quietly(resource)
+
+    async def aclose(self):
+        for resource in self._drain():
+            result = _close_quietly(resource)
+            if inspect.isawaitable(result):
+                try:
+                    await result
+                except Exception as e:
+                    log_utils.warning("Client registry failed to close client", type=type(resource).__name__, error=e)
+
+def _close_quietly(resource):
+    close = getattr(resource, "close", None)
+    if close is None:
+        return
+    try:
+        result = close()
+    except Exception as e:
+        log_utils.warning("Client registry failed to close client", type=type(resource).__name__, error=e)
+        return None
+    if inspect.iscoroutine(result) and not _in_running_loop():
+        result.close()
+        return None
+    return result
+
+def _in_running_loop():
+    try:
+        asyncio.get_running_loop()
+        return True
+    except RuntimeError:
+        return False
+
+def evict_on(*errors):
+    # Drops the client passed as the first argument (or `client=`) from the
+    # registry when it fails with a fatal transport error, so the next caller
+    # gets a freshly built client instead of a broken connection pool.
+    def evict(args, kwargs):
+        client = kwargs.get("client", args[0] if args else None)
+        if client is not None:
+            registry.evict_client(client)
+    def decorator(func):
+        if inspect.isasyncgenfunction(func):
+            @functools.wraps(func)
+            async def async_gen_wrapper(*args, **kwargs):
+                try:
+                    async for item in func(*args, **kwargs):
+                        yield item
+                except errors as e:
+                    evict(args, kwargs)
+                    raise e
+            return async_gen_wrapper
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                try:
+                    return await func(*args, **kwargs)
+                except errors as e:
+                    evict(args, kwargs)
+                    raise e
+            return async_wrapper
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            try:
+                return func(*args, **kwargs)
+            except errors as e:
+                evict(args, kwargs)
+                raise e
+        return wrapper
+    return decorator
+
+registry = ClientRegistry()
+atexit.register(registry.close)
@@ -1,21 +1,66 @@
+import asyncio
+import base64
+import binascii
+import hashlib
+import json
+import os
 from azure.cosmos import CosmosClient
-from azure.cosmos.exceptions import CosmosResourceNotFoundError
-from azure.identity import DefaultAzureCredential
-from retry import exponential_backoff
+from azure.cosmos.exceptions import CosmosAccessConditionFailedError, CosmosBatchOperationError, CosmosResourceExistsError, CosmosResourceNotFoundError
+from azure.core import MatchConditions
+from azure.core.exceptions import ServiceRequestError, ServiceResponseError
+import read_cache
+import tracing
+from client_registry import registry, evict_on
+from retry import RetryPolicy, is_transient_azure_error, status_code_of
 
 REPORTS_CONTAINER_NAME = "reports"
+JOBS_CONTAINER_NAME = "jobs"
+RATE_LIMITS_CONTAINER_NAME = "ratelimits"
 SURVEY_CONTAINER_NAME = "surveysV2"
 SURVEY_PARTITION_KEY = "surveyPartition"
 SURVEY_PARTITION_VALUE = "survey"
+# "legacy" keeps every survey in one logical partition of surveysV2. "sharded"
+# partitions surveysV3 by survey name and lists surveys from a catalogue
+# container. "dual" is the migration phase: reads stay on the legacy container
+# while writes go to both layouts (see migrate_surveys.py).
+SURVEY_LAYOUT_LEGACY = "legacy"
+SURVEY_LAYOUT_DUAL = "dual"
+SURVEY_LAYOUT_SHARDED = "sharded"
+SURVEY_STORAGE_LAYOUT = os.environ.get("SURVEY_STORAGE_LAYOUT", SURVEY_LAYOUT_LEGACY)
+SHARDED_SURVEY_CONTAINER_NAME = "surveysV3"
+SURVEY_CATALOGUE_CONTAINER_NAME = "surveyCatalogue"
+CATALOGUE_PARTITION_KEY = "cataloguePartition"
+# Catalogue entries are small but written on every survey write, so they are
+# spread over a fixed number of partitions. Changing the count moves entries
+# between shards; re-run the migrate_surveys.py copy with --restart afterwards.
+SURVEY_CATALOGUE_SHARDS = int(os.environ.get("SURVEY_CATALOGUE_SHARDS", "16"))
 ID_KEY = "id"
 REPORT_VERSION_KEY = "reportVersion"
 REPORT_PARTITION_KEY = "surveyName"
 DATA_KEY = "data"
 SURVEY_QUERY = "SELECT c.id FROM c"
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+# Transactional batches are limited to 100 operations and 2MB per partition key.
+MAX_BATCH_OPERATIONS = 100
+MAX_BATCH_BYTES = 1_500_000
+SURVEY_EXPORT_QUERY = "SELECT c.id, c.data FROM c"
 REPORT_VERSION_QUERY = "SELECT c.reportVersion FROM c WHERE c.surveyName = @surveyName ORDER BY c.reportVersion DESC"
+# Served by the (surveyName ASC, reportVersion DESC) composite index in
+# scripts/cosmos/reports_indexing_policy.json.
+REPORT_VERSION_PAGE_QUERY = "SELECT {top}c.reportVersion FROM c WHERE c.surveyName = @surveyName{filters} ORDER BY c.reportVersion DESC"
+REPORT_LATEST_QUERY = "SELECT TOP 1 c.data FROM c WHERE c.surveyName = @surveyName ORDER BY c.reportVersion DESC"
 DB_NAME = "changeai-db"
 COSMOS_ENDPOINT = "https://changeai-storage.documents.azure.com:443"
 
+def _is_retryable(e):
+    # 449 is Cosmos' "retry with" for conflicting concurrent writes.
+    return status_code_of(e) == 449 or is_transient_azure_error(e)
+
+# The Cosmos SDK already retries throttled (429) requests internally, so this
+# policy stays short and mainly covers transport failures and 5xx responses.
+COSMOS_RETRY_POLICY = RetryPolicy("cosmos", is_retryable=_is_retryable, retries=3, base_delay=0.2, max_delay=5.0)
+
 def _get_container_client(client, container):
     database = client.get_database_client(database=DB_NAME)
     return database.get_container_client(container=container)
@@ -23,48 +68,236 @@ def _get_container_client(client, container):
 def _create_report_version_id(surveyName, version):
     return f"{surveyName}:{version}"
 
+def _strip_system_properties(item):
+    return {k: v for k, v in item.items() if not k.startswith("_")}
+
 def get_client():
-    return CosmosClient(url=COSMOS_ENDPOINT, credential=DefaultAzureCredential())
+    return registry.get("cosmos", lambda: CosmosClient(url=COSMOS_ENDPOINT, credential=registry.get_credential(), raw_response_hook=tracing.record_azure_response))
+
+def get_async_client():
+    from azure.cosmos.aio import CosmosClient as AsyncCosmosClient
+    return registry.get("cosmos-aio", lambda: AsyncCosmosClient(url=COSMOS_ENDPOINT, credential=registry.get_async_credential(), raw_response_hook=tracing.record_azure_response))
+
+def encode_continuation_token(token):
+    # Cosmos tokens are JSON; callers get them url-safe and opaque.
+    return base64.urlsafe_b64encode(token.encode("utf-8")).decode("ascii") if token else None
+
+def decode_continuation_token(token):
+    if not token:
+        return None
+    try:
+        return base64.urlsafe_b64decode(token.encode("ascii")).decode("utf-8")
+    except (binascii.Error, UnicodeError) as e:
+        raise ValueError(f"Invalid continuation token: {repr(e)}") from e
+
+def _query_page(container, query, parameters, partition_key, page_size, continuation_token):
+    # Returns one page of results and the opaque token for the next page, or
+    # None when this was the last one.
+    pages = container.query_items(
+        query=query,
+        parameters=parameters,
+        partition_key=partition_key,
+        enable_cross_partition_query=False,
+        max_item_count=page_size
+    ).by_page(decode_continuation_token(continuation_token))
+    page = next(pages, None)
+    items = list(page) if page is not None else []
+    return items, encode_continuation_token(pages.continuation_token)
+
+def _survey_container(client, layout):
+    name = SHARDED_SURVEY_CONTAINER_NAME if layout == SURVEY_LAYOUT_SHARDED else SURVEY_CONTAINER_NAME
+    return _get_container_client(client, name)
+
+def _survey_partition(name, layout):
+    return name if layout == SURVEY_LAYOUT_SHARDED else SURVEY_PARTITION_VALUE
+
+def _read_layout():
+    # Until the migration is complete the legacy container stays the source of truth.
+    return SURVEY_LAYOUT_SHARDED if SURVEY_STORAGE_LAYOUT == SURVEY_LAYOUT_SHARDED else SURVEY_LAYOUT_LEGACY
+
+def _write_layouts():
+    if SURVEY_STORAGE_LAYOUT == SURVEY_LAYOUT_DUAL:
+        return (SURVEY_LAYOUT_LEGACY, SURVEY_LAYOUT_SHARDED)
+    return (_read_layout(),)
+
+def _catalogue_shard_partition(shard):
+    return f"catalogue-{shard:02d}"
+
+def catalogue_partition(name):
+    # A stable hash, unlike hash(), so every instance picks the same shard.
+    digest = hashlib.sha256(name.encode("utf-8")).hexdigest()
+    return _catalogue_shard_partition(int(digest[:8], 16) % SURVEY_CATALOGUE_SHARDS)
+
+def survey_record(name, content, layout):
+    record = {}
+    record[ID_KEY] = name
+    record[DATA_KEY] = content
+    record[SURVEY_PARTITION_KEY] = _survey_partition(name, layout)
+    return record
+
+def catalogue_record(name):
+    record = {}
+    record[ID_KEY] = name
+    record[CATALOGUE_PARTITION_KEY] = catalogue_partition(name)
+    return record
+
+def _encode_catalogue_token(shard, token):
+    return encode_continuation_token(json.dumps({"shard": shard, "token": token}))
+
+def _decode_catalogue_token(token):
+    if not token:
+        return 0, None
+    try:
+        position = json.loads(decode_continuation_token(token))
+        return int(position["shard"]), position["token"]
+    except (KeyError, TypeError, json.JSONDecodeError) as e:
+        raise ValueError(f"Invalid continuation token: {repr(e)}") from e
+
+def _list_catalogue_page(client, page_size, continuation_token):
+    # Walks the catalogue shards in order, one single-partition query at a
+    # time; the token records the shard as well as the position within it.
+    container = _get_container_client(client, SURVEY_CATALOGUE_CONTAINER_NAME)
+    shard, token = _decode_catalogue_token(continuation_token)
+    while shard < SURVEY_CATALOGUE_SHARDS:
+        items, token = _query_page(container, SURVEY_QUERY, None, _catalogue_shard_partition(shard), page_size, token)
+        if token is None:
+            shard += 1
+        if items or token is not None:
+            has_more = shard < SURVEY_CATALOGUE_SHARDS
+            return [d[ID_KEY] for d in items], _encode_catalogue_token(shard, token) if has_more else None
+    return [], None
+
+@tracing.traced("cosmos")
+@evict_on(ServiceRequestError, ServiceResponseError)
+@COSMOS_RETRY_POLICY
+def list_surveys_page(client, page_size=DEFAULT_PAGE_SIZE, continuation_token=None):
+    if _read_layout() == SURVEY_LAYOUT_SHARDED:
+        return _list_catalogue_page(client, page_size, continuation_token)
+    container = _survey_container(client, SURVEY_LAYOUT_LEGACY)
+    items, next_token = _query_page(container, SURVEY_QUERY, None, SURVEY_PARTITION_VALUE, page_size, continuation_token)
+    return [d[ID_KEY] for d in items], next_token
 
-@exponential_backoff(initial_delay=1, retries=3)
 def list_surveys(client):
-    container = _get_container_client(client, SURVEY_CONTAINER_NAME)
-    results = container.query_items(query=SURVEY_QUERY, partition_key=SURVEY_PARTITION_VALUE, enable_cross_partition_query=False)
-    return [d[ID_KEY] for d in results]
+    survey_names, continuation_token = list_surveys_page(client, page_size=MAX_PAGE_SIZE)
+    while continuation_token:
+        names, continuation_token = list_surveys_page(client, page_size=MAX_PAGE_SIZE, continuation_token=continuation_token)
+        survey_names.extend(names)
+    return survey_names
 
-@exponential_backoff(initial_delay=1, retries=3)
+@tracing.traced("cosmos")
+@evict_on(ServiceRequestError, ServiceResponseError)
+@COSMOS_RETRY_POLICY
 def get_survey(client, name):
-    container = _get_container_client(client, SURVEY_CONTAINER_NAME)
+    layout = _read_layout()
+    container = _survey_container(client, layout)
     try:
-        return container.read_item(item=name, partition_key=SURVEY_PARTITION_VALUE)[DATA_KEY]
+        return container.read_item(item=name, partition_key=_survey_partition(name, layout))[DATA_KEY]
     except CosmosResourceNotFoundError:
         return None
 
-@exponential_backoff(initial_delay=1, retries=3)
+@tracing.traced("cosmos")
+@evict_on(ServiceRequestError, ServiceResponseError)
+@COSMOS_RETRY_POLICY
+def _read_survey_item(client, name):
+    layout = _read_layout()
+    try:
+        return _survey_container(client, layout).read_item(item=name, partition_key=_survey_partition(name, layout))
+    except CosmosResourceNotFoundError:
+        return None
+
+def get_survey_entry(client, name, max_age=read_cache.SURVEY_CACHE_MAX_AGE_SECONDS):
+    # Returns a read_cache.Entry with the survey and its document etag, or None.
+    entry = read_cache.surveys.get(name, max_age)
+    if entry is not None:
+        return entry
+    item = _read_survey_item(client, name)
+    if item is None:
+        read_cache.surveys.invalidate(name)
+        return None
+    return read_cache.surveys.put(name, item[DATA_KEY], item["_etag"])
+
+@tracing.traced("cosmos")
+@evict_on(ServiceRequestError, ServiceResponseError)
+@COSMOS_RETRY_POLICY
 def put_survey(client, name, content):
-    record = {}
-    record[ID_KEY] = name
-    record[DATA_KEY] = content
-    record[SURVEY_PARTITION_KEY] = SURVEY_PARTITION_VALUE
-    container = _get_container_client(client, SURVEY_CONTAINER_NAME)
-    container.upsert_item(body=record)
+    # The cached survey is dropped before the write and again once it is done,
+    # so a read that raced the write cannot leave the old survey cached.
+    read_cache.surveys.invalidate(name)
+    try:
+        for layout in _write_layouts():
+            _survey_container(client, layout).upsert_item(body=survey_record(name, content, layout))
+            if layout == SURVEY_LAYOUT_SHARDED:
+                # Surveys are only listed through the catalogue in this layout, so
+                # the entry is written after the survey itself.
+                _get_container_client(client, SURVEY_CATALOGUE_CONTAINER_NAME).upsert_item(body=catalogue_record(name))
+    finally:
+        read_cache.surveys.invalidate(name)
 
-@exponential_backoff(initial_delay=1, retries=3)
+@tracing.traced("cosmos")
+@evict_on(ServiceRequestError, ServiceResponseError)
+@COSMOS_RETRY_POLICY
 def delete_survey(client, name):
-    container = _get_container_client(client, SURVEY_CONTAINER_NAME)
+    # Invalidated before and after, as in put_survey.
+    read_cache.surveys.invalidate(name)
     try:
-        container.delete_item(item=name, partition_key=name)
-    except CosmosResourceNotFoundError:
-        return None
+        for layout in _write_layouts():
+            if layout == SURVEY_LAYOUT_SHARDED:
+                try:
+                    _get_container_client(client, SURVEY_CATALOGUE_CONTAINER_NAME).delete_item(item=name, partition_key=catalogue_partition(name))
+                except CosmosResourceNotFoundError:
+                    pass
+            try:
+                _survey_container(client, layout).delete_item(item=name, partition_key=_survey_partition(name, layout))
+            except CosmosResourceNotFoundError:
+                pass
+    finally:
+        read_cache.surveys.invalidate(name)
 
-@exponential_backoff(initial_delay=1, retries=3)
+@tracing.traced("cosmos")
+@evict_on(ServiceRequestError, ServiceResponseError)
+@COSMOS_RETRY_POLICY
 def list_report_versions(client, surveyName):
     container = _get_container_client(client, REPORTS_CONTAINER_NAME)
     parameters = [{"name": "@surveyName", "value": surveyName}]
     results = container.query_items(query=REPORT_VERSION_QUERY, parameters=parameters, partition_key=surveyName, enable_cross_partition_query=False)
     return [d[REPORT_VERSION_KEY] for d in results]
 
-@exponential_backoff(initial_delay=1, retries=3)
+@tracing.traced("cosmos")
+@evict_on(ServiceRequestError, ServiceResponseError)
+@COSMOS_RETRY_POLICY
+def list_report_versions_page(client, surveyName, page_size=DEFAULT_PAGE_SIZE, continuation_token=None, limit=None, since=None, before=None):
+    # Newest first. `since` is inclusive and `before` exclusive; `limit` caps
+    # the total across all pages. Continuation requests must repeat the same
+    # filters and limit, since the token is tied to the query text.
+    container = _get_container_client(client, REPORTS_CONTAINER_NAME)
+    parameters = [{"name": "@surveyName", "value": surveyName}]
+    filters = ""
+    if since is not None:
+        filters += " AND c.reportVersion >= @since"
+        parameters.append({"name": "@since", "value": since})
+    if before is not None:
+        filters += " AND c.reportVersion < @before"
+        parameters.append({"name": "@before", "value": before})
+    top = ""
+    if limit is not None:
+        top = "TOP @limit "
+        parameters.append({"name": "@limit", "value": limit})
+    query = REPORT_VERSION_PAGE_QUERY.format(top=top, filters=filters)
+    items, next_token = _query_page(container, query, parameters, surveyName, page_size, continuation_token)
+    return [d[REPORT_VERSION_KEY] for d in items], next_token
+
+@tracing.traced("cosmos")
+@evict_on(ServiceRequestError, ServiceResponseError)
+@COSMOS_RETRY_POLICY
+def get_latest_report_version(client, surveyName):
+    container = _get_container_client(client, REPORTS_CONTAINER_NAME)
+    parameters = [{"name": "@surveyName", "value": surveyName}]
+    results = list(container.query_items(query=REPORT_LATEST_QUERY, parameters=parameters, partition_key=surveyName))
+    return results[0][DATA_KEY] if results else None
+
+@tracing.traced("cosmos")
+@evict_on(ServiceRequestError, ServiceResponseError)
+@COSMOS_RETRY_POLICY
 def get_report_version(client, surveyName, reportVersion):
     container = _get_container_client(client, REPORTS_CONTAINER_NAME)
     try:
@@ -72,12 +305,328 @@ def get_report_version(client, surveyName, reportVersion):
     except CosmosResourceNotFoundError:
         return None
 
-@exponential_backoff(initial_delay=1, retries=3)
+@tracing.traced("cosmos")
+@evict_on(ServiceRequestError, ServiceResponseError)
+@COSMOS_RETRY_POLICY
+def _read_report_version_item(client, surveyName, reportVersion):
+    container = _get_container_client(client, REPORTS_CONTAINER_NAME)
+    try:
+        return container.read_item(item=_create_report_version_id(surveyName, reportVersion), partition_key=surveyName)
+    except CosmosResourceNotFoundError:
+        return None
+
+def get_report_version_entry(client, surveyName, reportVersion):
+    # Returns a read_cache.Entry with the report and its document etag, or None.
+    # Missing versions are not cached, since they may be written later.
+    key = (surveyName, reportVersion)
+    entry = read_cache.reports.get(key)
+    if entry is not None:
+        return entry
+    item = _read_report_version_item(client, surveyName, reportVersion)
+    if item is None:
+        return None
+    return read_cache.reports.put(key, item[DATA_KEY], item["_etag"])
+
+@tracing.traced("cosmos")
+@evict_on(ServiceRequestError, ServiceResponseError)
+@COSMOS_RETRY_POLICY
 def put_report_version(client, surveyName, reportVersion, content):
+    read_cache.reports.invalidate((surveyName, reportVersion))
+    record = {}
+    record[ID_KEY] = _create_report_version_id(surveyName, reportVersion)
+    record[DATA_KEY] = content
+    record[REPORT_PARTITION_KEY] = surveyName
+    record[REPORT_VERSION_KEY] = reportVersion
+    container = _get_container_client(client, REPORTS_CONTAINER_NAME)
+    container.upsert_item(body=record)
+
+def _report_version_record(surveyName, reportVersion, content):
     record = {}
     record[ID_KEY] = _create_report_version_id(surveyName, reportVersion)
     record[DATA_KEY] = content
     record[REPORT_PARTITION_KEY] = surveyName
     record[REPORT_VERSION_KEY] = reportVersion
+    return record
+
+@tracing.traced("cosmos")
+@evict_on(ServiceRequestError, ServiceResponseError)
+@COSMOS_RETRY_POLICY
+async def get_survey_async(client, name):
+    layout = _read_layout()
+    container = _survey_container(client, layout)
+    try:
+        return (await container.read_item(item=name, partition_key=_survey_partition(name, layout)))[DATA_KEY]
+    except CosmosResourceNotFoundError:
+        return None
+
+async def _query_page_async(container, query, parameters, partition_key, page_size, continuation_token):
+    pages = container.query_items(
+        query=query,
+        parameters=parameters,
+        partition_key=partition_key,
+        max_item_count=page_size
+    ).by_page(decode_continuation_token(continuation_token))
+    page = await anext(pages, None)
+    items = [item async for item in page] if page is not None else []
+    return items, encode_continuation_token(pages.continuation_token)
+
+@tracing.traced("cosmos")
+@evict_on(ServiceRequestError, ServiceResponseError)
+@COSMOS_RETRY_POLICY
+async def list_legacy_surveys_page_async(client, page_size=DEFAULT_PAGE_SIZE, continuation_token=None):
+    # Full survey documents from the legacy container, for migration.
+    container = _survey_container(client, SURVEY_LAYOUT_LEGACY)
+    items, next_token = await _query_page_async(container, "SELECT * FROM c", None, SURVEY_PARTITION_VALUE, page_size, continuation_token)
+    return [_strip_system_properties(item) for item in items], next_token
+
+@tracing.traced("cosmos")
+@evict_on(ServiceRequestError, ServiceResponseError)
+@COSMOS_RETRY_POLICY
+async def legacy_survey_exists_async(client, name):
+    container = _survey_container(client, SURVEY_LAYOUT_LEGACY)
+    try:
+        await container.read_item(item=name, partition_key=SURVEY_PARTITION_VALUE)
+    except CosmosResourceNotFoundError:
+        return False
+    return True
+
+@tracing.traced("cosmos")
+@evict_on(ServiceRequestError, ServiceResponseError)
+@COSMOS_RETRY_POLICY
+async def create_sharded_survey_async(client, name, content):
+    # Returns False if the survey already exists in the sharded container,
+    # e.g. because a dual write got there first.
+    container = _survey_container(client, SURVEY_LAYOUT_SHARDED)
+    try:
+        await container.create_item(body=survey_record(name, content, SURVEY_LAYOUT_SHARDED))
+    except CosmosResourceExistsError:
+        return False
+    return True
+
+@tracing.traced("cosmos")
+@evict_on(ServiceRequestError, ServiceResponseError)
+@COSMOS_RETRY_POLICY
+async def delete_sharded_survey_async(client, name):
+    for container_name, partition in (
+        (SURVEY_CATALOGUE_CONTAINER_NAME, catalogue_partition(name)),
+        (SHARDED_SURVEY_CONTAINER_NAME, name)
+    ):
+        try:
+            await _get_container_client(client, container_name).delete_item(item=name, partition_key=partition)
+        except CosmosResourceNotFoundError:
+            pass
+
+@tracing.traced("cosmos")
+@COSMOS_RETRY_POLICY
+async def _put_catalogue_group_async(container, partition, records):
+    for start in range(0, len(records), MAX_BATCH_OPERATIONS):
+        operations = [("upsert", (record,)) for record in records[start:start + MAX_BATCH_OPERATIONS]]
+        await container.execute_item_batch(batch_operations=operations, partition_key=partition)
+
+@tracing.traced("cosmos")
+@evict_on(ServiceRequestError, ServiceResponseError)
+async def put_catalogue_entries_async(client, names):
+    # Entries of the same shard go out as one transactional batch; the shards
+    # are written concurrently.
+    container = _get_container_client(client, SURVEY_CATALOGUE_CONTAINER_NAME)
+    groups = {}
+    for name in names:
+        record = catalogue_record(name)
+        groups.setdefault(record[CATALOGUE_PARTITION_KEY], []).append(record)
+    await asyncio.gather(*(_put_catalogue_group_async(container, partition, records) for partition, records in groups.items()))
+
+@tracing.traced("cosmos")
+@evict_on(ServiceRequestError, ServiceResponseError)
+@COSMOS_RETRY_POLICY
+async def list_catalogue_shard_page_async(client, shard, page_size=DEFAULT_PAGE_SIZE, continuation_token=None):
+    container = _get_container_client(client, SURVEY_CATALOGUE_CONTAINER_NAME)
+    items, next_token = await _query_page_async(container, SURVEY_QUERY, None, _catalogue_shard_partition(shard), page_size, continuation_token)
+    return [d[ID_KEY] for d in items], next_token
+
+def _batch_chunks(records):
+    # Splits records into transactional batches within the operation and size limits.
+    chunk, chunk_bytes = [], 0
+    for record in records:
+        record_bytes = len(json.dumps(record))
+        if chunk and (len(chunk) == MAX_BATCH_OPERATIONS or chunk_bytes + record_bytes > MAX_BATCH_BYTES):
+            yield chunk
+            chunk, chunk_bytes = [], 0
+        chunk.append(record)
+        chunk_bytes += record_bytes
+    if chunk:
+        yield chunk
+
+@tracing.traced("cosmos")
+@COSMOS_RETRY_POLICY
+async def _upsert_async(container, record):
+    await container.upsert_item(body=record)
+
+async def _upsert_each_async(container, records):
+    # Returns one error (or None) per record.
+    results = await asyncio.gather(*(_upsert_async(container, record) for record in records), return_exceptions=True)
+    return [repr(result) if isinstance(result, Exception) else None for result in results]
+
+@tracing.traced("cosmos")
+@COSMOS_RETRY_POLICY
+async def _execute_upsert_batch_async(container, partition, records):
+    await container.execute_item_batch(batch_operations=[("upsert", (record,)) for record in records], partition_key=partition)
+
+async def _upsert_partition_async(container, partition, records):
+    # Records sharing a partition go out as transactional batches. A batch
+    # fails as a whole, so a failed one is retried record by record to find
+    # out which records were at fault.
+    errors = []
+    for chunk in _batch_chunks(records):
+        if len(chunk) == 1:
+            errors.extend(await _upsert_each_async(container, chunk))
+            continue
+        try:
+            await _execute_upsert_batch_async(container, partition, chunk)
+            errors.extend([None] * len(chunk))
+        except CosmosBatchOperationError:
+            errors.extend(await _upsert_each_async(container, chunk))
+    return errors
+
+@tracing.traced("cosmos")
+@evict_on(ServiceRequestError, ServiceResponseError)
+async def put_surveys_async(client, surveys):
+    # `surveys` is a list of (name, content) with unique names. Returns one
+    # error string (or None on success) per survey, in the same order. Cached
+    # surveys are invalidated before and after, as in put_survey.
+    for name, _ in surveys:
+        read_cache.surveys.invalidate(name)
+    errors = [None] * len(surveys)
+    try:
+        for layout in _write_layouts():
+            container = _survey_container(client, layout)
+            records = [survey_record(name, content, layout) for name, content in surveys]
+            if layout == SURVEY_LAYOUT_SHARDED:
+                layout_errors = await _upsert_each_async(container, records)
+                written = [name for (name, _), error in zip(surveys, layout_errors) if error is None]
+                await put_catalogue_entries_async(client, written)
+            else:
+                layout_errors = await _upsert_partition_async(container, SURVEY_PARTITION_VALUE, records)
+            errors = [error or layout_error for error, layout_error in zip(errors, layout_errors)]
+    finally:
+        for name, _ in surveys:
+            read_cache.surveys.invalidate(name)
+    return errors
+
+@tracing.traced("cosmos")
+@evict_on(ServiceRequestError, ServiceResponseError)
+@COSMOS_RETRY_POLICY
+async def list_survey_contents_page_async(client, page_size=DEFAULT_PAGE_SIZE, continuation_token=None):
+    # Returns ([(name, content)], next token) for export. The sharded layout
+    # has no single partition to read, so a cross-partition query is used.
+    layout = _read_layout()
+    container = _survey_container(client, layout)
+    partition_key = SURVEY_PARTITION_VALUE if layout == SURVEY_LAYOUT_LEGACY else None
+    items, next_token = await _query_page_async(container, SURVEY_EXPORT_QUERY, None, partition_key, page_size, continuation_token)
+    return [(item[ID_KEY], item[DATA_KEY]) for item in items], next_token
+
+@tracing.traced("cosmos")
+@evict_on(ServiceRequestError, ServiceResponseError)
+@COSMOS_RETRY_POLICY
+async def put_report_version_async(client, surveyName, reportVersion, content):
+    read_cache.reports.invalidate((surveyName, reportVersion))
+    container = _get_container_client(client, REPORTS_CONTAINER_NAME)
+    await container.upsert_item(body=_report_version_record(surveyName, reportVersion, content))
+
+@tracing.traced("cosmos")
+@evict_on(ServiceRequestError, ServiceResponseError)
+@COSMOS_RETRY_POLICY
+async def get_latest_report_version_async(client, surveyName):
+    container = _get_container_client(client, REPORTS_CONTAINER_NAME)
+    parameters = [{"name": "@surveyName", "value": surveyName}]
+    results = [item async for item in container.query_items(query=REPORT_LATEST_QUERY, parameters=parameters, partition_key=surveyName)]
+    return results[0][DATA_KEY] if results else None
+
+@tracing.traced("cosmos")
+@COSMOS_RETRY_POLICY
+async def _put_report_version_group_async(container, surveyName, records):
+    if len(records) == 1:
+        await container.upsert_item(body=records[0])
+        return
+    for start in range(0, len(records), MAX_BATCH_OPERATIONS):
+        operations = [("upsert", (record,)) for record in records[start:start + MAX_BATCH_OPERATIONS]]
+        await container.execute_item_batch(batch_operations=operations, partition_key=surveyName)
+
+@tracing.traced("cosmos")
+@evict_on(ServiceRequestError, ServiceResponseError)
+async def put_report_versions_async(client, reports):
+    # `reports` is a list of (surveyName, reportVersion, content). Versions of the
+    # same survey share a partition and go out as one transactional batch; the
+    # partitions are written concurrently.
     container = _get_container_client(client, REPORTS_CONTAINER_NAME)
-    container.upsert_item(body=record)
\ No newline at end of file
+    groups = {}
+    for surveyName, reportVersion, content in reports:
+        read_cache.reports.invalidate((surveyName, reportVersion))
+        groups.setdefault(surveyName, []).append(_report_version_record(surveyName, reportVersion, content))
+    await asyncio.gather(*(_put_report_version_group_async(container, surveyName, records) for surveyName, records in groups.items()))
+
+@tracing.traced("cosmos")
+@evict_on(ServiceRequestError, ServiceResponseError)
+@COSMOS_RETRY_POLICY
+def get_job(client, jobId):
+    container = _get_container_client(client, JOBS_CONTAINER_NAME)
+    try:
+        return _strip_system_properties(container.read_item(item=jobId, partition_key=jobId))
+    except CosmosResourceNotFoundError:
+        return None
+
+@tracing.traced("cosmos")
+@evict_on(ServiceRequestError, ServiceResponseError)
+@COSMOS_RETRY_POLICY
+def put_job(client, job):
+    container = _get_container_client(client, JOBS_CONTAINER_NAME)
+    container.upsert_item(body=job)
+
+@tracing.traced("cosmos")
+@evict_on(ServiceRequestError, ServiceResponseError)
+@COSMOS_RETRY_POLICY
+def transition_job(client, jobId, from_statuses, changes):
+    # Optimistic concurrency on the document etag, so two workers (or a worker
+    # and a retry request) cannot both move the same job out of a status.
+    container = _get_container_client(client, JOBS_CONTAINER_NAME)
+    try:
+        item = container.read_item(item=jobId, partition_key=jobId)
+    except CosmosResourceNotFoundError:
+        return None
+    if item["status"] not in from_statuses:
+        return None
+    etag = item["_etag"]
+    job = _strip_system_properties(item)
+    job.update(changes)
+    try:
+        container.replace_item(item=jobId, body=job, etag=etag, match_condition=MatchConditions.IfNotModified)
+    except CosmosAccessConditionFailedError:
+        return None
+    return job
+
+@tracing.traced("cosmos")
+@evict_on(ServiceRequestError, ServiceResponseError)
+@COSMOS_RETRY_POLICY
+def get_rate_limit_state(client, key):
+    # Returns (state, etag); etag is None when the limiter has no document yet.
+    container = _get_container_client(client, RATE_LIMITS_CONTAINER_NAME)
+    try:
+        item = container.read_item(item=key, partition_key=key)
+    except CosmosResourceNotFoundError:
+        return {}, None
+    return item["buckets"], item["_etag"]
+
+@tracing.traced("cosmos")
+@evict_on(ServiceRequestError, ServiceResponseError)
+@COSMOS_RETRY_POLICY
+def put_rate_limit_state(client, key, state, etag):
+    # Returns False if another instance updated (or created) the document first.
+    container = _get_container_client(client, RATE_LIMITS_CONTAINER_NAME)
+    body = {ID_KEY: key, "buckets": state}
+    try:
+        if etag is None:
+            container.create_item(body=body)
+        else:
+            container.replace_item(item=key, body=body, etag=etag, match_condition=MatchConditions.IfNotModified)
+    except (CosmosAccessConditionFailedError, CosmosResourceExistsError):
+        return False
+    return True
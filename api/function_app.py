@@ -1,361 +1,605 @@
 import azure.functions as func
-import logging
+from azurefunctions.extensions.http.fastapi import JSONResponse, PlainTextResponse, Request, Response, StreamingResponse
+import asyncio
 import json
-import uuid
-import db_utils
-import openai_utils
-import pydantic
-import analysis_schema
+import sys
+import job_queue
+import lazy_modules
+import log_utils
+import metrics
+import read_cache
 import system_message
-import keyvault_utils
-import blob_utils
-from datetime import datetime, timezone
+import tracing
+import warmup
 
+# Loaded when a route first uses them (or by the warm-up), so indexing the app
+# and a cold request only import the SDKs that request needs.
+db_utils = lazy_modules.LazyModule("db_utils")
+pydantic = lazy_modules.LazyModule("pydantic")
+analysis_cache = lazy_modules.LazyModule("analysis_cache")
+analysis_pipeline = lazy_modules.LazyModule("analysis_pipeline")
+analysis_schema = lazy_modules.LazyModule("analysis_schema")
+batch_analysis = lazy_modules.LazyModule("batch_analysis")
+keyvault_utils = lazy_modules.LazyModule("keyvault_utils")
+openai_utils = lazy_modules.LazyModule("openai_utils")
+rate_limiter = lazy_modules.LazyModule("rate_limiter")
+report_content = lazy_modules.LazyModule("report_content")
+survey_transfer = lazy_modules.LazyModule("survey_transfer")
+
+# Importing the FastAPI extension turns on HTTP streams for the whole app:
+# every HTTP route is handed a FastAPI Request and has to return one of its
+# responses, streamed or not. The app setting PYTHON_ENABLE_INIT_INDEXING=1
+# is needed for the extension to load.
 app = func.FunctionApp(http_auth_level=func.AuthLevel.ANONYMOUS)
+log_utils.configure()
+
+def _positive_int_param(req, name, maximum=None):
+    # Returns (value, error); value is None when the parameter is absent.
+    value = req.query_params.get(name)
+    if value is None:
+        return None, None
+    try:
+        value = int(value)
+    except ValueError:
+        return None, f"Malformed request, {name} must be an integer."
+    if value < 1:
+        return None, f"Malformed request, {name} must be positive."
+    if maximum is not None and value > maximum:
+        return None, f"Malformed request, {name} must be at most {maximum}."
+    return value, None
+
+# Surveys can change, so clients revalidate every time; report versions never do.
+SURVEY_CACHE_CONTROL = "private, no-cache"
+REPORT_CACHE_CONTROL = "private, max-age=31536000, immutable"
+
+def _etag_matches(req, etag):
+    # If-None-Match uses weak comparison, so W/ prefixes are ignored.
+    if_none_match = req.headers.get('If-None-Match')
+    if not if_none_match or not etag:
+        return False
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags
+
+def _cached_response(req, entry, cache_control):
+    headers = {"ETag": entry.etag, "Cache-Control": cache_control}
+    if _etag_matches(req, entry.etag):
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(entry.value, status_code=200, headers=headers)
+
+def _page_size(req):
+    page_size, error = _positive_int_param(req, 'pageSize', db_utils.MAX_PAGE_SIZE)
+    return page_size or db_utils.DEFAULT_PAGE_SIZE, error
 
 @app.function_name(name="ListSurveys")
 @app.route(route="surveys", methods=["GET"])
-def get_surveys(req: func.HttpRequest) -> func.HttpResponse:
+@tracing.traced_route
+def get_surveys(req: Request) -> Response:
+    page_size, error = _page_size(req)
+    if error:
+        response_body = {"error": error}
+        log_utils.error("GET surveys error", response=response_body)
+        return JSONResponse(response_body, status_code=400)
     try:
-        response_body = {"surveyNames": db_utils.list_surveys(db_utils.get_client())}
-        logging.info(f"GET surveys response: {response_body}")
-        return func.HttpResponse(
-            json.dumps(response_body),
-            mimetype='application/json',
-            status_code=200
+        survey_names, continuation_token = db_utils.list_surveys_page(
+            client=db_utils.get_client(),
+            page_size=page_size,
+            continuation_token=req.query_params.get('continuationToken')
         )
+        response_body = {
+            "surveyNames": survey_names,
+            "continuationToken": continuation_token
+        }
+        log_utils.verbose("GET surveys response", surveys=len(survey_names), response=log_utils.Payload(response_body))
+        return JSONResponse(response_body, status_code=200)
+    except ValueError as e:
+        return JSONResponse({"error": repr(e)}, status_code=400)
     except Exception as e:
-        logging.error(f"GET surveys error: {e}")
-        return func.HttpResponse(
-            json.dumps({"error": repr(e)}),
-            mimetype='application/json',
-            status_code=500
-        )
+        log_utils.error("GET surveys error", error=e)
+        return JSONResponse({"error": repr(e)}, status_code=500)
 
 @app.function_name(name="GetSurvey")
 @app.route(route="survey", methods=["GET"])
-def get_survey(req: func.HttpRequest) -> func.HttpResponse:
-    survey_name = req.params.get('surveyName')
+@tracing.traced_route
+def get_survey(req: Request) -> Response:
+    survey_name = req.query_params.get('surveyName')
     if not survey_name:
         response_body = {"error": "Malformed request, missing surveyName request parameter."}
-        logging.error(f"GET survey error: {response_body}")
-        return func.HttpResponse(
-            json.dumps(response_body),
-            mimetype='application/json',
-            status_code=400
-        )
+        log_utils.error("GET survey error", response=response_body)
+        return JSONResponse(response_body, status_code=400)
     try:
-        survey = db_utils.get_survey(db_utils.get_client(), survey_name)
-        if not survey:
-            return func.HttpResponse(
-                json.dumps({}),
-                mimetype='application/json',
-                status_code=404
-            )
-        logging.info(f"GET survey response: {survey}")
-        return func.HttpResponse(
-            json.dumps(survey),
-            mimetype='application/json',
-            status_code=200
-        )
+        entry = db_utils.get_survey_entry(db_utils.get_client(), survey_name)
+        if not entry:
+            return JSONResponse({}, status_code=404)
+        log_utils.verbose("GET survey response", survey=survey_name, response=log_utils.Payload(entry.value))
+        return _cached_response(req, entry, SURVEY_CACHE_CONTROL)
     except Exception as e:
-        logging.error(f"GET survey error: {e}")
-        return func.HttpResponse(
-            json.dumps({"error": repr(e)}),
-            mimetype='application/json',
-            status_code=500
-        )
+        log_utils.error("GET survey error", error=e)
+        return JSONResponse({"error": repr(e)}, status_code=500)
 
 @app.function_name(name="UpsertSurvey")
 @app.route(route="survey", methods=["PUT"])
-def upsert_survey(req: func.HttpRequest) -> func.HttpResponse:
-    survey_name = req.params.get('surveyName')
+@tracing.traced_route
+async def upsert_survey(req: Request) -> Response:
+    survey_name = req.query_params.get('surveyName')
     if not survey_name:
         response_body = {"error": "Malformed request, missing surveyName request parameter."}
-        logging.error(f"PUT survey error: {response_body}")
-        return func.HttpResponse(
-            json.dumps(response_body),
-            mimetype='application/json',
-            status_code=400
-        )
+        log_utils.error("PUT survey error", response=response_body)
+        return JSONResponse(response_body, status_code=400)
     request_body = None
     try:
-        request_body = req.get_json()
+        request_body = await req.json()
     except ValueError as e:
-        return func.HttpResponse(
-            json.dumps({"error": repr(e)}),
-            mimetype='application/json',
-            status_code=400
-        )
+        return JSONResponse({"error": repr(e)}, status_code=400)
     if not request_body:
         response_body = {"error": "Malformed request, missing content in request body."}
-        logging.error(f"PUT survey error: {response_body}")
-        return func.HttpResponse(
-            json.dumps(response_body),
-            mimetype='application/json',
-            status_code=400
-        )
+        log_utils.error("PUT survey error", response=response_body)
+        return JSONResponse(response_body, status_code=400)
     try:
-        db_utils.put_survey(db_utils.get_client(), survey_name, request_body)
-        logging.info(f"PUT survey success")
-        return func.HttpResponse(
-            json.dumps({}),
-            mimetype='application/json',
-            status_code=200
-        )
+        await asyncio.to_thread(db_utils.put_survey, db_utils.get_client(), survey_name, request_body)
+        log_utils.info("PUT survey success", survey=survey_name)
+        return JSONResponse({}, status_code=200)
     except Exception as e:
-        logging.error(f"PUT survey error: {e}")
-        return func.HttpResponse(
-            json.dumps({"error": repr(e)}),
-            mimetype='application/json',
-            status_code=500
-        )
+        log_utils.error("PUT survey error", error=e)
+        return JSONResponse({"error": repr(e)}, status_code=500)
 
 @app.function_name(name="DeleteSurvey")
 @app.route(route="survey", methods=["DELETE"])
-def delete_survey(req: func.HttpRequest) -> func.HttpResponse:
-    survey_name = req.params.get('surveyName')
+@tracing.traced_route
+def delete_survey(req: Request) -> Response:
+    survey_name = req.query_params.get('surveyName')
     if not survey_name:
         response_body = {"error": "Malformed request, missing surveyName request parameter."}
-        logging.error(f"DELETE survey error: {response_body}")
-        return func.HttpResponse(
-            json.dumps(response_body),
-            mimetype='application/json',
-            status_code=400
-        )
+        log_utils.error("DELETE survey error", response=response_body)
+        return JSONResponse(response_body, status_code=400)
     try:
         client = db_utils.get_client()
         survey = db_utils.get_survey(client, survey_name)
         if not survey:
-            return func.HttpResponse(
-                json.dumps({}),
-                mimetype='application/json',
-                status_code=404
-            )
+            return JSONResponse({}, status_code=404)
         db_utils.delete_survey(client, survey_name)
-        return func.HttpResponse(
-            json.dumps({}),
-            mimetype='application/json',
-            status_code=200
-        )
+        return JSONResponse({}, status_code=200)
     except Exception as e:
-        logging.error(f"DELETE survey error: {e}")
-        return func.HttpResponse(
-            json.dumps({"error": repr(e)}),
-            mimetype='application/json',
-            status_code=500
-        )
+        log_utils.error("DELETE survey error", error=e)
+        return JSONResponse({"error": repr(e)}, status_code=500)
+
+@app.function_name(name="ImportSurveys")
+@app.route(route="surveys/import", methods=["POST"])
+@tracing.traced_route
+async def import_surveys(req: Request) -> StreamingResponse:
+    # The body is NDJSON, one {"surveyName", "survey"} record per line; the
+    # response streams one result per record followed by a summary.
+    async def lines():
+        try:
+            async for result in survey_transfer.import_surveys_async(req.stream()):
+                yield json.dumps(result) + "\n"
+        except Exception as e:
+            log_utils.error("POST surveys import error", error=e)
+            yield json.dumps({"error": repr(e)}) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+@app.function_name(name="ExportSurveys")
+@app.route(route="surveys/export", methods=["GET"])
+@tracing.traced_route
+async def export_surveys(req: Request) -> StreamingResponse:
+    async def lines():
+        try:
+            async for line in survey_transfer.export_surveys_async():
+                yield line
+        except Exception as e:
+            # Headers are already sent, so the failure is reported in-band.
+            log_utils.error("GET surveys export error", error=e)
+            yield json.dumps({"error": repr(e)}) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
 
 @app.function_name(name="PostSurveyAnalysis")
 @app.route(route="survey/analysis", methods=["POST"])
-def post_survey_analysis(req: func.HttpRequest) -> func.HttpResponse:
+@tracing.traced_route
+async def post_survey_analysis(req: Request) -> Response:
     system_prompt = system_message.ROI_EXPERT_SYSTEM_MESSAGE
     request_body = None
-    survey_name = req.params.get('surveyName')
+    survey_name = req.query_params.get('surveyName')
     if not survey_name:
         response_body = {"error": "Malformed request, missing surveyName request parameter."}
-        logging.error(f"POST survey analysis error: {response_body}")
-        return func.HttpResponse(
-            json.dumps(response_body),
-            mimetype='application/json',
-            status_code=400
-        )
+        log_utils.error("POST survey analysis error", response=response_body)
+        return JSONResponse(response_body, status_code=400)
     try:
-        request_body = req.get_json()
+        request_body = await req.json()
     except ValueError as e:
-        return func.HttpResponse(
-            json.dumps({"error": repr(e)}),
-            mimetype='application/json',
-            status_code=400
-        )
+        return JSONResponse({"error": repr(e)}, status_code=400)
     if not request_body:
         response_body = {"error": "Malformed request, missing content in request body."}
-        logging.error(f"POST survey analysis error: {response_body}")
-        return func.HttpResponse(
-            json.dumps(response_body),
-            mimetype='application/json',
-            status_code=400
-        )
+        log_utils.error("POST survey analysis error", response=response_body)
+        return JSONResponse(response_body, status_code=400)
     request_json = None
     try:
         request_json = json.dumps(request_body)
     except TypeError as e:
         response_body = {"error": "Malformed request, unable to serialize request body."}
-        logging.error(f"POST survey analysis error: {response_body}")
-        return func.HttpResponse(
-            json.dumps(response_body),
-            mimetype='application/json',
-            status_code=400
-        )
+        log_utils.error("POST survey analysis error", response=response_body)
+        return JSONResponse(response_body, status_code=400)
+    analysis_request = None
     try:
-        analysis_schema.Request.model_validate_json(request_json)
+        analysis_request = analysis_schema.Request.model_validate_json(request_json)
     except pydantic.ValidationError as e:
         response_body = {"error": f"Malformed request, request does not follow expected schema: {repr(e)}"}
-        logging.error(f"POST survey analysis error: {response_body}")
-        return func.HttpResponse(
-            json.dumps(response_body),
-            mimetype='application/json',
-            status_code=400
-        )
+        log_utils.error("POST survey analysis error", response=response_body)
+        return JSONResponse(response_body, status_code=400)
+    cache_mode = req.query_params.get('cache')
+    if cache_mode and cache_mode not in analysis_cache.CACHE_MODES:
+        response_body = {"error": f"Malformed request, cache must be one of {list(analysis_cache.CACHE_MODES)}."}
+        log_utils.error("POST survey analysis error", response=response_body)
+        return JSONResponse(response_body, status_code=400)
+    if req.query_params.get('mode') == 'job':
+        try:
+            job = await asyncio.to_thread(job_queue.submit_job, survey_name, request_body, system_prompt)
+            response_body = job_queue.job_status(job)
+            log_utils.info("POST survey analysis job queued", survey=survey_name, job=job["id"])
+            return JSONResponse(response_body, status_code=202)
+        except Exception as e:
+            log_utils.error("POST survey analysis job error", error=e)
+            return JSONResponse({"error": repr(e)}, status_code=500)
     try:
-        api_key = keyvault_utils.get_secret(keyvault_utils.get_client(), "OpenAI")
-        analysis = None
-        retry = 0
-        bad_quality_answer = True
-        openai_response = None
-        while retry < 3 and bad_quality_answer:
-            openai_response = json.loads(
-                    openai_utils.get_json_response(
-                    client=openai_utils.get_client(api_key=api_key),
-                    system_message=system_prompt,
-                    user_message=request_json,
-                    response_class=analysis_schema.Response
-                )
-            )
-            logging.info(f"[RETRY {str(retry)}] POST survey analysis OpenAI response: {openai_response}")
-            analysis = openai_response["analysis"]
-            reported_roi = analysis["roi"]["value"]
-            reported_total_costs = analysis["total_costs"]["value"]
-            reported_total_benefits = analysis["total_benefits"]["value"]
-            computed_roi = (reported_total_benefits - reported_total_costs) / reported_total_costs
-            delta = abs(computed_roi - reported_roi)
-            if abs(computed_roi - reported_roi) < 0.01:
-                logging.info(f"[SUCCESS OPENAI RETRIES = {str(retry)}], delta = {delta}, reported_roi={reported_roi}, computed_roi={computed_roi}, reported_total_costs={reported_total_costs}, reported_total_benefits={reported_total_benefits} POST survey analysis response: {openai_response}")
-                bad_quality_answer = False
-            retry += 1
-            if retry == 3 and bad_quality_answer:
-                logging.error(f"[ERROR OPENAI RETRIES = {str(retry)}], delta = {delta}, reported_roi={reported_roi}, computed_roi={computed_roi}, reported_total_costs={reported_total_costs}, reported_total_benefits={reported_total_benefits} POST survey analysis response: {openai_response}")
-        logging.info(f"[TOTAL OPENAI RETRIES = {str(retry)}] POST survey analysis response: {openai_response}")
-        summary = openai_response["summary"]
-        analysis = {
-            "response": openai_response["analysis"],
-            "request": request_body,
-            "persona": system_prompt,
-            "summary": summary
-        }
-        analysis_json = json.dumps(analysis)
-        blob_client = blob_utils.get_client()
-        prefix = str(uuid.uuid4())
-        analysis_url = blob_utils.upload_blob(
-            client=blob_client,
-            container_name="analysis",
-            blob_name=f"{prefix}.json",
-            content_type="application/json",
-            data=analysis_json
-        )
-        summary_url = blob_utils.upload_blob(
-            client=blob_client,
-            container_name="summary",
-            blob_name=f"{prefix}.txt",
-            content_type="text/plain",
-            data=summary
-        )
-        report_version = datetime.now().isoformat()
-        response = {
-            "surveyName": survey_name,
-            "reportVersion": report_version,
-            "summary": summary_url,
-            "analysis": analysis_url,
-        }
-        db_utils.put_report_version(
-            client=db_utils.get_client(),
-            surveyName=survey_name,
-            reportVersion=report_version,
-            content=response
-        )
-        logging.info(f"POST survey analysis response: {response}")
-        return func.HttpResponse(
-            json.dumps(response),
-            mimetype='application/json',
-            status_code=200
+        response = await analysis_pipeline.run_analysis_async(
+            survey_name=survey_name,
+            request=analysis_request,
+            request_body=request_body,
+            system_prompt=system_prompt,
+            cache_mode=cache_mode
         )
+        log_utils.verbose("POST survey analysis response", survey=survey_name, response=log_utils.Payload(response))
+        return JSONResponse(response, status_code=200)
+    except rate_limiter.RateLimitExceededError as e:
+        log_utils.warning("POST survey analysis shed", error=e)
+        return JSONResponse({"error": str(e)}, status_code=429, headers={"Retry-After": str(max(int(e.retry_after + 0.999), 1))})
     except Exception as e:
-        logging.error(f"POST survey analysis error: {e}")
-        return func.HttpResponse(
-            json.dumps({"error": repr(e)}),
-            mimetype='application/json',
-            status_code=500
-        )
+        log_utils.error("POST survey analysis error", error=e)
+        return JSONResponse({"error": repr(e)}, status_code=500)
+
+def _sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.function_name(name="StreamSurveyAnalysis")
+@app.route(route="survey/analysis/stream", methods=["POST"])
+@tracing.traced_route
+async def stream_survey_analysis(req: Request) -> StreamingResponse:
+    system_prompt = system_message.ROI_EXPERT_SYSTEM_MESSAGE
+    survey_name = req.query_params.get('surveyName')
+    if not survey_name:
+        response_body = {"error": "Malformed request, missing surveyName request parameter."}
+        log_utils.error("POST survey analysis stream error", response=response_body)
+        return JSONResponse(response_body, status_code=400)
+    request_body = None
+    try:
+        request_body = await req.json()
+    except ValueError as e:
+        return JSONResponse({"error": repr(e)}, status_code=400)
+    if not request_body:
+        response_body = {"error": "Malformed request, missing content in request body."}
+        log_utils.error("POST survey analysis stream error", response=response_body)
+        return JSONResponse(response_body, status_code=400)
+    request_json = json.dumps(request_body)
+    analysis_request = None
+    try:
+        analysis_request = analysis_schema.Request.model_validate_json(request_json)
+    except pydantic.ValidationError as e:
+        response_body = {"error": f"Malformed request, request does not follow expected schema: {repr(e)}"}
+        log_utils.error("POST survey analysis stream error", response=response_body)
+        return JSONResponse(response_body, status_code=400)
+    cache_mode = req.query_params.get('cache')
+    if cache_mode and cache_mode not in analysis_cache.CACHE_MODES:
+        response_body = {"error": f"Malformed request, cache must be one of {list(analysis_cache.CACHE_MODES)}."}
+        log_utils.error("POST survey analysis stream error", response=response_body)
+        return JSONResponse(response_body, status_code=400)
+
+    async def events():
+        try:
+            async for event, data in analysis_pipeline.stream_analysis_async(
+                survey_name=survey_name,
+                request=analysis_request,
+                request_body=request_body,
+                system_prompt=system_prompt,
+                cache_mode=cache_mode
+            ):
+                yield _sse_event(event, data)
+        except Exception as e:
+            log_utils.error("POST survey analysis stream error", error=e)
+            yield _sse_event("error", {"error": repr(e)})
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.function_name(name="PostSurveyAnalysisBatch")
+@app.route(route="survey/analysis/batch", methods=["POST"])
+@tracing.traced_route
+async def post_survey_analysis_batch(req: Request) -> StreamingResponse:
+    system_prompt = system_message.ROI_EXPERT_SYSTEM_MESSAGE
+    request_body = None
+    try:
+        request_body = await req.json()
+    except ValueError as e:
+        return JSONResponse({"error": repr(e)}, status_code=400)
+    items, error = None, None
+    try:
+        items, error = batch_analysis.parse_batch_request(request_body)
+    except (TypeError, ValueError) as e:
+        error = f"Malformed request: {repr(e)}"
+    if error:
+        response_body = {"error": error}
+        log_utils.error("POST survey analysis batch error", response=response_body)
+        return JSONResponse(response_body, status_code=400)
+    max_concurrency = None
+    token_budget = None
+    try:
+        max_concurrency = int(request_body.get("maxConcurrency") or batch_analysis.BATCH_DEFAULT_CONCURRENCY)
+        token_budget = int(request_body["tokenBudget"]) if request_body.get("tokenBudget") else None
+    except (TypeError, ValueError) as e:
+        return JSONResponse({"error": f"Malformed request, maxConcurrency and tokenBudget must be integers: {repr(e)}"}, status_code=400)
+    if not 1 <= max_concurrency <= batch_analysis.BATCH_MAX_CONCURRENCY:
+        response_body = {"error": f"Malformed request, maxConcurrency must be between 1 and {batch_analysis.BATCH_MAX_CONCURRENCY}."}
+        log_utils.error("POST survey analysis batch error", response=response_body)
+        return JSONResponse(response_body, status_code=400)
+    results = batch_analysis.run_batch_async(
+        items=items,
+        system_prompt=system_prompt,
+        max_concurrency=max_concurrency,
+        token_budget=token_budget
+    )
+    if req.query_params.get('stream') == 'true':
+        async def lines():
+            try:
+                async for result in results:
+                    yield json.dumps(result) + "\n"
+            except Exception as e:
+                # Headers are already sent, so the failure is reported in-band.
+                log_utils.error("POST survey analysis batch error", error=e)
+                yield json.dumps({"error": repr(e)}) + "\n"
+
+        return StreamingResponse(lines(), media_type="application/x-ndjson")
+    try:
+        response_body = {"results": [result async for result in results]}
+        log_utils.verbose("POST survey analysis batch response", response=log_utils.Payload(response_body))
+        return JSONResponse(response_body, status_code=200)
+    except Exception as e:
+        log_utils.error("POST survey analysis batch error", error=e)
+        return JSONResponse({"error": repr(e)}, status_code=500)
+
+@app.function_name(name="GetSurveyAnalysisJob")
+@app.route(route="survey/analysis/job", methods=["GET"])
+@tracing.traced_route
+def get_survey_analysis_job(req: Request) -> Response:
+    job_id = req.query_params.get('jobId')
+    if not job_id:
+        response_body = {"error": "Malformed request, missing jobId request parameter."}
+        log_utils.error("GET survey analysis job error", response=response_body)
+        return JSONResponse(response_body, status_code=400)
+    try:
+        job = job_queue.get_job(job_id)
+        if not job:
+            return JSONResponse({}, status_code=404)
+        response_body = job_queue.job_status(job)
+        log_utils.verbose("GET survey analysis job response", response=log_utils.Payload(response_body))
+        return JSONResponse(response_body, status_code=200)
+    except Exception as e:
+        log_utils.error("GET survey analysis job error", error=e)
+        return JSONResponse({"error": repr(e)}, status_code=500)
+
+@app.function_name(name="RetrySurveyAnalysisJob")
+@app.route(route="survey/analysis/job/retry", methods=["POST"])
+@tracing.traced_route
+def retry_survey_analysis_job(req: Request) -> Response:
+    job_id = req.query_params.get('jobId')
+    if not job_id:
+        response_body = {"error": "Malformed request, missing jobId request parameter."}
+        log_utils.error("POST survey analysis job retry error", response=response_body)
+        return JSONResponse(response_body, status_code=400)
+    try:
+        job = job_queue.retry_job(job_id)
+        if job:
+            log_utils.info("POST survey analysis job retry queued", job=job_id)
+            return JSONResponse(job_queue.job_status(job), status_code=202)
+        job = job_queue.get_job(job_id)
+        if not job:
+            return JSONResponse({}, status_code=404)
+        # Not in a retryable state; report it unchanged so retries are idempotent.
+        return JSONResponse(job_queue.job_status(job), status_code=409)
+    except Exception as e:
+        log_utils.error("POST survey analysis job retry error", error=e)
+        return JSONResponse({"error": repr(e)}, status_code=500)
+
+@app.function_name(name="AnalysisJobWorker")
+@app.queue_trigger(arg_name="msg", queue_name=job_queue.ANALYSIS_JOB_QUEUE_NAME, connection=job_queue.STORAGE_CONNECTION_SETTING)
+def analysis_job_worker(msg: func.QueueMessage) -> None:
+    job_id = json.loads(msg.get_body().decode("utf-8"))["jobId"]
+    job_queue.process_job(job_id)
+
+@app.function_name(name="GetOpenAIRateLimitStats")
+@app.route(route="openai/ratelimit", methods=["GET"])
+def get_openai_rate_limit_stats(req: Request) -> Response:
+    response_body = openai_utils.get_rate_limiter().stats()
+    return JSONResponse(response_body, status_code=200)
+
+@app.function_name(name="GetOpenAIHedgeStats")
+@app.route(route="openai/hedges", methods=["GET"])
+def get_openai_hedge_stats(req: Request) -> Response:
+    response_body = openai_utils.hedge_stats()
+    return JSONResponse(response_body, status_code=200)
+
+def _stats_metrics():
+    # Stats the limiter and caches already keep, read at scrape time. A scrape
+    # does not load the OpenAI or Key Vault helpers; until a request has, they
+    # have nothing to report.
+    caches = {
+        "survey": read_cache.surveys.stats(),
+        "report": read_cache.reports.stats()
+    }
+    families = []
+    if "keyvault_utils" in sys.modules:
+        caches["secret"] = keyvault_utils.get_secret_cache_stats()
+    if "openai_utils" in sys.modules:
+        limiter = openai_utils.get_rate_limiter().stats()
+        families += [
+            ("changeai_openai_limiter_admitted_total", "counter", "OpenAI calls admitted by the rate limiter.", [({}, limiter["admitted"])]),
+            ("changeai_openai_limiter_shed_total", "counter", "OpenAI calls shed by the rate limiter.", [({}, limiter["shed"])]),
+            ("changeai_openai_limiter_wait_seconds_total", "counter", "Time OpenAI calls waited for the rate limiter.", [({}, limiter["wait_seconds_total"])]),
+            ("changeai_openai_limiter_waiting", "gauge", "OpenAI calls waiting for the rate limiter.", [({}, limiter["waiting"])]),
+            ("changeai_openai_hedge_delay_seconds", "gauge", "How long a hedged OpenAI call waits before sending its hedge.", [({"name": hedge["name"]}, hedge["delaySeconds"]) for hedge in openai_utils.hedge_stats()])
+        ]
+    for name, metric_type, key, documentation in (
+        ("changeai_cache_hits_total", "counter", "hits", "Cache hits."),
+        ("changeai_cache_misses_total", "counter", "misses", "Cache misses."),
+        ("changeai_cache_entries", "gauge", "size", "Entries held by each cache.")
+    ):
+        families.append((name, metric_type, documentation, [({"cache": cache}, stats[key]) for cache, stats in caches.items()]))
+    return families
+
+metrics.registry.add_collector(_stats_metrics)
+
+@app.function_name(name="GetMetrics")
+@app.route(route="metrics", methods=["GET"])
+def get_metrics(req: Request) -> Response:
+    try:
+        return PlainTextResponse(metrics.registry.render(), status_code=200)
+    except Exception as e:
+        log_utils.error("GET metrics error", error=e)
+        return JSONResponse({"error": repr(e)}, status_code=500)
+
+@app.function_name(name="WarmUp")
+@app.warm_up_trigger(arg_name="warmupContext")
+async def warm_up(warmupContext) -> None:
+    # Runs on instances added by scale-out before they receive traffic (Premium
+    # and Dedicated plans); GET warmup does the same for slot swaps and plans
+    # without the trigger.
+    await warmup.warm_async()
+
+@app.function_name(name="GetWarmUp")
+@app.route(route="warmup", methods=["GET"])
+@tracing.traced_route
+async def get_warm_up(req: Request) -> Response:
+    try:
+        response_body = await warmup.warm_async()
+        return JSONResponse(response_body, status_code=200 if response_body["ok"] else 503)
+    except Exception as e:
+        log_utils.error("GET warmup error", error=e)
+        return JSONResponse({"error": repr(e)}, status_code=500)
 
 @app.function_name(name="ListReportVersions")
 @app.route(route="report/versions", methods=["GET"])
-def get_report_versions(req: func.HttpRequest) -> func.HttpResponse:
-    survey_name = req.params.get('surveyName')
+@tracing.traced_route
+def get_report_versions(req: Request) -> Response:
+    survey_name = req.query_params.get('surveyName')
     if not survey_name:
         response_body = {"error": "Malformed request, missing surveyName request parameter."}
-        logging.error(f"GET report versions error: {response_body}")
-        return func.HttpResponse(
-            json.dumps(response_body),
-            mimetype='application/json',
-            status_code=400
-        )
+        log_utils.error("GET report versions error", response=response_body)
+        return JSONResponse(response_body, status_code=400)
+    page_size, error = _page_size(req)
+    limit = None
+    if not error:
+        limit, error = _positive_int_param(req, 'limit')
+    if error:
+        response_body = {"error": error}
+        log_utils.error("GET report versions error", response=response_body)
+        return JSONResponse(response_body, status_code=400)
     try:
-        report_versions = db_utils.list_report_versions(
+        report_versions, continuation_token = db_utils.list_report_versions_page(
             client=db_utils.get_client(),
-            surveyName=survey_name
+            surveyName=survey_name,
+            page_size=page_size,
+            continuation_token=req.query_params.get('continuationToken'),
+            limit=limit,
+            since=req.query_params.get('since'),
+            before=req.query_params.get('before')
         )
         response_body = {
             "surveyName": survey_name,
-            "reportVersions": report_versions
+            "reportVersions": report_versions,
+            "continuationToken": continuation_token
         }
-        logging.info(f"GET report versions response: {response_body}")
-        return func.HttpResponse(
-            json.dumps(response_body),
-            mimetype='application/json',
-            status_code=200
-        )
+        log_utils.verbose("GET report versions response", survey=survey_name, response=log_utils.Payload(response_body))
+        return JSONResponse(response_body, status_code=200)
+    except ValueError as e:
+        return JSONResponse({"error": repr(e)}, status_code=400)
     except Exception as e:
-        logging.error(f"GET report versions error: {e}")
-        return func.HttpResponse(
-            json.dumps({"error": repr(e)}),
-            mimetype='application/json',
-            status_code=500
-        )
+        log_utils.error("GET report versions error", error=e)
+        return JSONResponse({"error": repr(e)}, status_code=500)
 
 @app.function_name(name="GetReportVersion")
 @app.route(route="report/version", methods=["GET"])
-def get_report_version(req: func.HttpRequest) -> func.HttpResponse:
-    survey_name = req.params.get('surveyName')
+@tracing.traced_route
+def get_report_version(req: Request) -> Response:
+    survey_name = req.query_params.get('surveyName')
     if not survey_name:
         response_body = {"error": "Malformed request, missing surveyName request parameter."}
-        logging.error(f"GET survey error: {response_body}")
-        return func.HttpResponse(
-            json.dumps(response_body),
-            mimetype='application/json',
-            status_code=400
-        )
-    report_version = req.params.get('reportVersion')
+        log_utils.error("GET survey error", response=response_body)
+        return JSONResponse(response_body, status_code=400)
+    report_version = req.query_params.get('reportVersion')
     if not report_version:
         response_body = {"error": "Malformed request, missing reportVersion request parameter."}
-        logging.error(f"GET report version error: {response_body}")
-        return func.HttpResponse(
-            json.dumps(response_body),
-            mimetype='application/json',
-            status_code=400
-        )
-    logging.info(f"report version: {report_version}")
+        log_utils.error("GET report version error", response=response_body)
+        return JSONResponse(response_body, status_code=400)
+    log_utils.debug("GET report version request", survey=survey_name, report_version=report_version)
     try:
-        report = db_utils.get_report_version(
+        entry = db_utils.get_report_version_entry(
             client=db_utils.get_client(),
             surveyName=survey_name,
             reportVersion=report_version
         )
-        if not report:
-            return func.HttpResponse(
-                json.dumps({}),
-                mimetype='application/json',
-                status_code=404
+        if not entry:
+            return JSONResponse({}, status_code=404)
+        log_utils.verbose("GET report version response", survey=survey_name, response=log_utils.Payload(entry.value))
+        return _cached_response(req, entry, REPORT_CACHE_CONTROL)
+    except Exception as e:
+        log_utils.error("GET report version error", error=e)
+        return JSONResponse({"error": repr(e)}, status_code=500)
+
+@app.function_name(name="GetReportContent")
+@app.route(route="report/content", methods=["GET"])
+@tracing.traced_route
+async def get_report_content(req: Request) -> StreamingResponse:
+    # Without `part` the analysis and summary are streamed together as one JSON
+    # document; with part=analysis or part=summary that artifact is streamed
+    # as stored, with Range and If-None-Match support.
+    survey_name = req.query_params.get('surveyName')
+    report_version = req.query_params.get('reportVersion')
+    if not survey_name or not report_version:
+        response_body = {"error": "Malformed request, missing surveyName or reportVersion request parameter."}
+        log_utils.error("GET report content error", response=response_body)
+        return JSONResponse(response_body, status_code=400)
+    part = req.query_params.get('part')
+    if part and part not in report_content.REPORT_PARTS:
+        response_body = {"error": f"Malformed request, part must be one of {list(report_content.REPORT_PARTS)}."}
+        log_utils.error("GET report content error", response=response_body)
+        return JSONResponse(response_body, status_code=400)
+    try:
+        entry = await asyncio.to_thread(db_utils.get_report_version_entry, db_utils.get_client(), survey_name, report_version)
+        if not entry:
+            return JSONResponse({}, status_code=404)
+        content_etag = report_content.content_etag(entry.etag, req.headers.get('Accept-Encoding'))
+        if part:
+            content = await report_content.open_part(
+                report=entry.value,
+                part=part,
+                range_header=req.headers.get('Range'),
+                accept_encoding=req.headers.get('Accept-Encoding'),
+                if_none_match=req.headers.get('If-None-Match')
             )
-        logging.info(f"GET report version response: {report}")
-        return func.HttpResponse(
-            json.dumps(report),
-            mimetype='application/json',
-            status_code=200
-        )
+        elif _etag_matches(req, content_etag):
+            content = report_content.ContentResponse(304, {
+                "ETag": content_etag,
+                "Cache-Control": report_content.ARTIFACT_CACHE_CONTROL,
+                "Vary": "Accept-Encoding"
+            })
+        else:
+            content = await report_content.open_content(entry.value, entry.etag, req.headers.get('Accept-Encoding'))
+        if content is None:
+            return JSONResponse({}, status_code=404)
+        if content.body is None:
+            return StreamingResponse(iter(()), status_code=content.status_code, headers=content.headers)
+        return StreamingResponse(content.body, status_code=content.status_code, headers=content.headers, media_type=content.media_type)
     except Exception as e:
-        logging.error(f"GET report version error: {e}")
-        return func.HttpResponse(
-            json.dumps({"error": repr(e)}),
-            mimetype='application/json',
-            status_code=500
-        )
\ No newline at end of file
+        log_utils.error("GET report content error", error=e)
+        return JSONResponse({"error": repr(e)}, status_code=500)
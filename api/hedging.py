@@ -0,0 +1,115 @@
+import asyncio
+import collections
+import math
+import threading
+import time
+import metrics
+
+# Hedged requests: when a call has not answered by a high percentile of its
+# recent latencies, a second one is sent and whichever answers first with an
+# acceptable result wins. Slow outliers then cost about the percentile plus one
+# typical call instead of the full stall, for a few percent more calls.
+HEDGE_OUTCOMES = metrics.registry.counter(
+    "changeai_hedged_calls_total",
+    "Hedged calls by outcome: answered before the hedge was needed, primary or hedge won after it was sent, or both failed."
+)
+OUTCOMES = ("notNeeded", "primary", "hedge", "failed")
+
+class LatencyWindow:
+    def __init__(self, size):
+        self._samples = collections.deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, fraction, min_samples):
+        # None until there are enough samples to say anything about the tail.
+        with self._lock:
+            samples = sorted(self._samples)
+        if len(samples) < max(min_samples, 1):
+            return None
+        return samples[min(len(samples) - 1, math.ceil(fraction * len(samples)) - 1)]
+
+def _consume(task):
+    # A loser that failed after the winner was chosen is not awaited again.
+    if not task.cancelled():
+        task.exception()
+
+class Hedge:
+    def __init__(self, name, percentile=0.95, initial_delay=30.0, min_delay=1.0, min_samples=20, window=500):
+        self.name = name
+        self.percentile = percentile
+        self.initial_delay = initial_delay
+        self.min_delay = min_delay
+        self.min_samples = min_samples
+        self.latencies = LatencyWindow(window)
+        self._lock = threading.Lock()
+        self._outcomes = dict.fromkeys(OUTCOMES, 0)
+
+    def delay(self):
+        observed = self.latencies.percentile(self.percentile, self.min_samples)
+        return self.initial_delay if observed is None else max(observed, self.min_delay)
+
+    def _record(self, outcome):
+        with self._lock:
+            self._outcomes[outcome] += 1
+        HEDGE_OUTCOMES.inc(name=self.name, outcome=outcome)
+
+    def stats(self):
+        with self._lock:
+            outcomes = dict(self._outcomes)
+        hedged = outcomes["primary"] + outcomes["hedge"] + outcomes["failed"]
+        total = hedged + outcomes["notNeeded"]
+        return {
+            "name": self.name,
+            "delaySeconds": round(self.delay(), 4),
+            "outcomes": outcomes,
+            "hedgeRate": round(hedged / total, 4) if total else 0.0,
+            "hedgeWinRate": round(outcomes["hedge"] / hedged, 4) if hedged else 0.0
+        }
+
+    async def run(self, primary, hedge):
+        # primary and hedge are coroutine functions; a leg that raises (a
+        # failed call or a rejected result) leaves the other to answer. If the
+        # primary fails before the hedge is due, its error is raised so the
+        # caller's retry policy decides what happens next, Retry-After included.
+        started = time.monotonic()
+        primary_task = asyncio.ensure_future(primary())
+        try:
+            done, _ = await asyncio.wait({primary_task}, timeout=self.delay())
+        except BaseException:
+            primary_task.cancel()
+            raise
+        if done:
+            result = primary_task.result()
+            self.latencies.add(time.monotonic() - started)
+            self._record("notNeeded")
+            return result
+        hedge_task = asyncio.ensure_future(hedge())
+        pending = {primary_task, hedge_task}
+        error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in (primary_task, hedge_task):
+                    if task not in done:
+                        continue
+                    if task.exception() is None:
+                        # Only the primary's latency is sampled: if it lost,
+                        # its time so far is a lower bound, which still lands
+                        # above the current delay, while adding the hedge's
+                        # own, typical, latency would pull the delay down and
+                        # send ever more hedges.
+                        self.latencies.add(time.monotonic() - started)
+                        self._record("primary" if task is primary_task else "hedge")
+                        return task.result()
+                    error = error or task.exception()
+            self._record("failed")
+            raise error
+        finally:
+            for task in (primary_task, hedge_task):
+                if not task.done():
+                    task.cancel()
+                task.add_done_callback(_consume)
@@ -0,0 +1,222 @@
+import contextlib
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+import lazy_modules
+import log_utils
+from client_registry import registry
+
+# The AnalysisJobWorker trigger reads this module's settings when the app is
+# indexed, so the analysis pipeline is only loaded once a job is handled.
+analysis_pipeline = lazy_modules.LazyModule("analysis_pipeline")
+analysis_schema = lazy_modules.LazyModule("analysis_schema")
+db_utils = lazy_modules.LazyModule("db_utils")
+
+# "azure" uses a Storage queue drained by the AnalysisJobWorker queue trigger
+# and a Cosmos jobs container; "local" runs jobs on in-process worker threads
+# with a SQLite job store, so the whole flow can be load tested offline.
+ANALYSIS_JOB_BACKEND = os.environ.get("ANALYSIS_JOB_BACKEND", "azure")
+ANALYSIS_JOB_QUEUE_NAME = os.environ.get("ANALYSIS_JOB_QUEUE_NAME", "analysis-jobs")
+ANALYSIS_JOB_CONCURRENCY = int(os.environ.get("ANALYSIS_JOB_CONCURRENCY", "4"))
+# A running job whose worker stopped updating it for this long may be reclaimed
+# by a redelivered queue message or an explicit retry.
+ANALYSIS_JOB_LEASE_SECONDS = float(os.environ.get("ANALYSIS_JOB_LEASE_SECONDS", "900"))
+ANALYSIS_JOB_SQLITE_PATH = os.environ.get("ANALYSIS_JOB_SQLITE_PATH", os.path.join(tempfile.gettempdir(), "changeai-jobs.sqlite3"))
+STORAGE_CONNECTION_SETTING = "AzureWebJobsStorage"
+
+STATUS_QUEUED = "queued"
+STATUS_RUNNING = "running"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+
+def _now():
+    return datetime.now(timezone.utc).isoformat()
+
+def _lease_expired(job):
+    updated_at = datetime.fromisoformat(job["updatedAt"])
+    return (datetime.now(timezone.utc) - updated_at).total_seconds() > ANALYSIS_JOB_LEASE_SECONDS
+
+def _reclaimable(job, statuses):
+    if job["status"] == STATUS_RUNNING and _lease_expired(job):
+        return statuses + (STATUS_RUNNING,)
+    return statuses
+
+class CosmosJobStore:
+    def create(self, job):
+        db_utils.put_job(db_utils.get_client(), job)
+
+    def get(self, job_id):
+        return db_utils.get_job(db_utils.get_client(), job_id)
+
+    def transition(self, job_id, from_statuses, changes):
+        return db_utils.transition_job(db_utils.get_client(), job_id, from_statuses, changes)
+
+class SqliteJobStore:
+    def __init__(self, path=ANALYSIS_JOB_SQLITE_PATH):
+        self._path = path
+        self._lock = threading.Lock()
+        with self._connect() as connection:
+            connection.execute("CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, status TEXT NOT NULL, data TEXT NOT NULL)")
+
+    @contextlib.contextmanager
+    def _connect(self):
+        # The connection's own context manager commits or rolls back but does
+        # not close it, so it is closed here.
+        connection = sqlite3.connect(self._path, timeout=30)
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def create(self, job):
+        with self._lock, self._connect() as connection:
+            connection.execute("INSERT OR REPLACE INTO jobs (id, status, data) VALUES (?, ?, ?)", (job["id"], job["status"], json.dumps(job)))
+
+    def get(self, job_id):
+        with self._connect() as connection:
+            row = connection.execute("SELECT data FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def transition(self, job_id, from_statuses, changes):
+        with self._lock, self._connect() as connection:
+            row = connection.execute("SELECT data FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None:
+                return None
+            job = json.loads(row[0])
+            if job["status"] not in from_statuses:
+                return None
+            job.update(changes)
+            placeholders = ", ".join("?" for _ in from_statuses)
+            cursor = connection.execute(
+                f"UPDATE jobs SET status = ?, data = ? WHERE id = ? AND status IN ({placeholders})",
+                (job["status"], json.dumps(job), job_id, *from_statuses)
+            )
+            return job if cursor.rowcount == 1 else None
+
+class StorageJobQueue:
+    def _get_client(self):
+        def create():
+            from azure.storage.queue import QueueClient, TextBase64EncodePolicy
+            # The Functions queue trigger expects base64 encoded messages.
+            return QueueClient.from_connection_string(
+                os.environ[STORAGE_CONNECTION_SETTING],
+                ANALYSIS_JOB_QUEUE_NAME,
+                message_encode_policy=TextBase64EncodePolicy()
+            )
+        return registry.get("job-queue", create)
+
+    def enqueue(self, job_id):
+        self._get_client().send_message(json.dumps({"jobId": job_id}))
+
+class LocalJobQueue:
+    def __init__(self, concurrency=ANALYSIS_JOB_CONCURRENCY):
+        self._executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="analysis-job")
+
+    def enqueue(self, job_id):
+        self._executor.submit(process_job, job_id)
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+def _create_backend(name):
+    if name == "azure":
+        return CosmosJobStore(), StorageJobQueue()
+    if name == "local":
+        return SqliteJobStore(), LocalJobQueue()
+    raise ValueError(f"Unknown analysis job backend '{name}'")
+
+_backend = None
+_backend_lock = threading.Lock()
+
+def _get_backend():
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = _create_backend(ANALYSIS_JOB_BACKEND)
+    return _backend
+
+def configure(store, queue):
+    global _backend
+    with _backend_lock:
+        _backend = (store, queue)
+
+def submit_job(survey_name, request_body, system_prompt):
+    store, queue = _get_backend()
+    now = _now()
+    job = {
+        "id": str(uuid.uuid4()),
+        "surveyName": survey_name,
+        "request": request_body,
+        "persona": system_prompt,
+        "status": STATUS_QUEUED,
+        "attempts": 0,
+        "reportVersion": None,
+        "report": None,
+        "error": None,
+        "createdAt": now,
+        "updatedAt": now
+    }
+    store.create(job)
+    queue.enqueue(job["id"])
+    return job
+
+def get_job(job_id):
+    store, _ = _get_backend()
+    return store.get(job_id)
+
+def retry_job(job_id):
+    # Only failed (or abandoned running) jobs are re-queued; retrying any other
+    # job is a no-op that returns None so callers can report its status.
+    store, queue = _get_backend()
+    current = store.get(job_id)
+    if current is None:
+        return None
+    job = store.transition(job_id, _reclaimable(current, (STATUS_FAILED,)), {"status": STATUS_QUEUED, "error": None, "updatedAt": _now()})
+    if job is not None:
+        queue.enqueue(job_id)
+    return job
+
+def process_job(job_id):
+    store, _ = _get_backend()
+    current = store.get(job_id)
+    if current is None:
+        log_utils.error("Analysis job not found", job=job_id)
+        return None
+    # Claiming moves queued -> running atomically, so a redelivered message or a
+    # concurrent worker cannot run a job twice or re-run a finished one.
+    job = store.transition(job_id, _reclaimable(current, (STATUS_QUEUED,)), {"status": STATUS_RUNNING, "attempts": current["attempts"] + 1, "updatedAt": _now()})
+    if job is None:
+        log_utils.info("Analysis job skipped", job=job_id, status=current["status"])
+        return current
+    try:
+        report = analysis_pipeline.run_analysis(
+            survey_name=job["surveyName"],
+            request=analysis_schema.Request.model_validate(job["request"]),
+            request_body=job["request"],
+            system_prompt=job["persona"]
+        )
+    except Exception as e:
+        log_utils.error("Analysis job failed", job=job_id, error=e)
+        return store.transition(job_id, (STATUS_RUNNING,), {"status": STATUS_FAILED, "error": repr(e), "updatedAt": _now()})
+    log_utils.info("Analysis job done", job=job_id, report_version=report["reportVersion"])
+    return store.transition(job_id, (STATUS_RUNNING,), {"status": STATUS_DONE, "reportVersion": report["reportVersion"], "report": report, "updatedAt": _now()})
+
+def job_status(job):
+    return {
+        "jobId": job["id"],
+        "surveyName": job["surveyName"],
+        "status": job["status"],
+        "attempts": job["attempts"],
+        "reportVersion": job["reportVersion"],
+        "report": job["report"],
+        "error": job["error"],
+        "createdAt": job["createdAt"],
+        "updatedAt": job["updatedAt"]
+    }
@@ -1,12 +1,192 @@
+import asyncio
+import os
+import threading
+import time
+from azure.core.exceptions import ServiceRequestError, ServiceResponseError
 from azure.keyvault.secrets import SecretClient
-from azure.identity import DefaultAzureCredential
-from retry import exponential_backoff
+import log_utils
+import tracing
+from client_registry import registry, evict_on
+from retry import RetryPolicy, is_transient_azure_error
+from single_flight import AsyncSingleFlight, SingleFlight
 
 KEYVAULT_ENDPOINT = "https://changeai-keyvault.vault.azure.net"
+SECRET_TTL_SECONDS = float(os.environ.get("KEYVAULT_SECRET_TTL_SECONDS", "900"))
+# Fraction of the TTL after which a read triggers a background refresh.
+SECRET_REFRESH_AHEAD_RATIO = float(os.environ.get("KEYVAULT_SECRET_REFRESH_AHEAD_RATIO", "0.8"))
+# Key Vault throttles per vault; a cached value is served if this gives up.
+KEYVAULT_RETRY_POLICY = RetryPolicy("keyvault", is_retryable=is_transient_azure_error, retries=3, base_delay=0.5, max_delay=10.0)
 
 def get_client():
-    return SecretClient(vault_url=KEYVAULT_ENDPOINT, credential=DefaultAzureCredential())
+    return registry.get("keyvault", lambda: SecretClient(vault_url=KEYVAULT_ENDPOINT, credential=registry.get_credential(), raw_response_hook=tracing.record_azure_response))
 
-@exponential_backoff(initial_delay=1, retries=3)
-def get_secret(client, secret_name):
+def get_async_client():
+    from azure.keyvault.secrets.aio import SecretClient as AsyncSecretClient
+    return registry.get("keyvault-aio", lambda: AsyncSecretClient(vault_url=KEYVAULT_ENDPOINT, credential=registry.get_async_credential(), raw_response_hook=tracing.record_azure_response))
+
+@tracing.traced("keyvault")
+@evict_on(ServiceRequestError, ServiceResponseError)
+@KEYVAULT_RETRY_POLICY
+def _fetch_secret(client, secret_name):
     return client.get_secret(secret_name).value
+
+@tracing.traced("keyvault")
+@evict_on(ServiceRequestError, ServiceResponseError)
+@KEYVAULT_RETRY_POLICY
+async def _fetch_secret_async(client, secret_name):
+    return (await client.get_secret(secret_name)).value
+
+class _CachedSecret:
+    def __init__(self, value, fetched_at):
+        self.value = value
+        self.fetched_at = fetched_at
+        self.refreshing = False
+
+class SecretCache:
+    def __init__(self, fetch, fetch_async=None, ttl=SECRET_TTL_SECONDS, refresh_ahead_ratio=SECRET_REFRESH_AHEAD_RATIO, clock=time.monotonic):
+        self._fetch = fetch
+        self._fetch_async = fetch_async
+        self._ttl = ttl
+        self._refresh_after = ttl * refresh_ahead_ratio
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._refresh_tasks = set()
+        # Bumped by invalidate(); fetches that started before it do not store
+        # their value, so a secret rotated meanwhile is not put back.
+        self._generation = 0
+        self._flights = SingleFlight()
+        self._async_flights = AsyncSingleFlight()
+        self._stats = {"hits": 0, "misses": 0, "refreshes": 0, "refresh_failures": 0, "stale_served": 0, "stale_discarded": 0}
+
+    def _lookup(self, secret_name):
+        # Returns (entry, fresh, should_refresh, generation); at most one refresh
+        # per entry is started, and misses fall through to a foreground fetch by
+        # the caller.
+        now = self._clock()
+        with self._lock:
+            entry = self._entries.get(secret_name)
+            if entry is not None:
+                age = now - entry.fetched_at
+                if age < self._ttl:
+                    self._stats["hits"] += 1
+                    should_refresh = age >= self._refresh_after and not entry.refreshing
+                    if should_refresh:
+                        entry.refreshing = True
+                    return entry, True, should_refresh, self._generation
+            self._stats["misses"] += 1
+            return entry, False, False, self._generation
+
+    def _serve_stale(self, entry, secret_name, e):
+        if entry is None:
+            raise e
+        with self._lock:
+            self._stats["stale_served"] += 1
+        log_utils.warning("Key Vault fetch failed, serving last known value", secret=secret_name, error=e)
+        return entry.value
+
+    def get(self, client, secret_name):
+        entry, fresh, should_refresh, generation = self._lookup(secret_name)
+        if should_refresh:
+            threading.Thread(
+                target=self._refresh,
+                args=(client, secret_name, generation),
+                name=f"keyvault-refresh-{secret_name}",
+                daemon=True
+            ).start()
+        if fresh:
+            return entry.value
+        # Concurrent misses for one secret share a single Key Vault call, unless
+        # it was invalidated in between.
+        try:
+            return self._flights.do((secret_name, generation), lambda: self._fetch_and_store(client, secret_name, generation))
+        except Exception as e:
+            return self._serve_stale(entry, secret_name, e)
+
+    async def get_async(self, client, secret_name):
+        entry, fresh, should_refresh, generation = self._lookup(secret_name)
+        if should_refresh:
+            task = asyncio.get_running_loop().create_task(self._refresh_async(client, secret_name, generation))
+            self._refresh_tasks.add(task)
+            task.add_done_callback(self._refresh_tasks.discard)
+        if fresh:
+            return entry.value
+        try:
+            return await self._async_flights.do((secret_name, generation), lambda: self._fetch_and_store_async(client, secret_name, generation))
+        except Exception as e:
+            return self._serve_stale(entry, secret_name, e)
+
+    def _fetch_and_store(self, client, secret_name, generation):
+        value = self._fetch(client, secret_name)
+        self._store(secret_name, value, generation)
+        return value
+
+    async def _fetch_and_store_async(self, client, secret_name, generation):
+        value = await self._fetch_async(client, secret_name)
+        self._store(secret_name, value, generation)
+        return value
+
+    def _refresh(self, client, secret_name, generation):
+        try:
+            value = self._fetch(client, secret_name)
+        except Exception as e:
+            self._refresh_failed(secret_name, e)
+            return
+        self._refreshed(secret_name, value, generation)
+
+    async def _refresh_async(self, client, secret_name, generation):
+        try:
+            value = await self._fetch_async(client, secret_name)
+        except Exception as e:
+            self._refresh_failed(secret_name, e)
+            return
+        self._refreshed(secret_name, value, generation)
+
+    def _refresh_failed(self, secret_name, e):
+        with self._lock:
+            self._stats["refresh_failures"] += 1
+            entry = self._entries.get(secret_name)
+            if entry is not None:
+                entry.refreshing = False
+        log_utils.warning("Key Vault background refresh failed", secret=secret_name, error=e)
+
+    def _refreshed(self, secret_name, value, generation):
+        with self._lock:
+            self._stats["refreshes"] += 1
+        self._store(secret_name, value, generation)
+
+    def _store(self, secret_name, value, generation):
+        with self._lock:
+            if generation == self._generation:
+                self._entries[secret_name] = _CachedSecret(value, self._clock())
+            else:
+                self._stats["stale_discarded"] += 1
+                entry = self._entries.get(secret_name)
+                if entry is not None:
+                    entry.refreshing = False
+
+    def invalidate(self, secret_name=None):
+        with self._lock:
+            self._generation += 1
+            if secret_name is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(secret_name, None)
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, size=len(self._entries))
+
+_secret_cache = SecretCache(_fetch_secret, _fetch_secret_async)
+
+def get_secret(client, secret_name):
+    return _secret_cache.get(client, secret_name)
+
+async def get_secret_async(client, secret_name):
+    return await _secret_cache.get_async(client, secret_name)
+
+def invalidate_secret(secret_name=None):
+    _secret_cache.invalidate(secret_name)
+
+def get_secret_cache_stats():
+    return _secret_cache.stats()
@@ -0,0 +1,34 @@
+import importlib
+import logging
+import time
+
+# Stands in for a module until one of its attributes is first read, so the
+# Functions host can index the app without importing the OpenAI and Azure
+# SDKs, and each route only pays for what it uses. importlib's own locks make
+# the first load safe from concurrent worker threads, which
+# importlib.util.LazyLoader is not before Python 3.12.
+class LazyModule:
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def _load(self):
+        started = time.monotonic()
+        module = importlib.import_module(self._name)
+        self._module = module
+        logging.info(f"Lazy module '{self._name}' loaded in {time.monotonic() - started:.3f}s")
+        return module
+
+    def __getattr__(self, attribute):
+        module = self._module or self._load()
+        return getattr(module, attribute)
+
+def load(*names):
+    # Imports modules up front, e.g. from the warm-up, and returns how long
+    # each took; modules already imported by an earlier one cost nothing.
+    seconds = {}
+    for name in names:
+        started = time.monotonic()
+        importlib.import_module(name)
+        seconds[name] = round(time.monotonic() - started, 4)
+    return seconds
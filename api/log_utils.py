@@ -0,0 +1,151 @@
+import atexit
+import hashlib
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import tracing
+
+# Records are "event key=value ...", built only when a handler emits them, so
+# a record below the configured level costs a level check. Request and
+# response bodies are passed as Payload and logged as their size, a hash and a
+# capped preview; records that carry them are sampled per request.
+LOG_PAYLOAD_PREVIEW_CHARS = int(os.environ.get("LOG_PAYLOAD_PREVIEW_CHARS", "200"))
+LOG_VALUE_MAX_CHARS = int(os.environ.get("LOG_VALUE_MAX_CHARS", "1000"))
+# Share of requests whose verbose records are kept, by default and per route
+# (the route function's name), e.g. "get_survey=0,post_survey_analysis=0.5".
+LOG_VERBOSE_SAMPLE_RATE = float(os.environ.get("LOG_VERBOSE_SAMPLE_RATE", "0.05"))
+LOG_SAMPLE_RATES = {
+    route.strip(): float(rate)
+    for route, rate in (item.split("=", 1) for item in os.environ.get("LOG_SAMPLE_RATES", "").split(",") if "=" in item)
+}
+# Writes to console and file handlers happen on a listener thread.
+LOG_QUEUE_HANDLER = os.environ.get("LOG_QUEUE_HANDLER", "true").lower() == "true"
+
+logger = logging.getLogger()
+
+def _cap(text, limit):
+    return text if len(text) <= limit else f"{text[:limit]}...(+{len(text) - limit} chars)"
+
+def _json(value):
+    return value if isinstance(value, str) else json.dumps(value, separators=(",", ":"), ensure_ascii=False, default=str)
+
+class Payload:
+    # A body in a log record: its size, a hash to spot repeats and the start
+    # of it. Built when the record is first written, which for queued
+    # handlers is after the call that logged it, and then reused by every
+    # other handler. Values that are not strings are taken as their repr,
+    # which is what the routes used to log and is cheaper than JSON.
+    __slots__ = ("value", "_text")
+
+    def __init__(self, value):
+        self.value = value
+        self._text = None
+
+    def __str__(self):
+        if self._text is None:
+            text = self.value if isinstance(self.value, str) else repr(self.value)
+            data = text.encode("utf-8")
+            self._text = f"{{bytes={len(data)} sha256={hashlib.sha256(data).hexdigest()[:16]} preview={json.dumps(_cap(text, LOG_PAYLOAD_PREVIEW_CHARS), ensure_ascii=False)}}}"
+        return self._text
+
+def _format(value):
+    if isinstance(value, Payload):
+        return str(value)
+    if isinstance(value, BaseException):
+        value = repr(value)
+    elif value is None or isinstance(value, (bool, int, float)):
+        return str(value)
+    text = _cap(_json(value), LOG_VALUE_MAX_CHARS)
+    return text if text and not any(c.isspace() or c in '"=' for c in text) else json.dumps(text, ensure_ascii=False)
+
+class Event:
+    __slots__ = ("event", "fields")
+
+    def __init__(self, event, fields):
+        self.event = event
+        self.fields = fields
+
+    def __str__(self):
+        return " ".join([self.event] + [f"{key}={_format(value)}" for key, value in self.fields.items()])
+
+def _emit(level, event, fields):
+    # stacklevel points records at the caller of info(), error() and so on.
+    logger.log(level, Event(event, fields), extra={"event": event}, stacklevel=3)
+
+def debug(event, **fields):
+    if logger.isEnabledFor(logging.DEBUG):
+        _emit(logging.DEBUG, event, fields)
+
+def info(event, **fields):
+    if logger.isEnabledFor(logging.INFO):
+        _emit(logging.INFO, event, fields)
+
+def warning(event, **fields):
+    if logger.isEnabledFor(logging.WARNING):
+        _emit(logging.WARNING, event, fields)
+
+def error(event, **fields):
+    if logger.isEnabledFor(logging.ERROR):
+        _emit(logging.ERROR, event, fields)
+
+def sample_rate(route):
+    return LOG_SAMPLE_RATES.get(route, LOG_VERBOSE_SAMPLE_RATE)
+
+def sampled():
+    # Decided once per request, on its route span, so a sampled request keeps
+    # all of its verbose records; outside a route each record is sampled.
+    route_span = tracing.route_span()
+    if route_span is None:
+        return random.random() < LOG_VERBOSE_SAMPLE_RATE
+    if route_span.log_sampled is None:
+        route_span.log_sampled = random.random() < sample_rate(route_span.operation)
+    return route_span.log_sampled
+
+def verbose(event, **fields):
+    # INFO records with payloads, kept for a sample of requests.
+    if logger.isEnabledFor(logging.INFO) and sampled():
+        _emit(logging.INFO, event, fields)
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    # The stock prepare() formats the record on the caller's thread so it can
+    # be pickled; this queue stays in the process, so formatting is left to
+    # the listener.
+    def prepare(self, record):
+        return record
+
+_listener = None
+
+def configure():
+    # Moves the root logger's console and file handlers behind a queue, so a
+    # request only enqueues its records. Other handlers stay in place: the
+    # Functions host's reads the invocation from the logging thread and
+    # already hands records off to the host, as OpenTelemetry's exporter does.
+    global _listener
+    if _listener is not None or not LOG_QUEUE_HANDLER:
+        return
+    blocking = [handler for handler in logger.handlers if type(handler) is logging.StreamHandler or isinstance(handler, logging.FileHandler)]
+    if not blocking:
+        return
+    records = queue.SimpleQueue()
+    for handler in blocking:
+        logger.removeHandler(handler)
+    logger.addHandler(_QueueHandler(records))
+    _listener = logging.handlers.QueueListener(records, *blocking, respect_handler_level=True)
+    _listener.start()
+    atexit.register(shutdown)
+
+def shutdown():
+    # Writes out queued records and puts the handlers back.
+    global _listener
+    listener, _listener = _listener, None
+    if listener is None:
+        return
+    listener.stop()
+    for handler in list(logger.handlers):
+        if isinstance(handler, _QueueHandler):
+            logger.removeHandler(handler)
+    for handler in listener.handlers:
+        logger.addHandler(handler)
@@ -0,0 +1,106 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import db_utils
+from client_registry import registry
+
+# Online migration of surveys from the single-partition surveysV2 container to
+# the name-partitioned surveysV3 container and its catalogue:
+#   1. Deploy with SURVEY_STORAGE_LAYOUT=dual so every write goes to both.
+#   2. Run `python migrate_surveys.py copy`; it can be stopped and resumed.
+#   3. Run `python migrate_surveys.py reconcile` to drop surveys deleted while
+#      the copy was running.
+#   4. Deploy with SURVEY_STORAGE_LAYOUT=sharded.
+# The copy only creates documents that are missing, so it never overwrites a
+# newer version written by the app in the meantime.
+MIGRATION_PAGE_SIZE = 100
+MIGRATION_CONCURRENCY = 16
+MIGRATION_CHECKPOINT_PATH = "survey_migration.checkpoint.json"
+
+def load_checkpoint(path):
+    if not os.path.exists(path):
+        return {"continuationToken": None, "done": False, "copied": 0, "skipped": 0}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def save_checkpoint(path, checkpoint):
+    # Written to a temporary file first so an interrupted run never leaves a
+    # truncated checkpoint behind.
+    temporary_path = f"{path}.tmp"
+    with open(temporary_path, "w", encoding="utf-8") as f:
+        json.dump(checkpoint, f)
+    os.replace(temporary_path, path)
+
+async def _bounded(semaphore, coroutine):
+    async with semaphore:
+        return await coroutine
+
+async def copy_surveys(client, checkpoint_path, page_size=MIGRATION_PAGE_SIZE, concurrency=MIGRATION_CONCURRENCY):
+    checkpoint = load_checkpoint(checkpoint_path)
+    if checkpoint["done"]:
+        logging.info(f"Survey copy already finished: {checkpoint}")
+        return checkpoint
+    semaphore = asyncio.Semaphore(concurrency)
+    while True:
+        surveys, continuation_token = await db_utils.list_legacy_surveys_page_async(client, page_size, checkpoint["continuationToken"])
+        created = await asyncio.gather(*(
+            _bounded(semaphore, db_utils.create_sharded_survey_async(client, survey[db_utils.ID_KEY], survey[db_utils.DATA_KEY]))
+            for survey in surveys
+        ))
+        # Entries are upserted even for skipped surveys, so re-running the copy
+        # also repairs the catalogue.
+        await db_utils.put_catalogue_entries_async(client, [survey[db_utils.ID_KEY] for survey in surveys])
+        checkpoint["copied"] += sum(created)
+        checkpoint["skipped"] += len(created) - sum(created)
+        checkpoint["continuationToken"] = continuation_token
+        checkpoint["done"] = continuation_token is None
+        save_checkpoint(checkpoint_path, checkpoint)
+        logging.info(f"Survey copy progress: {checkpoint['copied']} copied, {checkpoint['skipped']} already present")
+        if checkpoint["done"]:
+            return checkpoint
+
+async def _reconcile_survey(client, name):
+    if await db_utils.legacy_survey_exists_async(client, name):
+        return False
+    await db_utils.delete_sharded_survey_async(client, name)
+    return True
+
+async def reconcile_surveys(client, page_size=MIGRATION_PAGE_SIZE, concurrency=MIGRATION_CONCURRENCY):
+    # The legacy container is authoritative until the switch to "sharded", so
+    # anything it no longer has is removed from the new layout.
+    semaphore = asyncio.Semaphore(concurrency)
+    removed = 0
+    for shard in range(db_utils.SURVEY_CATALOGUE_SHARDS):
+        continuation_token = None
+        while True:
+            names, continuation_token = await db_utils.list_catalogue_shard_page_async(client, shard, page_size, continuation_token)
+            results = await asyncio.gather(*(_bounded(semaphore, _reconcile_survey(client, name)) for name in names))
+            removed += sum(results)
+            if continuation_token is None:
+                break
+    logging.info(f"Survey reconcile removed {removed} surveys")
+    return removed
+
+async def main(args):
+    client = db_utils.get_async_client()
+    try:
+        if args.command == "copy":
+            if args.restart and os.path.exists(args.checkpoint):
+                os.remove(args.checkpoint)
+            await copy_surveys(client, args.checkpoint, args.page_size, args.concurrency)
+        else:
+            await reconcile_surveys(client, args.page_size, args.concurrency)
+    finally:
+        await registry.aclose()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Migrate surveys to the name-partitioned layout.")
+    parser.add_argument("command", choices=["copy", "reconcile"])
+    parser.add_argument("--checkpoint", default=MIGRATION_CHECKPOINT_PATH)
+    parser.add_argument("--page-size", type=int, default=MIGRATION_PAGE_SIZE)
+    parser.add_argument("--concurrency", type=int, default=MIGRATION_CONCURRENCY)
+    parser.add_argument("--restart", action="store_true", help="Ignore the checkpoint and copy from the start.")
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main(parser.parse_args()))
@@ -1,20 +1,177 @@
-from openai import OpenAI
-from retry import exponential_backoff
+import asyncio
+import functools
+import os
+import tempfile
+import threading
+import openai
+from openai import AsyncOpenAI, OpenAI, APIConnectionError
+import hedging
+import log_utils
+import rate_limiter
+import retry
+import tracing
+from client_registry import registry, evict_on, key_digest
+from retry import RetryPolicy, TRANSIENT_STATUS_CODES
 
+DEFAULT_MODEL = "gpt-4o"
+DEFAULT_MAX_TOKENS = 4096
+DEFAULT_TEMPERATURE = 0.1
+DEFAULT_TOP_P = 0.1
+# Model per kind of call, so cheaper or faster models can take the calls that
+# do not need gpt-4o: "analysis" writes the whole response, "numeric" the
+# totals and ROI (and re-asks for them when they fail the checks), "narrative"
+# the insights, recommendations and summary once the numbers are known, and
+# "extraction" lists the costs and benefits stated in each form.
+MODEL_TIERS = {tier: os.environ.get(f"OPENAI_MODEL_{tier.upper()}", DEFAULT_MODEL) for tier in ("analysis", "numeric", "narrative", "extraction")}
+# A single call is abandoned after this many seconds (or at the caller's
+# deadline, if sooner) and retried like any other timeout; 0 disables it.
+OPENAI_TIMEOUT_SECONDS = float(os.environ.get("OPENAI_TIMEOUT_SECONDS", "90"))
+# Hedged calls send a second request, to OPENAI_HEDGE_MODEL or else the same
+# model, once the first has taken longer than this percentile of recent calls
+# of its kind; until there are enough of them the initial delay is used.
+OPENAI_HEDGE_ENABLED = os.environ.get("OPENAI_HEDGE_ENABLED", "true").lower() == "true"
+OPENAI_HEDGE_MODEL = os.environ.get("OPENAI_HEDGE_MODEL", "")
+OPENAI_HEDGE_PERCENTILE = float(os.environ.get("OPENAI_HEDGE_PERCENTILE", "0.95"))
+OPENAI_HEDGE_INITIAL_DELAY_SECONDS = float(os.environ.get("OPENAI_HEDGE_INITIAL_DELAY_SECONDS", "30"))
+OPENAI_HEDGE_MIN_DELAY_SECONDS = float(os.environ.get("OPENAI_HEDGE_MIN_DELAY_SECONDS", "2"))
+OPENAI_HEDGE_MIN_SAMPLES = int(os.environ.get("OPENAI_HEDGE_MIN_SAMPLES", "20"))
+# Deployment quota for requests and tokens per minute; 0 disables that bucket.
+OPENAI_RPM_LIMIT = int(os.environ.get("OPENAI_RPM_LIMIT", "0"))
+OPENAI_TPM_LIMIT = int(os.environ.get("OPENAI_TPM_LIMIT", "0"))
+# Calls that cannot be admitted within this many seconds are shed.
+OPENAI_RATE_LIMIT_MAX_WAIT_SECONDS = float(os.environ.get("OPENAI_RATE_LIMIT_MAX_WAIT_SECONDS", "30"))
+# "cosmos" shares the buckets across instances, "sqlite" across processes on
+# one machine, and "memory" keeps them per process.
+OPENAI_RATE_LIMIT_BACKEND = os.environ.get("OPENAI_RATE_LIMIT_BACKEND", "memory")
+OPENAI_RATE_LIMIT_SQLITE_PATH = os.environ.get("OPENAI_RATE_LIMIT_SQLITE_PATH", os.path.join(tempfile.gettempdir(), "changeai-ratelimits.sqlite3"))
+
+class MissingResponseError(Exception):
+    pass
+
+def _is_retryable(e):
+    if isinstance(e, openai.RateLimitError):
+        # An exhausted quota is a billing problem, not a transient throttle.
+        return getattr(e, "code", None) != "insufficient_quota"
+    if isinstance(e, (openai.APITimeoutError, openai.APIConnectionError, MissingResponseError)):
+        return True
+    if isinstance(e, openai.APIStatusError):
+        return e.status_code in TRANSIENT_STATUS_CODES
+    # Validation, content filter and length errors will not change on retry.
+    return False
+
+OPENAI_RETRY_POLICY = RetryPolicy("openai", is_retryable=_is_retryable, retries=3, base_delay=1.0, max_delay=20.0, max_retry_after=30.0)
+
+def _request_timeout(timeout=None):
+    # Caps a single call by its own timeout and by what is left of the
+    # caller's deadline, if any.
+    timeout = OPENAI_TIMEOUT_SECONDS if timeout is None else timeout
+    budget = retry.remaining()
+    if budget is not None:
+        timeout = min(timeout, max(budget, 1.0)) if timeout else max(budget, 1.0)
+    return timeout or openai.NOT_GIVEN
+
+def estimate_tokens(text):
+    # Rough count (about four characters per token for English JSON) used for
+    # budgeting; it does not need to match the tokenizer exactly.
+    return (len(text) + 3) // 4
+
+@functools.lru_cache(maxsize=None)
+def _encoding(model):
+    # tiktoken fetches its vocabulary on first use; without it (or offline)
+    # counts fall back to estimate_tokens.
+    try:
+        import tiktoken
+        return tiktoken.encoding_for_model(model)
+    except Exception as e:
+        log_utils.warning("Token counting falls back to estimates", model=model, error=e)
+        return None
+
+def count_tokens(text, model=DEFAULT_MODEL):
+    encoding = _encoding(model)
+    if encoding is None:
+        return estimate_tokens(text)
+    return len(encoding.encode(text, disallowed_special=()))
+
+def _create_rate_limit_store(name):
+    if name == "cosmos":
+        return rate_limiter.CosmosBucketStore()
+    if name == "sqlite":
+        return rate_limiter.SqliteBucketStore(OPENAI_RATE_LIMIT_SQLITE_PATH)
+    if name == "memory":
+        return rate_limiter.MemoryBucketStore()
+    raise ValueError(f"Unknown OpenAI rate limit backend '{name}'")
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+def get_rate_limiter():
+    global _limiter
+    if _limiter is None:
+        with _limiter_lock:
+            if _limiter is None:
+                _limiter = rate_limiter.RateLimiter(
+                    name="openai",
+                    store=_create_rate_limit_store(OPENAI_RATE_LIMIT_BACKEND),
+                    limits={"requests": OPENAI_RPM_LIMIT, "tokens": OPENAI_TPM_LIMIT},
+                    max_wait=OPENAI_RATE_LIMIT_MAX_WAIT_SECONDS
+                )
+    return _limiter
+
+def configure_rate_limiter(limiter):
+    global _limiter
+    with _limiter_lock:
+        _limiter = limiter
+
+def _request_cost(system_message, user_message, max_tokens, model=DEFAULT_MODEL):
+    # Quota is charged on prompt plus max_tokens up front, the same way the
+    # service counts it when admitting a request.
+    return {"requests": 1, "tokens": count_tokens(system_message, model) + count_tokens(user_message, model) + max_tokens}
+
+def _record_usage(system_message, user_message, completion):
+    tracing.add("bytes_sent", len(system_message.encode("utf-8")) + len(user_message.encode("utf-8")))
+    usage = getattr(completion, "usage", None)
+    if usage is not None:
+        tracing.add("prompt_tokens", getattr(usage, "prompt_tokens", 0) or 0)
+        tracing.add("completion_tokens", getattr(usage, "completion_tokens", 0) or 0)
+
+def _unused_tokens(cost, completion):
+    usage = getattr(completion, "usage", None)
+    total_tokens = getattr(usage, "total_tokens", None)
+    return {"tokens": cost["tokens"] - total_tokens} if total_tokens is not None else {}
+
+# The SDK's own retries are off: they would repeat a timed out call before
+# OPENAI_RETRY_POLICY, and its backoff and deadline, ever saw it.
 def get_client(api_key):
-    return OpenAI(api_key=api_key)
+    return registry.get(f"openai:{key_digest(api_key)}", lambda: OpenAI(api_key=api_key, max_retries=0))
 
-@exponential_backoff(initial_delay=1, retries=3)
+def get_async_client(api_key):
+    return registry.get(f"openai-aio:{key_digest(api_key)}", lambda: AsyncOpenAI(api_key=api_key, max_retries=0))
+
+def _get_content(completion):
+    choices = completion.choices if completion else None
+    message = choices[0].message if choices else None
+    content = message.content if message else None
+    if not content:
+        raise MissingResponseError("Response from OpenAI was missing")
+    return content
+
+@tracing.traced("openai")
+@evict_on(APIConnectionError)
+@OPENAI_RETRY_POLICY
 def get_json_response(
     client,
     system_message,
     user_message,
     response_class,
-    model="gpt-4o",
-    max_tokens=4096,
-    temperature=0.1,
-    top_p=0.1
+    model=DEFAULT_MODEL,
+    max_tokens=DEFAULT_MAX_TOKENS,
+    temperature=DEFAULT_TEMPERATURE,
+    top_p=DEFAULT_TOP_P,
+    timeout=None
 ):
+    limiter = get_rate_limiter()
+    cost = _request_cost(system_message, user_message, max_tokens, model)
+    limiter.acquire(cost)
     completion = client.beta.chat.completions.parse(
         model=model,
         messages=[
@@ -24,11 +181,126 @@ def get_json_response(
         response_format=response_class,
         max_tokens=max_tokens,
         temperature=temperature,
-        top_p=top_p
+        top_p=top_p,
+        timeout=_request_timeout(timeout)
     )
-    choices = completion.choices if completion else None
-    message = choices[0].message if choices else None
-    content = message.content if message else None
-    if not content:
-        raise Exception("Response from OpenAI was missing")
-    return content
\ No newline at end of file
+    _record_usage(system_message, user_message, completion)
+    limiter.refund(_unused_tokens(cost, completion))
+    return _get_content(completion)
+
+async def _parse_async(client, system_message, user_message, response_class, model, max_tokens, temperature, top_p, timeout):
+    limiter = get_rate_limiter()
+    cost = _request_cost(system_message, user_message, max_tokens, model)
+    await limiter.acquire_async(cost)
+    completion = await client.beta.chat.completions.parse(
+        model=model,
+        messages=[
+            {"role": "system", "content": system_message},
+            {"role": "user", "content": user_message},
+        ],
+        response_format=response_class,
+        max_tokens=max_tokens,
+        temperature=temperature,
+        top_p=top_p,
+        timeout=_request_timeout(timeout)
+    )
+    _record_usage(system_message, user_message, completion)
+    await asyncio.to_thread(limiter.refund, _unused_tokens(cost, completion))
+    return _get_content(completion)
+
+_hedges = {}
+_hedges_lock = threading.Lock()
+
+def get_hedge(model, response_class):
+    # One latency window per model and kind of response, since an analysis
+    # and a numeric re-ask take very different times.
+    name = f"{model}:{response_class.__name__}"
+    with _hedges_lock:
+        if name not in _hedges:
+            _hedges[name] = hedging.Hedge(
+                name,
+                percentile=OPENAI_HEDGE_PERCENTILE,
+                initial_delay=OPENAI_HEDGE_INITIAL_DELAY_SECONDS,
+                min_delay=OPENAI_HEDGE_MIN_DELAY_SECONDS,
+                min_samples=OPENAI_HEDGE_MIN_SAMPLES
+            )
+        return _hedges[name]
+
+def hedge_stats():
+    with _hedges_lock:
+        hedges = list(_hedges.values())
+    return [hedge.stats() for hedge in hedges]
+
+@tracing.traced("openai")
+@evict_on(APIConnectionError)
+@OPENAI_RETRY_POLICY
+async def get_json_response_async(
+    client,
+    system_message,
+    user_message,
+    response_class,
+    model=DEFAULT_MODEL,
+    max_tokens=DEFAULT_MAX_TOKENS,
+    temperature=DEFAULT_TEMPERATURE,
+    top_p=DEFAULT_TOP_P,
+    timeout=None,
+    hedge=False
+):
+    # With hedge, each attempt may send a second call; the first content that
+    # validates against response_class wins and the other call is cancelled.
+    arguments = (system_message, user_message, response_class)
+    options = (max_tokens, temperature, top_p, timeout)
+    if not (hedge and OPENAI_HEDGE_ENABLED):
+        return await _parse_async(client, *arguments, model, *options)
+
+    def leg(leg_model):
+        async def call():
+            content = await _parse_async(client, *arguments, leg_model, *options)
+            response_class.model_validate_json(content)
+            return content
+        return call
+
+    return await get_hedge(model, response_class).run(leg(model), leg(OPENAI_HEDGE_MODEL or model))
+
+@tracing.traced("openai")
+@evict_on(APIConnectionError)
+async def stream_json_response_async(
+    client,
+    system_message,
+    user_message,
+    response_class,
+    model=DEFAULT_MODEL,
+    max_tokens=DEFAULT_MAX_TOKENS,
+    temperature=DEFAULT_TEMPERATURE,
+    top_p=DEFAULT_TOP_P
+):
+    # Yields ("partial", dict) as the structured output is parsed incrementally,
+    # then ("final", str) with the complete JSON content. Streams are not
+    # retried: tokens already forwarded to a caller cannot be taken back. The
+    # caller's deadline caps every read and the stream as a whole.
+    limiter = get_rate_limiter()
+    cost = _request_cost(system_message, user_message, max_tokens, model)
+    await limiter.acquire_async(cost)
+    async with client.beta.chat.completions.stream(
+        model=model,
+        messages=[
+            {"role": "system", "content": system_message},
+            {"role": "user", "content": user_message},
+        ],
+        response_format=response_class,
+        max_tokens=max_tokens,
+        temperature=temperature,
+        top_p=top_p,
+        stream_options={"include_usage": True},
+        timeout=_request_timeout()
+    ) as stream:
+        async for event in stream:
+            budget = retry.remaining()
+            if budget is not None and budget <= 0:
+                raise retry.DeadlineExceededError("Deadline exceeded while streaming")
+            if event.type == "content.delta" and isinstance(event.parsed, dict):
+                yield "partial", event.parsed
+        completion = await stream.get_final_completion()
+    _record_usage(system_message, user_message, completion)
+    await asyncio.to_thread(limiter.refund, _unused_tokens(cost, completion))
+    yield "final", _get_content(completion)
@@ -0,0 +1,138 @@
+import hashlib
+import json
+import os
+import openai_utils
+import system_message
+
+# Surveys whose compact prompt is larger than this are analysed map-reduce:
+# forms are extracted in parallel, in chunks of at most PROMPT_CHUNK_TOKENS,
+# and the extractions are then aggregated in one final call.
+PROMPT_MAX_INPUT_TOKENS = int(os.environ.get("PROMPT_MAX_INPUT_TOKENS", "60000"))
+PROMPT_CHUNK_TOKENS = int(os.environ.get("PROMPT_CHUNK_TOKENS", "12000"))
+# The extraction has an entry per form and its latency is mostly completion
+# tokens, so small chunks run in parallel finish about when the final call does.
+PROMPT_CHUNK_FORMS = int(os.environ.get("PROMPT_CHUNK_FORMS", "8"))
+# Part of the analysis cache key, so changing the layout does not serve
+# analyses generated from the old one.
+PROMPT_FORMAT = "compact-v1"
+# Stored with every extraction; extractions made with another prompt or model
+# are not reused.
+EXTRACTION_FORMAT = f"form-v1:{openai_utils.MODEL_TIERS['extraction']}"
+
+class Prompt:
+    def __init__(self, system_message, user_message):
+        self.system_message = system_message
+        self.user_message = user_message
+
+    def tokens(self):
+        return openai_utils.count_tokens(self.system_message) + openai_utils.count_tokens(self.user_message)
+
+def compact_json(value):
+    return json.dumps(value, separators=(",", ":"), ensure_ascii=False)
+
+def _clean(text):
+    return " ".join(str(text).split())
+
+def _row(form):
+    title, description, contents = _clean(form.title), _clean(form.description), _clean(form.contents)
+    if not description or description == title:
+        return [title, contents]
+    return [title, description, contents]
+
+def form_entries(forms):
+    # [(fingerprint, category, row)] in first-seen order, without repeated
+    # forms. The fingerprint is taken from the form's content, so an unchanged
+    # form keeps it across versions of a survey.
+    entries = []
+    seen = set()
+    for form in forms:
+        category, row = _clean(form.category), _row(form)
+        fingerprint = hashlib.sha256(compact_json([category, *row]).encode("utf-8")).hexdigest()[:32]
+        if fingerprint in seen:
+            continue
+        seen.add(fingerprint)
+        entries.append((fingerprint, category, row))
+    return entries
+
+def group_entries(entries):
+    # {category: [row, ...]}; each category string is sent once.
+    groups = {}
+    for _, category, row in entries:
+        groups.setdefault(category, []).append(row)
+    return groups
+
+def compact_forms(forms):
+    return group_entries(form_entries(forms))
+
+def chunk_entries(entries, max_tokens=PROMPT_CHUNK_TOKENS, max_forms=PROMPT_CHUNK_FORMS):
+    # Splits form entries into chunks of at most max_tokens and max_forms,
+    # keeping their order. A single form larger than max_tokens gets a chunk
+    # of its own.
+    chunks = []
+    chunk, categories, size = [], set(), 0
+    for entry in entries:
+        _, category, row = entry
+        # The row plus its id in the extraction layout.
+        tokens = openai_utils.count_tokens(compact_json(row)) + 3
+        header = 0 if category in categories else openai_utils.count_tokens(compact_json(category)) + 3
+        if chunk and (size + tokens + header > max_tokens or len(chunk) >= max_forms):
+            chunks.append(chunk)
+            chunk, categories, size = [], set(), 0
+            header = openai_utils.count_tokens(compact_json(category)) + 3
+        chunk.append(entry)
+        categories.add(category)
+        size += tokens + header
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+def forms_prompt(system_prompt, groups):
+    return Prompt(system_prompt + system_message.COMPACT_FORMS_NOTE, compact_json(groups))
+
+def extraction_prompt(entries):
+    # Forms are numbered by their position in `entries` so the model's
+    # per-form answers can be matched back to them.
+    groups = {}
+    for index, (_, category, row) in enumerate(entries):
+        groups.setdefault(category, []).append([index, *row])
+    return Prompt(system_message.ROI_EXTRACTION_SYSTEM_MESSAGE, compact_json(groups))
+
+def aggregate_prompt(system_prompt, extractions, entries=()):
+    # The final call over stored extractions, plus the forms in `entries` as
+    # they are. Without any extractions this is the plain forms prompt.
+    if not extractions:
+        return forms_prompt(system_prompt, group_entries(entries))
+
+    def rows(field):
+        return [[item["title"], item["amount"]] for extraction in extractions for item in extraction[field]]
+
+    message = {
+        "costs": rows("costs"),
+        "benefits": rows("benefits"),
+        "observations": [observation for extraction in extractions for observation in extraction["observations"]]
+    }
+    if not entries:
+        return Prompt(system_prompt + system_message.AGGREGATE_NOTE, compact_json(message))
+    message["forms"] = group_entries(entries)
+    return Prompt(system_prompt + system_message.AGGREGATE_NOTE + system_message.AGGREGATE_FORMS_NOTE, compact_json(message))
+
+def section_prompt(prompt, note, numbers=None):
+    # One part of a split analysis. The system message and forms are sent
+    # unchanged and first, so every part shares the prompt's prefix, which
+    # the service can cache, and only the request at the end differs.
+    parts = [prompt.user_message]
+    if numbers is not None:
+        parts.append(system_message.CHECKED_NUMBERS_NOTE + compact_json(numbers))
+    parts.append(note)
+    return Prompt(prompt.system_message, "\n\n".join(parts))
+
+def plan(request, system_prompt, incremental=False, max_input_tokens=PROMPT_MAX_INPUT_TOKENS):
+    # Returns (prompt, None) when the survey is sent whole in one call, or
+    # (None, form entries) when it goes through per-form extraction: always
+    # for incremental analysis, otherwise only when it is too large.
+    entries = form_entries(request.forms)
+    if not incremental:
+        prompt = forms_prompt(system_prompt, group_entries(entries))
+        if prompt.tokens() <= max_input_tokens:
+            return prompt, None
+    return None, entries
@@ -0,0 +1,316 @@
+import asyncio
+import json
+import random
+import sqlite3
+import threading
+import time
+import db_utils
+import log_utils
+import retry
+from single_flight import SingleFlight
+
+# Buckets refill continuously at `limit` units per minute and hold at most one
+# minute's worth, so short bursts are admitted but the per-minute rate is not
+# exceeded. Wall clock time is used because state may be shared by processes.
+REFILL_WINDOW_SECONDS = 60.0
+# Waiters poll the shared buckets; the poll interval is capped so a refund or a
+# freed slot is noticed promptly, and jittered so waiters do not poll in step.
+MAX_POLL_SECONDS = 1.0
+
+class RateLimitExceededError(Exception):
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+def _take(state, costs, limits, now):
+    # Refills every bucket in `state` and, if all of them can cover their cost,
+    # debits them. Returns 0 when admitted, otherwise the seconds until the
+    # slowest bucket will have refilled enough. Mutates `state` either way.
+    wait = 0.0
+    for name, limit in limits.items():
+        bucket = state.setdefault(name, {"tokens": float(limit), "updated": now})
+        elapsed = max(now - bucket["updated"], 0.0)
+        bucket["tokens"] = min(float(limit), bucket["tokens"] + elapsed * limit / REFILL_WINDOW_SECONDS)
+        bucket["updated"] = now
+        # A single request larger than the bucket waits for a full bucket.
+        cost = min(costs.get(name, 0), limit)
+        if bucket["tokens"] < cost:
+            wait = max(wait, (cost - bucket["tokens"]) * REFILL_WINDOW_SECONDS / limit)
+    if wait == 0.0:
+        for name, limit in limits.items():
+            state[name]["tokens"] -= min(costs.get(name, 0), limit)
+    return wait
+
+def _give_back(state, amounts, limits):
+    for name, amount in amounts.items():
+        if name in state and name in limits:
+            state[name]["tokens"] = min(float(limits[name]), state[name]["tokens"] + amount)
+
+class MemoryBucketStore:
+    # Per-process buckets, for a single worker or for tests.
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._states = {}
+
+    def acquire(self, key, costs, limits, now):
+        with self._lock:
+            return _take(self._states.setdefault(key, {}), costs, limits, now)
+
+    def refund(self, key, amounts, limits):
+        with self._lock:
+            _give_back(self._states.setdefault(key, {}), amounts, limits)
+
+class SqliteBucketStore:
+    # Buckets shared by every process that can open the same file; a local
+    # stand-in for the Cosmos store.
+    def __init__(self, path):
+        self._path = path
+        with self._connect() as connection:
+            connection.execute("CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, state TEXT NOT NULL)")
+
+    def _connect(self):
+        return sqlite3.connect(self._path, timeout=30, isolation_level=None)
+
+    def _update(self, key, change):
+        connection = self._connect()
+        try:
+            # IMMEDIATE takes the write lock up front, so the read-modify-write
+            # below is atomic across processes.
+            connection.execute("BEGIN IMMEDIATE")
+            row = connection.execute("SELECT state FROM buckets WHERE key = ?", (key,)).fetchone()
+            state = json.loads(row[0]) if row else {}
+            result = change(state)
+            connection.execute("INSERT OR REPLACE INTO buckets (key, state) VALUES (?, ?)", (key, json.dumps(state)))
+            connection.execute("COMMIT")
+            return result
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        finally:
+            connection.close()
+
+    def acquire(self, key, costs, limits, now):
+        return self._update(key, lambda state: _take(state, costs, limits, now))
+
+    def refund(self, key, amounts, limits):
+        self._update(key, lambda state: _give_back(state, amounts, limits))
+
+class CosmosBucketStore:
+    # Buckets shared by every Function App instance, updated with optimistic
+    # concurrency on the document etag. Each instance leases a block of
+    # capacity (a fraction of every limit, or the whole cost if larger) and
+    # admits calls from it locally, so the shared document is read and
+    # replaced once per block rather than once per call. Leases expire after
+    # `lease_seconds`, so an instance cannot keep admitting from capacity it
+    # took long ago; whatever is left of one goes back to the shared buckets
+    # when the instance next renews.
+    def __init__(self, max_conflicts=10, lease_fraction=0.05, lease_seconds=5.0, contended_wait=0.1):
+        self._max_conflicts = max_conflicts
+        self._lease_fraction = lease_fraction
+        self._lease_seconds = lease_seconds
+        self._contended_wait = contended_wait
+        self._lock = threading.Lock()
+        self._leases = {}
+        self._renewals = SingleFlight()
+
+    def _update(self, key, change):
+        # Returns (True, result) once the change is written, or (False, None)
+        # when every attempt lost the race to another instance.
+        client = db_utils.get_client()
+        for _ in range(self._max_conflicts):
+            state, etag = db_utils.get_rate_limit_state(client, key)
+            result = change(state)
+            if db_utils.put_rate_limit_state(client, key, state, etag):
+                return True, result
+        log_utils.warning("Rate limit state is contended", key=key, attempts=self._max_conflicts)
+        return False, None
+
+    def _renew(self, state, leftover, costs, limits, now):
+        # Returns the leftover of the previous lease, then takes a full block
+        # or, when the buckets cannot cover one, just this call's cost.
+        _give_back(state, leftover, limits)
+        block = {name: min(max(costs.get(name, 0), limit * self._lease_fraction), limit) for name, limit in limits.items()}
+        if _take(state, block, limits, now) == 0.0:
+            return 0.0, block
+        return _take(state, costs, limits, now), costs
+
+    def _merge(self, key, buckets, expires, limits):
+        if not buckets:
+            return
+        lease = self._leases.setdefault(key, {"buckets": {}, "expires": expires})
+        lease["expires"] = max(lease["expires"], expires)
+        for name, amount in buckets.items():
+            if name in limits:
+                lease["buckets"][name] = min(float(limits[name]), lease["buckets"].get(name, 0.0) + amount)
+
+    def _debit(self, key, costs, limits, now):
+        # Admits the call from the local lease if it covers every cost.
+        with self._lock:
+            lease = self._leases.get(key)
+            if lease is None or lease["expires"] <= now or any(lease["buckets"].get(name, 0.0) < min(costs.get(name, 0), limit) for name, limit in limits.items()):
+                return False
+            for name, limit in limits.items():
+                lease["buckets"][name] -= min(costs.get(name, 0), limit)
+            return True
+
+    def _renew_lease(self, key, costs, limits, now):
+        # Swaps the local lease for a fresh block. Returns 0 once it is in
+        # place, otherwise the seconds until the shared buckets can cover the
+        # call. The shared document is updated outside the lock, so admissions
+        # from other leases are not held up by it.
+        with self._lock:
+            lease = self._leases.pop(key, None)
+        leftover = lease["buckets"] if lease is not None else {}
+        expires = lease["expires"] if lease is not None else now
+        try:
+            written, result = self._update(key, lambda state: self._renew(state, leftover, costs, limits, now))
+        except BaseException:
+            with self._lock:
+                self._merge(key, leftover, expires, limits)
+            raise
+        with self._lock:
+            if not written:
+                self._merge(key, leftover, expires, limits)
+                # Contention is not exhaustion: the caller polls again within
+                # its own wait budget.
+                return self._contended_wait
+            wait, granted = result
+            if wait == 0.0:
+                self._merge(key, granted, now + self._lease_seconds, limits)
+            return wait
+
+    def acquire(self, key, costs, limits, now):
+        if self._debit(key, costs, limits, now):
+            return 0.0
+        # One renewal per key at a time: callers that need one while it runs
+        # wait for it and then try the new lease.
+        wait = self._renewals.do(key, lambda: self._renew_lease(key, costs, limits, now))
+        if wait:
+            return wait
+        if self._debit(key, costs, limits, now):
+            return 0.0
+        # Callers ahead of this one used up the new block.
+        return self._contended_wait
+
+    def refund(self, key, amounts, limits):
+        # Refunds top up the local lease and reach the shared buckets with the
+        # rest of its leftover. Without a lease they are written straight back.
+        with self._lock:
+            if key in self._leases:
+                self._merge(key, amounts, self._leases[key]["expires"], limits)
+                return
+        self._update(key, lambda state: _give_back(state, amounts, limits))
+
+class RateLimiter:
+    def __init__(self, name, store, limits, max_wait, clock=time.time):
+        self.name = name
+        self._store = store
+        # Limits of 0 (or less) are unlimited and left out of the buckets.
+        self._limits = {bucket: limit for bucket, limit in limits.items() if limit and limit > 0}
+        self._max_wait = max_wait
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._stats = {
+            "admitted": 0,
+            "shed": 0,
+            "waiting": 0,
+            "max_waiting": 0,
+            "waited": 0,
+            "wait_seconds_total": 0.0,
+            "wait_seconds_max": 0.0,
+            "refunded": {}
+        }
+
+    @property
+    def enabled(self):
+        return bool(self._limits)
+
+    def _wait_budget(self):
+        # The caller's retry deadline, if shorter, also bounds the wait.
+        budget = retry.remaining()
+        return self._max_wait if budget is None else min(self._max_wait, budget)
+
+    def _next_sleep(self, costs, waited):
+        # Returns 0 once admitted, the seconds to sleep before trying again, or
+        # raises when the wait would exceed the budget.
+        wait = self._store.acquire(self.name, costs, self._limits, self._clock())
+        if wait == 0:
+            return 0
+        left = self._wait_budget() - waited
+        if wait > left:
+            with self._lock:
+                self._stats["shed"] += 1
+            raise RateLimitExceededError(f"Rate limit '{self.name}' exhausted, {wait:.2f}s wait exceeds the remaining {max(left, 0):.2f}s", retry_after=wait)
+        return min(wait, MAX_POLL_SECONDS) * random.uniform(0.8, 1.0)
+
+    def _enter(self):
+        with self._lock:
+            self._stats["waiting"] += 1
+            self._stats["max_waiting"] = max(self._stats["max_waiting"], self._stats["waiting"])
+
+    def _leave(self, waited, admitted, queued):
+        with self._lock:
+            self._stats["waiting"] -= 1
+            if admitted:
+                self._stats["admitted"] += 1
+                if queued:
+                    self._stats["waited"] += 1
+                    self._stats["wait_seconds_total"] += waited
+                    self._stats["wait_seconds_max"] = max(self._stats["wait_seconds_max"], waited)
+
+    def acquire(self, costs):
+        if not self.enabled:
+            return
+        started = time.monotonic()
+        admitted = False
+        queued = False
+        self._enter()
+        try:
+            while True:
+                sleep = self._next_sleep(costs, time.monotonic() - started)
+                if sleep == 0:
+                    admitted = True
+                    return
+                queued = True
+                time.sleep(sleep)
+        finally:
+            self._leave(time.monotonic() - started, admitted, queued)
+
+    async def acquire_async(self, costs):
+        if not self.enabled:
+            return
+        started = time.monotonic()
+        admitted = False
+        queued = False
+        self._enter()
+        try:
+            while True:
+                sleep = await asyncio.to_thread(self._next_sleep, costs, time.monotonic() - started)
+                if sleep == 0:
+                    admitted = True
+                    return
+                queued = True
+                await asyncio.sleep(sleep)
+        finally:
+            self._leave(time.monotonic() - started, admitted, queued)
+
+    def refund(self, amounts):
+        # Returns over-estimated capacity once the real usage is known.
+        amounts = {bucket: amount for bucket, amount in amounts.items() if bucket in self._limits and amount > 0}
+        if not amounts:
+            return
+        try:
+            self._store.refund(self.name, amounts, self._limits)
+        except Exception as e:
+            log_utils.warning("Rate limit refund failed", limiter=self.name, error=e)
+            return
+        with self._lock:
+            for bucket, amount in amounts.items():
+                self._stats["refunded"][bucket] = self._stats["refunded"].get(bucket, 0) + amount
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats, refunded=dict(self._stats["refunded"]))
+        stats["limits"] = dict(self._limits)
+        stats["max_wait_seconds"] = self._max_wait
+        return stats
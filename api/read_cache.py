@@ -0,0 +1,80 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+SURVEY_CACHE_MAX_ENTRIES = int(os.environ.get("SURVEY_CACHE_MAX_ENTRIES", "512"))
+SURVEY_CACHE_MAX_BYTES = int(os.environ.get("SURVEY_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+# Writes through this instance invalidate its entries straight away; writes
+# through other instances are picked up once an entry is this old.
+SURVEY_CACHE_MAX_AGE_SECONDS = float(os.environ.get("SURVEY_CACHE_MAX_AGE_SECONDS", "30"))
+REPORT_CACHE_MAX_ENTRIES = int(os.environ.get("REPORT_CACHE_MAX_ENTRIES", "1024"))
+REPORT_CACHE_MAX_BYTES = int(os.environ.get("REPORT_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+class Entry:
+    def __init__(self, value, etag, size, stored_at):
+        self.value = value
+        self.etag = etag
+        self.size = size
+        self.stored_at = stored_at
+
+class LruCache:
+    # Bounded by entry count and by the JSON size of the cached values. Values
+    # are shared between callers and must not be mutated.
+    def __init__(self, max_entries, max_bytes, clock=time.monotonic):
+        self._max_entries = max_entries
+        self._max_bytes = max_bytes
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def get(self, key, max_age=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or (max_age is not None and self._clock() - entry.stored_at > max_age):
+                self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+            return entry
+
+    def put(self, key, value, etag):
+        size = len(json.dumps(value))
+        entry = Entry(value, etag, size, self._clock())
+        if size > self._max_bytes:
+            # Still returned to the caller, just never cached.
+            self.invalidate(key)
+            return entry
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous.size
+            self._entries[key] = entry
+            self._bytes += size
+            while len(self._entries) > self._max_entries or self._bytes > self._max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted.size
+                self._stats["evictions"] += 1
+        return entry
+
+    def invalidate(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._bytes -= entry.size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, size=len(self._entries), bytes=self._bytes)
+
+surveys = LruCache(SURVEY_CACHE_MAX_ENTRIES, SURVEY_CACHE_MAX_BYTES)
+# Report versions are immutable once written, so their entries never expire.
+reports = LruCache(REPORT_CACHE_MAX_ENTRIES, REPORT_CACHE_MAX_BYTES)
@@ -0,0 +1,179 @@
+import asyncio
+import json
+import re
+import zlib
+from azure.core.exceptions import HttpResponseError, ResourceNotModifiedError
+import blob_utils
+
+REPORT_PARTS = ("analysis", "summary")
+# Artifact blobs get a fresh name per report version and are never rewritten.
+ARTIFACT_CACHE_CONTROL = "private, max-age=31536000, immutable"
+RANGE_PATTERN = re.compile(r"bytes=(\d+)-(\d*)")
+GZIP_WBITS = 31
+# Each encoding of a representation gets its own entity tag, so a cache never
+# answers a request for one encoding with the bytes of the other.
+GZIP_ETAG_SUFFIX = "-gzip"
+IDENTITY_ETAG_SUFFIX = "-identity"
+
+class ContentResponse:
+    def __init__(self, status_code, headers=None, body=None, media_type=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.body = body
+        self.media_type = media_type
+
+def parse_range(header):
+    # Returns (offset, length) for a single "bytes=start-[end]" range, with
+    # length None for an open end. Anything else (suffix or multiple ranges,
+    # bad syntax) returns None and the whole blob is sent, as RFC 9110 allows.
+    match = RANGE_PATTERN.fullmatch((header or "").strip())
+    if not match:
+        return None
+    offset = int(match[1])
+    if not match[2]:
+        return offset, None
+    end = int(match[2])
+    return (offset, end - offset + 1) if end >= offset else None
+
+def accepts_gzip(header):
+    for coding in (header or "").split(","):
+        name, _, params = coding.strip().partition(";")
+        if name.strip().lower() in ("gzip", "*"):
+            return params.replace(" ", "") not in ("q=0", "q=0.0", "q=0.00", "q=0.000")
+    return False
+
+def single_etag(header):
+    # The blob service takes one etag per condition; a list or a wildcard is
+    # left to a full response.
+    tags = [tag.strip().removeprefix("W/") for tag in (header or "").split(",") if tag.strip()]
+    return tags[0] if len(tags) == 1 and tags[0] != "*" else None
+
+def _tagged(etag, suffix):
+    # Appends `suffix` inside the quotes of an entity tag.
+    if etag and etag.endswith('"'):
+        return etag[:-1] + suffix + '"'
+    return etag + suffix if etag else etag
+
+def _untagged(etag):
+    # Returns (stored etag, suffix) for an entity tag sent back by a client.
+    for suffix in (GZIP_ETAG_SUFFIX, IDENTITY_ETAG_SUFFIX):
+        for ending in (suffix + '"', suffix):
+            if etag.endswith(ending):
+                return etag[:-len(ending)] + ending[len(suffix):], suffix
+    return etag, None
+
+def content_etag(etag, accept_encoding=None):
+    # The entity tag of the combined report content for this Accept-Encoding.
+    return _tagged(etag, GZIP_ETAG_SUFFIX) if accepts_gzip(accept_encoding) else etag
+
+def _part_etag(properties, gzip_ok):
+    # Blobs stored as they are look the same to every client; a gzip blob is
+    # sent encoded or decoded depending on the client.
+    if not blob_utils.is_gzip(properties):
+        return properties.etag
+    return _tagged(properties.etag, GZIP_ETAG_SUFFIX if gzip_ok else IDENTITY_ETAG_SUFFIX)
+
+async def _chunks(downloader):
+    async for chunk in downloader.chunks():
+        yield chunk
+
+async def _gunzip(chunks):
+    decompressor = zlib.decompressobj(GZIP_WBITS)
+    async for chunk in chunks:
+        data = decompressor.decompress(chunk)
+        if data:
+            yield data
+    tail = decompressor.flush()
+    if tail:
+        yield tail
+
+async def _gzip(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, GZIP_WBITS)
+    async for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+def _decoded(downloader):
+    return _gunzip(_chunks(downloader)) if blob_utils.is_gzip(downloader.properties) else _chunks(downloader)
+
+async def _open(url, offset=None, length=None, if_none_match=None):
+    container_name, blob_name = blob_utils.parse_blob_url(url)
+    return await blob_utils.open_blob_async(
+        client=blob_utils.get_async_client(),
+        container_name=container_name,
+        blob_name=blob_name,
+        offset=offset,
+        length=length,
+        if_none_match=if_none_match
+    )
+
+async def open_part(report, part, range_header=None, accept_encoding=None, if_none_match=None):
+    # Streams one artifact. Clients that accept gzip get the stored bytes as
+    # they are, so ranges refer to the encoded representation; other clients
+    # get decoded bytes and ranges are ignored for gzip blobs.
+    byte_range = parse_range(range_header)
+    gzip_ok = accepts_gzip(accept_encoding)
+    offset, length = byte_range or (None, None)
+    client_etag = single_etag(if_none_match)
+    blob_etag = None
+    if client_etag:
+        blob_etag, suffix = _untagged(client_etag)
+        # A tag for the other encoding of a gzip blob does not match this client.
+        if suffix is not None and suffix != (GZIP_ETAG_SUFFIX if gzip_ok else IDENTITY_ETAG_SUFFIX):
+            blob_etag = None
+    try:
+        downloader = await _open(report[part], offset, length, blob_etag)
+        if downloader is not None and byte_range and not gzip_ok and blob_utils.is_gzip(downloader.properties):
+            byte_range = None
+            downloader = await _open(report[part])
+    except ResourceNotModifiedError:
+        return ContentResponse(304, {"ETag": client_etag, "Cache-Control": ARTIFACT_CACHE_CONTROL, "Vary": "Accept-Encoding"})
+    except HttpResponseError as e:
+        if e.status_code == 416:
+            return ContentResponse(416, {"Accept-Ranges": "bytes"})
+        raise
+    if downloader is None:
+        return None
+    properties = downloader.properties
+    headers = {
+        "ETag": _part_etag(properties, gzip_ok),
+        "Cache-Control": ARTIFACT_CACHE_CONTROL,
+        "Accept-Ranges": "bytes",
+        "Vary": "Accept-Encoding"
+    }
+    if properties.last_modified:
+        headers["Last-Modified"] = properties.last_modified.strftime("%a, %d %b %Y %H:%M:%S GMT")
+    if gzip_ok or not blob_utils.is_gzip(properties):
+        if blob_utils.is_gzip(properties):
+            headers["Content-Encoding"] = blob_utils.CONTENT_ENCODING_GZIP
+        headers["Content-Length"] = str(downloader.size)
+        status_code = 200
+        if byte_range:
+            headers["Content-Range"] = properties.content_range
+            status_code = 206
+        return ContentResponse(status_code, headers, _chunks(downloader), properties.content_settings.content_type)
+    return ContentResponse(200, headers, _gunzip(_chunks(downloader)), properties.content_settings.content_type)
+
+async def open_content(report, etag, accept_encoding=None):
+    # Streams {"surveyName", "reportVersion", "analysis": {...}, "summary": "..."}
+    # in one response. The analysis JSON is passed through chunk by chunk; the
+    # summary is short text that has to be JSON escaped, so it is read whole.
+    analysis, summary = await asyncio.gather(_open(report["analysis"]), _open(report["summary"]))
+    if analysis is None or summary is None:
+        return None
+
+    async def body():
+        yield json.dumps({"surveyName": report["surveyName"], "reportVersion": report["reportVersion"]})[:-1].encode("utf-8")
+        yield b', "analysis": '
+        async for chunk in _decoded(analysis):
+            yield chunk
+        summary_text = b"".join([chunk async for chunk in _decoded(summary)]).decode("utf-8")
+        yield b', "summary": ' + json.dumps(summary_text).encode("utf-8") + b"}"
+
+    headers = {"ETag": content_etag(etag, accept_encoding), "Cache-Control": ARTIFACT_CACHE_CONTROL, "Vary": "Accept-Encoding"}
+    if accepts_gzip(accept_encoding):
+        headers["Content-Encoding"] = blob_utils.CONTENT_ENCODING_GZIP
+        return ContentResponse(200, headers, _gzip(body()), "application/json")
+    return ContentResponse(200, headers, body(), "application/json")
@@ -1,21 +1,201 @@
+import asyncio
+import contextlib
+import contextvars
+import email.utils
+import functools
+import inspect
+import random
 import time
 import logging
 
-def exponential_backoff(initial_delay=1, retries=3):
-    def decorator(func):
-        def wrapper(*args, **kwargs):
-            current_retry = 0
-            current_delay = initial_delay
-            while current_retry < retries:
+# Absolute monotonic time by which the current operation must finish. It lives
+# in a context variable so nested retrying calls share one budget instead of
+# multiplying their attempts and sleeps.
+_deadline = contextvars.ContextVar("retry_deadline", default=None)
+_attempt_hooks = []
+
+class DeadlineExceededError(TimeoutError):
+    pass
+
+@contextlib.contextmanager
+def deadline(seconds):
+    # Nested deadlines can only shorten the budget, never extend it.
+    new_deadline = time.monotonic() + seconds
+    current = _deadline.get()
+    token = _deadline.set(new_deadline if current is None else min(current, new_deadline))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+def remaining():
+    current = _deadline.get()
+    return None if current is None else current - time.monotonic()
+
+def add_attempt_hook(hook):
+    # hook(attempt) is called after every attempt with an Attempt record.
+    _attempt_hooks.append(hook)
+
+def remove_attempt_hook(hook):
+    if hook in _attempt_hooks:
+        _attempt_hooks.remove(hook)
+
+class Attempt:
+    def __init__(self, policy, function, number, elapsed, error=None, delay=None, will_retry=False):
+        self.policy = policy
+        self.function = function
+        self.number = number
+        self.elapsed = elapsed
+        self.error = error
+        self.delay = delay
+        self.will_retry = will_retry
+
+    @property
+    def succeeded(self):
+        return self.error is None
+
+def status_code_of(e):
+    for source in (e, getattr(e, "response", None)):
+        for attribute in ("status_code", "status"):
+            value = getattr(source, attribute, None)
+            if isinstance(value, int):
+                return value
+    return None
+
+def retry_after_of(e):
+    # Server hints in seconds: Cosmos and OpenAI send millisecond headers,
+    # Azure Storage, Key Vault and OpenAI the standard Retry-After header.
+    response = getattr(e, "response", None)
+    headers = getattr(response, "headers", None) or getattr(e, "headers", None)
+    if not headers:
+        return None
+    for name in ("x-ms-retry-after-ms", "retry-after-ms"):
+        value = headers.get(name)
+        if value:
+            try:
+                return float(value) / 1000
+            except ValueError:
+                pass
+    value = headers.get("Retry-After") or headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return max(email.utils.parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+class RetryPolicy:
+    def __init__(
+        self,
+        name,
+        is_retryable,
+        retries=3,
+        base_delay=0.5,
+        max_delay=20.0,
+        max_retry_after=60.0,
+        timeout=None
+    ):
+        self.name = name
+        self.is_retryable = is_retryable
+        self.retries = retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_retry_after = max_retry_after
+        # Optional total budget per call, applied on top of any outer deadline.
+        self.timeout = timeout
+
+    def _next_delay(self, previous_delay, e):
+        hint = retry_after_of(e)
+        if hint is not None:
+            return min(hint, self.max_retry_after)
+        # Decorrelated jitter: spreads retries of concurrent callers apart while
+        # still growing roughly exponentially.
+        return min(self.max_delay, random.uniform(self.base_delay, max(previous_delay, self.base_delay) * 3))
+
+    def _on_failure(self, func, attempt, started, previous_delay, e):
+        # Returns the delay before the next attempt, or re-raises.
+        elapsed = time.monotonic() - started
+        retryable = attempt < self.retries and self.is_retryable(e)
+        delay = self._next_delay(previous_delay, e) if retryable else None
+        budget = remaining()
+        if retryable and budget is not None and delay >= budget:
+            retryable = False
+            logging.warning(f"[{self.name}] Retry {attempt}. '{func.__name__}' failed with {repr(e)}; a {delay:.2f}s wait exceeds the remaining {max(budget, 0):.2f}s deadline.")
+        self._emit(Attempt(self.name, func.__name__, attempt, elapsed, error=e, delay=delay, will_retry=retryable))
+        if not retryable:
+            logging.error(f"[{self.name}] Retry {attempt}. Failed to execute function '{func.__name__}' with error {repr(e)}. Not retrying.")
+            raise e
+        logging.info(f"[{self.name}] Retry {attempt}. Failed to execute function '{func.__name__}' with error {repr(e)}. Retrying in {delay:.2f} seconds...")
+        return delay
+
+    def _emit(self, attempt):
+        for hook in list(_attempt_hooks):
+            try:
+                hook(attempt)
+            except Exception as e:
+                logging.warning(f"Retry attempt hook failed: {repr(e)}")
+
+    def _scope(self):
+        return deadline(self.timeout) if self.timeout else contextlib.nullcontext()
+
+    def _check_deadline(self, func, attempt):
+        budget = remaining()
+        if budget is not None and budget <= 0:
+            raise DeadlineExceededError(f"Deadline exceeded before attempt {attempt} of '{func.__name__}'")
+
+    def call(self, func, *args, **kwargs):
+        with self._scope():
+            delay = self.base_delay
+            started = time.monotonic()
+            for attempt in range(1, self.retries + 1):
+                self._check_deadline(func, attempt)
+                try:
+                    result = func(*args, **kwargs)
+                except Exception as e:
+                    delay = self._on_failure(func, attempt, started, delay, e)
+                    time.sleep(delay)
+                    continue
+                self._emit(Attempt(self.name, func.__name__, attempt, time.monotonic() - started))
+                return result
+
+    async def call_async(self, func, *args, **kwargs):
+        with self._scope():
+            delay = self.base_delay
+            started = time.monotonic()
+            for attempt in range(1, self.retries + 1):
+                self._check_deadline(func, attempt)
                 try:
-                    return func(*args, **kwargs)
+                    result = await func(*args, **kwargs)
                 except Exception as e:
-                    current_retry += 1
-                    if current_retry >= retries:
-                        logging.error(f"Retry {current_retry}. Failed to execute function '{func.__name__}'. Exhausted retries with error {repr(e)}.")
-                        raise e
-                    logging.info(f"Retry {current_retry}. Failed to execute function '{func.__name__}' with error {repr(e)}. Retrying in {current_delay} seconds...")
-                    time.sleep(current_delay)
-                    current_delay *= 2
+                    delay = self._on_failure(func, attempt, started, delay, e)
+                    await asyncio.sleep(delay)
+                    continue
+                self._emit(Attempt(self.name, func.__name__, attempt, time.monotonic() - started))
+                return result
+
+    def __call__(self, func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                return await self.call_async(func, *args, **kwargs)
+            return async_wrapper
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            return self.call(func, *args, **kwargs)
         return wrapper
-    return decorator
+
+TRANSIENT_STATUS_CODES = frozenset({408, 429, 500, 502, 503, 504})
+
+def is_transient_azure_error(e):
+    from azure.core.exceptions import ClientAuthenticationError, HttpResponseError, ServiceRequestError, ServiceResponseError
+    if isinstance(e, (ServiceRequestError, ServiceResponseError)):
+        return True
+    if isinstance(e, ClientAuthenticationError):
+        return False
+    if isinstance(e, HttpResponseError):
+        return status_code_of(e) in TRANSIENT_STATUS_CODES
+    return False
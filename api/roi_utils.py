@@ -0,0 +1,98 @@
+import re
+
+ROI_TOLERANCE = 0.01
+# Reported totals may legitimately exceed the explicit amounts (recurring costs,
+# projected benefits), but should never fall short of them by more than this.
+TOTALS_TOLERANCE = 0.05
+COST_KEYWORDS = ("cost", "spend", "expense", "fee", "investment")
+BENEFIT_KEYWORDS = ("benefit", "saving", "revenue", "gain", "return")
+_MULTIPLIERS = {"k": 1e3, "thousand": 1e3, "m": 1e6, "mm": 1e6, "million": 1e6, "b": 1e9, "billion": 1e9}
+_AMOUNT_PATTERN = re.compile(r"\$\s*(\d[\d,]*(?:\.\d+)?)\s*(k|mm|m|b|thousand|million|billion)?\b", re.IGNORECASE)
+_PLAIN_AMOUNT_PATTERN = re.compile(r"\s*\$?\s*(\d[\d,]*(?:\.\d+)?)\s*(k|mm|m|b|thousand|million|billion)?\s*", re.IGNORECASE)
+_FIGURE_PATTERN = re.compile(r"(?<![\d.])(-?\d[\d,]*(?:\.\d+)?)\s*(%|percent)?", re.IGNORECASE)
+
+def compute_roi(total_costs, total_benefits):
+    if total_costs <= 0:
+        return None
+    return (total_benefits - total_costs) / total_costs
+
+def parse_amount(contents):
+    # Only contents that are a bare number or carry an explicit "$" are treated
+    # as dollar amounts, so head counts and durations are not picked up. When
+    # several amounts appear the largest is kept, which keeps it a lower bound.
+    match = _PLAIN_AMOUNT_PATTERN.fullmatch(contents)
+    matches = [match] if match else list(_AMOUNT_PATTERN.finditer(contents))
+    if not matches:
+        return None
+    return max(float(m.group(1).replace(",", "")) * _MULTIPLIERS.get((m.group(2) or "").lower(), 1) for m in matches)
+
+def _classify(form):
+    text = f"{form.title} {form.description}".lower()
+    if any(k in text for k in COST_KEYWORDS):
+        return "costs"
+    if any(k in text for k in BENEFIT_KEYWORDS):
+        return "benefits"
+    return None
+
+def extract_form_amounts(request):
+    amounts = {"costs": [], "benefits": []}
+    for form in request.forms:
+        kind = _classify(form)
+        if kind is None:
+            continue
+        amount = parse_amount(form.contents)
+        if amount is not None and amount > 0:
+            amounts[kind].append({"title": form.title, "amount": amount})
+    return amounts
+
+def check_totals(analysis, amounts, tolerance=TOTALS_TOLERANCE):
+    issues = []
+    total_costs = analysis["total_costs"]["value"]
+    total_benefits = analysis["total_benefits"]["value"]
+    if total_costs <= 0:
+        issues.append(f"total_costs={total_costs} is not positive")
+    extracted_costs = sum(a["amount"] for a in amounts["costs"])
+    extracted_benefits = sum(a["amount"] for a in amounts["benefits"])
+    if total_costs < extracted_costs * (1 - tolerance):
+        issues.append(f"total_costs={total_costs} is below the {extracted_costs} stated in cost forms")
+    if total_benefits < extracted_benefits * (1 - tolerance):
+        issues.append(f"total_benefits={total_benefits} is below the {extracted_benefits} stated in benefit forms")
+    return issues
+
+def inconsistent_roi(analysis, tolerance=ROI_TOLERANCE):
+    # The ROI implied by the reported totals when the reported one is off by
+    # more than the tolerance, otherwise None.
+    computed_roi = compute_roi(analysis["total_costs"]["value"], analysis["total_benefits"]["value"])
+    if computed_roi is None or abs(computed_roi - analysis["roi"]["value"]) < tolerance:
+        return None
+    return computed_roi
+
+def quotes_roi(texts, roi, tolerance=ROI_TOLERANCE):
+    # Whether any of the texts states roi, as a ratio (1.59) or a percentage
+    # (159%). Errs towards yes, since a yes only costs a re-ask.
+    for text in texts:
+        for match in _FIGURE_PATTERN.finditer(text or ""):
+            figure = float(match.group(1).replace(",", ""))
+            if match.group(2):
+                figure /= 100
+            if abs(figure - roi) < tolerance:
+                return True
+    return False
+
+def repair_roi(analysis, tolerance=ROI_TOLERANCE):
+    # Writes the ROI implied by the reported totals back into the analysis and
+    # returns the value it replaced, or None when no repair was needed. Only
+    # the value changes, so callers check quotes_roi() on its text first.
+    computed_roi = inconsistent_roi(analysis, tolerance)
+    if computed_roi is None:
+        return None
+    reported_roi = analysis["roi"]["value"]
+    analysis["roi"]["value"] = round(computed_roi, 4)
+    return reported_roi
+
+def roi_explanation(analysis, roi):
+    # A plain statement of the calculation, for when the model cannot be asked
+    # to rewrite the explanation.
+    total_costs = analysis["total_costs"]["value"]
+    total_benefits = analysis["total_benefits"]["value"]
+    return f"ROI = (total benefits - total costs) / total costs = (${total_benefits:,.2f} - ${total_costs:,.2f}) / ${total_costs:,.2f} = {roi:.2f}, or {roi:.0%}."
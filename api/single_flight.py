@@ -0,0 +1,61 @@
+import asyncio
+import threading
+
+# Collapses concurrent calls for the same key into one: the first caller runs
+# the function and the others wait for its result or error.
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+class SingleFlight:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}
+
+    def do(self, key, fn):
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = _Flight()
+                self._flights[key] = flight
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+        try:
+            flight.value = fn()
+            return flight.value
+        except Exception as e:
+            flight.error = e
+            raise e
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+            flight.done.set()
+
+class AsyncSingleFlight:
+    # The shared call runs in its own task and every caller, the first one
+    # included, waits on it through a shield: a caller that is cancelled stops
+    # waiting without cancelling the call for the others.
+    def __init__(self):
+        self._flights = {}
+
+    def _land(self, key, flight):
+        if self._flights.get(key) is flight:
+            self._flights.pop(key)
+        # Mark retrieved so a flight nobody waited for does not log a warning.
+        if not flight.cancelled():
+            flight.exception()
+
+    async def do(self, key, fn):
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = asyncio.ensure_future(fn())
+            self._flights[key] = flight
+            flight.add_done_callback(lambda done: self._land(key, done))
+        return await asyncio.shield(flight)
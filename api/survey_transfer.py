@@ -0,0 +1,142 @@
+import asyncio
+import json
+import os
+import db_utils
+import log_utils
+
+# Imported surveys are written in chunks (one transactional batch per chunk in
+# the legacy layout), with at most SURVEY_IMPORT_CONCURRENCY chunks in flight.
+SURVEY_IMPORT_CHUNK_SIZE = int(os.environ.get("SURVEY_IMPORT_CHUNK_SIZE", "100"))
+SURVEY_IMPORT_CONCURRENCY = int(os.environ.get("SURVEY_IMPORT_CONCURRENCY", "4"))
+SURVEY_IMPORT_MAX_LINE_BYTES = int(os.environ.get("SURVEY_IMPORT_MAX_LINE_BYTES", "1000000"))
+SURVEY_EXPORT_PAGE_SIZE = int(os.environ.get("SURVEY_EXPORT_PAGE_SIZE", "100"))
+# Characters Cosmos DB does not allow in document ids.
+INVALID_NAME_CHARACTERS = ("/", "\\", "?", "#")
+
+def survey_line(name, survey):
+    # Import and export share one format: {"surveyName": ..., "survey": {...}}.
+    return json.dumps({"surveyName": name, "survey": survey}) + "\n"
+
+async def ndjson_lines(chunks, max_line_bytes=SURVEY_IMPORT_MAX_LINE_BYTES):
+    # Splits a byte stream into lines without holding more than one line in
+    # memory. Lines longer than max_line_bytes are skipped and yielded as None.
+    buffer = b""
+    skipping = False
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            yield None if skipping or len(line) > max_line_bytes else line
+            skipping = False
+        if len(buffer) > max_line_bytes:
+            buffer = b""
+            skipping = True
+    if skipping:
+        yield None
+    elif buffer.strip():
+        yield None if len(buffer) > max_line_bytes else buffer
+
+def parse_survey_line(line):
+    # Returns ((name, survey), error).
+    try:
+        record = json.loads(line)
+    except (UnicodeDecodeError, json.JSONDecodeError) as e:
+        return None, f"Malformed record, invalid JSON: {repr(e)}"
+    if not isinstance(record, dict):
+        return None, "Malformed record, expected a JSON object."
+    name = record.get("surveyName")
+    if not isinstance(name, str) or not name.strip():
+        return None, "Malformed record, missing surveyName."
+    if any(character in name for character in INVALID_NAME_CHARACTERS):
+        return None, f"Malformed record, surveyName cannot contain any of {' '.join(INVALID_NAME_CHARACTERS)}."
+    survey = record.get("survey")
+    if not isinstance(survey, dict) or not survey:
+        return None, "Malformed record, survey must be a non-empty JSON object."
+    return (name, survey), None
+
+def _result(line_number, name=None, error=None):
+    return {
+        "line": line_number,
+        "surveyName": name,
+        "status": "error" if error else "ok",
+        "error": error
+    }
+
+async def _write_chunk(client, chunk):
+    try:
+        errors = await db_utils.put_surveys_async(client, [(name, survey) for _, name, survey in chunk])
+    except Exception as e:
+        log_utils.error("POST surveys import chunk error", surveys=len(chunk), error=e)
+        errors = [repr(e)] * len(chunk)
+    return [_result(line_number, name, error) for (line_number, name, _), error in zip(chunk, errors)]
+
+async def import_surveys_async(chunks, chunk_size=SURVEY_IMPORT_CHUNK_SIZE, concurrency=SURVEY_IMPORT_CONCURRENCY):
+    # Yields one result per non-blank line as soon as it is known, then a
+    # {"summary": ...} record. Reading pauses while `concurrency` chunks are
+    # being written, so memory stays bounded whatever the size of the import.
+    client = db_utils.get_async_client()
+    counts = {"imported": 0, "failed": 0}
+    chunk = []
+    writes = {}
+
+    def count(results):
+        for result in results:
+            counts["imported" if result["status"] == "ok" else "failed"] += 1
+        return results
+
+    async def finish(return_when):
+        done, _ = await asyncio.wait(writes, return_when=return_when)
+        results = []
+        for task in done:
+            writes.pop(task)
+            results.extend(count(task.result()))
+        return results
+
+    def dispatch():
+        writes[asyncio.create_task(_write_chunk(client, chunk))] = {name for _, name, _ in chunk}
+
+    line_number = 0
+    async for line in ndjson_lines(chunks):
+        line_number += 1
+        if line is None:
+            yield count([_result(line_number, error=f"Malformed record, longer than {SURVEY_IMPORT_MAX_LINE_BYTES} bytes.")])[0]
+            continue
+        if not line.strip():
+            continue
+        record, error = parse_survey_line(line)
+        if error:
+            yield count([_result(line_number, error=error)])[0]
+            continue
+        name, survey = record
+        # A repeated name must not race its earlier copy, so that copy is
+        # written first and the later line wins.
+        if any(name == chunk_name for _, chunk_name, _ in chunk):
+            dispatch()
+            chunk = []
+        while any(name in names for names in writes.values()):
+            for result in await finish(asyncio.FIRST_COMPLETED):
+                yield result
+        chunk.append((line_number, name, survey))
+        if len(chunk) >= chunk_size:
+            dispatch()
+            chunk = []
+        while len(writes) >= concurrency:
+            for result in await finish(asyncio.FIRST_COMPLETED):
+                yield result
+    if chunk:
+        dispatch()
+    if writes:
+        for result in await finish(asyncio.ALL_COMPLETED):
+            yield result
+    yield {"summary": counts}
+
+async def export_surveys_async(page_size=SURVEY_EXPORT_PAGE_SIZE):
+    # Yields NDJSON lines one page at a time, in the import format.
+    client = db_utils.get_async_client()
+    continuation_token = None
+    while True:
+        surveys, continuation_token = await db_utils.list_survey_contents_page_async(client, page_size, continuation_token)
+        for name, survey in surveys:
+            yield survey_line(name, survey)
+        if continuation_token is None:
+            return
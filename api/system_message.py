@@ -32,4 +32,71 @@ ROI_EXPERT_SYSTEM_MESSAGE = ("You are an expert business consultant specializing
 
                              "It is essential that the ROI calculation is accurate and the insights and recommendations are strategically sound. "
                              "Your response will help the user determine whether a change initiative is feasible and worth pursuing."
-                             )
\ No newline at end of file
+                             )
+
+ROI_NUMERIC_REPAIR_SYSTEM_MESSAGE = ("You are an expert business consultant and a careful accountant. "
+                                     "You previously analyzed survey responses in JSON format, where each form has a category, title, description, and contents, "
+                                     "but the totals in your previous answer did not reconcile with the dollar amounts stated in the forms. "
+                                     "You will receive the forms, your previous totals, and the dollar amounts that were found in forms describing costs and benefits.\n"
+                                     "Recompute only the numbers:\n"
+                                     "1. The total dollar costs as a float, summing every cost stated or implied in the forms. Include an explanation of this calculation.\n"
+                                     "2. The total dollar benefits as a float, summing every benefit stated or implied in the forms. Include an explanation of this calculation.\n"
+                                     "3. The ROI as a float, calculated using the formula: (total benefits − total costs) / total costs, with an explanation that also expresses it as a percentage.\n"
+                                     "The output must be structured in JSON format according to the NumericAnalysis schema."
+                                     )
+
+COMPACT_FORMS_NOTE = ("\nThe forms are sent in a compact layout: a JSON object that maps each category to a list of its forms, "
+                      "where each form is [title, description, contents], or [title, contents] when the description would only repeat the title.")
+
+ROI_EXTRACTION_SYSTEM_MESSAGE = ("You are an expert business consultant and a careful accountant. "
+                                 "You will receive some of the forms of the survey responses for a change initiative; the results for all forms are combined afterwards. "
+                                 "The forms are a JSON object that maps each category to a list of its forms, where each form is [id, title, description, contents], "
+                                 "or [id, title, contents] when the description would only repeat the title.\n"
+                                 "For every form, return its id and what that form alone states:\n"
+                                 "1. costs: every dollar cost stated or implied, each with a short descriptive title and the amount as a float.\n"
+                                 "2. benefits: every dollar benefit stated or implied, each with a short descriptive title and the amount as a float.\n"
+                                 "3. observations: short notes on anything that bears on the success or risk of the initiative, such as readiness, stakeholder support, timelines and constraints.\n"
+                                 "Leave out forms that have nothing to extract. Do not compute totals or ROI, and do not invent amounts that the forms do not support. "
+                                 "The output must be structured in JSON format according to the Extraction schema."
+                                 )
+
+AGGREGATE_NOTE = ("\nInstead of the forms you will receive a JSON object with the costs and benefits "
+                  "as [title, amount] lists and the observations that were extracted from the forms of the survey. "
+                  "Treat these as the survey responses: sum the costs and the benefits for the totals and base the insights, recommendations and summary on the observations.")
+
+AGGREGATE_FORMS_NOTE = ("\nForms that have not been extracted are sent as they are under \"forms\", in a compact layout: a JSON object that maps each category to a list of its forms, "
+                        "where each form is [title, description, contents], or [title, contents] when the description would only repeat the title. "
+                        "Include their costs, benefits and observations alongside the extracted ones.")
+
+SECTION_NOTE = ("Only part of the analysis is requested in this call; the other parts are requested separately and combined afterwards. ")
+
+NUMERIC_SECTION_NOTE = (SECTION_NOTE +
+                        "Return only the total dollar costs, the total dollar benefits and the ROI, each as a float with an explanation of its calculation; "
+                        "the ROI is (total benefits − total costs) / total costs and its explanation also expresses it as a percentage. "
+                        "The output must be structured in JSON format according to the NumericAnalysis schema.")
+
+CHECKED_NUMBERS_NOTE = ("These totals and ROI have already been calculated and checked against the forms. "
+                        "Use exactly these values wherever you refer to costs, benefits or ROI: ")
+
+INSIGHTS_SECTION_NOTE = (SECTION_NOTE +
+                         "Return only the list of insights (minimum 3, maximum 10), where each insight has a title, short description, and detailed content that addresses the user directly in a professional, consultant tone, "
+                         "highlighting key success factors, risks, or decision drivers in the change initiative. "
+                         "The output must be structured in JSON format according to the Insights schema.")
+
+RECOMMENDATIONS_SECTION_NOTE = (SECTION_NOTE +
+                                "Return only the list of recommendations (minimum 3, maximum 10), where each recommendation has a title, short description, and detailed content offering actionable advice grounded in change management best practices. "
+                                "The output must be structured in JSON format according to the Recommendations schema.")
+
+SUMMARY_SECTION_NOTE = (SECTION_NOTE +
+                        "Return only the concise summary (under 200 words) that synthesizes the ROI calculation, highlights key insights driving the value or risk of the initiative, and outlines high-level recommendations. "
+                        "It should clearly state whether the change initiative appears financially viable, briefly mention the key benefit(s) and cost(s), and include at least one strategic or operational action to increase the likelihood of success. "
+                        "The output must be structured in JSON format according to the Summary schema.")
+
+ROI_CORRECTION_NOTE = ("The ROI in your earlier answer did not follow from these totals and has been recalculated. "
+                       "Return only the ROI with exactly the value given above and a new explanation of its calculation that also expresses it as a percentage. "
+                       "The output must be structured in JSON format according to the Roi schema.")
+
+ROI_SUMMARY_CORRECTION_NOTE = ("The ROI in your earlier answer did not follow from these totals and has been recalculated. "
+                               "Return the ROI with exactly the value given above and a new explanation of its calculation that also expresses it as a percentage, "
+                               "and the summary below rewritten so that every reference to the ROI uses the recalculated value, otherwise unchanged. "
+                               "The output must be structured in JSON format according to the RoiCorrection schema. The earlier summary: ")
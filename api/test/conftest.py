@@ -0,0 +1,13 @@
+import os
+import sys
+import pytest
+
+# The API's modules are flat and import each other by name, as they do when
+# the Functions host runs from the api folder.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+@pytest.fixture
+def fake_services():
+    # In-memory Cosmos, Blob, Key Vault and OpenAI clients from the benchmarks.
+    from benchmarks import fakes
+    return fakes.install()
@@ -0,0 +1,35 @@
+import json
+import pytest
+import db_utils
+
+def test_continuation_tokens_round_trip():
+    token = json.dumps({"token": "+RID:~abc==#RT:1", "range": {"min": "", "max": "FF"}})
+    encoded = db_utils.encode_continuation_token(token)
+    assert encoded.isascii() and "+" not in encoded and "/" not in encoded
+    assert db_utils.decode_continuation_token(encoded) == token
+
+def test_missing_continuation_tokens_stay_missing():
+    assert db_utils.encode_continuation_token(None) is None
+    assert db_utils.decode_continuation_token(None) is None
+    assert db_utils.decode_continuation_token("") is None
+
+@pytest.mark.parametrize("token", ["not base64!", "_w=="])
+def test_invalid_continuation_tokens_are_value_errors(token):
+    with pytest.raises(ValueError):
+        db_utils.decode_continuation_token(token)
+
+def test_catalogue_tokens_carry_the_shard():
+    encoded = db_utils._encode_catalogue_token(3, "cosmos-token")
+    assert db_utils._decode_catalogue_token(encoded) == (3, "cosmos-token")
+    assert db_utils._decode_catalogue_token(None) == (0, None)
+
+def test_invalid_catalogue_tokens_are_value_errors():
+    with pytest.raises(ValueError):
+        db_utils._decode_catalogue_token(db_utils.encode_continuation_token("[1, 2]"))
+    with pytest.raises(ValueError):
+        db_utils._decode_catalogue_token(db_utils.encode_continuation_token("{}"))
+
+def test_catalogue_partition_is_stable():
+    partition = db_utils.catalogue_partition("survey")
+    assert partition == db_utils.catalogue_partition("survey")
+    assert partition.startswith("catalogue-")
@@ -0,0 +1,123 @@
+import pytest
+import db_utils
+import rate_limiter
+
+LIMITS = {"requests": 60, "tokens": 600}
+
+def test_take_admits_until_a_bucket_is_empty():
+    state = {}
+    assert rate_limiter._take(state, {"requests": 1, "tokens": 600}, LIMITS, now=0.0) == 0.0
+    # 300 tokens refill in 30 seconds at 600 per minute.
+    assert rate_limiter._take(state, {"requests": 1, "tokens": 300}, LIMITS, now=0.0) == pytest.approx(30.0)
+    assert state["requests"]["tokens"] == 59
+
+def test_take_refills_with_time_up_to_the_limit():
+    state = {}
+    rate_limiter._take(state, {"tokens": 600}, LIMITS, now=0.0)
+    assert rate_limiter._take(state, {"tokens": 300}, LIMITS, now=30.0) == 0.0
+    rate_limiter._take(state, {}, LIMITS, now=1000.0)
+    assert state["tokens"]["tokens"] == 600
+
+def test_take_caps_a_cost_larger_than_the_bucket():
+    state = {}
+    assert rate_limiter._take(state, {"tokens": 10000}, LIMITS, now=0.0) == 0.0
+    assert state["tokens"]["tokens"] == 0
+
+def test_refund_returns_capacity_up_to_the_limit():
+    store = rate_limiter.MemoryBucketStore()
+    store.acquire("key", {"tokens": 600}, LIMITS, now=0.0)
+    store.refund("key", {"tokens": 200}, LIMITS)
+    assert store.acquire("key", {"tokens": 200}, LIMITS, now=0.0) == 0.0
+    store.refund("key", {"tokens": 10000}, LIMITS)
+    assert store._states["key"]["tokens"]["tokens"] == 600
+
+def test_limiter_sheds_calls_that_would_wait_too_long():
+    limiter = rate_limiter.RateLimiter("test", rate_limiter.MemoryBucketStore(), LIMITS, max_wait=1.0, clock=lambda: 0.0)
+    limiter.acquire({"requests": 1, "tokens": 600})
+    with pytest.raises(rate_limiter.RateLimitExceededError) as raised:
+        limiter.acquire({"requests": 1, "tokens": 600})
+    assert raised.value.retry_after == pytest.approx(60.0)
+    stats = limiter.stats()
+    assert stats["admitted"] == 1 and stats["shed"] == 1
+
+def test_limiter_without_limits_admits_everything():
+    limiter = rate_limiter.RateLimiter("test", rate_limiter.MemoryBucketStore(), {"requests": 0, "tokens": 0}, max_wait=0.0)
+    assert not limiter.enabled
+    for _ in range(100):
+        limiter.acquire({"requests": 1, "tokens": 10 ** 9})
+
+def test_limiter_counts_refunds():
+    limiter = rate_limiter.RateLimiter("test", rate_limiter.MemoryBucketStore(), LIMITS, max_wait=1.0, clock=lambda: 0.0)
+    limiter.acquire({"requests": 1, "tokens": 600})
+    limiter.refund({"tokens": 250, "unknown": 5})
+    assert limiter.stats()["refunded"] == {"tokens": 250}
+    limiter.acquire({"requests": 1, "tokens": 250})
+
+def test_sqlite_store_shares_buckets_between_instances(tmp_path):
+    path = str(tmp_path / "buckets.sqlite3")
+    first, second = rate_limiter.SqliteBucketStore(path), rate_limiter.SqliteBucketStore(path)
+    assert first.acquire("key", {"tokens": 600}, LIMITS, now=0.0) == 0.0
+    assert second.acquire("key", {"tokens": 300}, LIMITS, now=0.0) > 0
+    second.refund("key", {"tokens": 300}, LIMITS)
+    assert first.acquire("key", {"tokens": 300}, LIMITS, now=0.0) == 0.0
+
+class _RateLimitDocuments:
+    # Stands in for the rate limit container, with etags for the conditional
+    # replace.
+    def __init__(self, conflict=False):
+        self.documents = {}
+        self.writes = 0
+        self.conflict = conflict
+
+    def get(self, client, key):
+        state, etag = self.documents.get(key, ({}, None))
+        return {name: dict(bucket) for name, bucket in state.items()}, etag
+
+    def put(self, client, key, state, etag):
+        self.writes += 1
+        if self.conflict or self.documents.get(key, (None, None))[1] != etag:
+            return False
+        self.documents[key] = (state, (etag or 0) + 1)
+        return True
+
+@pytest.fixture
+def documents(monkeypatch):
+    documents = _RateLimitDocuments()
+    monkeypatch.setattr(db_utils, "get_client", lambda: None)
+    monkeypatch.setattr(db_utils, "get_rate_limit_state", documents.get)
+    monkeypatch.setattr(db_utils, "put_rate_limit_state", documents.put)
+    return documents
+
+def test_cosmos_store_admits_from_a_leased_block(documents):
+    store = rate_limiter.CosmosBucketStore(lease_fraction=0.1)
+    limits = {"requests": 600, "tokens": 60000}
+    for _ in range(60):
+        assert store.acquire("key", {"requests": 1, "tokens": 100}, limits, now=0.0) == 0.0
+    # Each renewal leases 60 requests, so 60 calls need one document write.
+    assert documents.writes == 1
+    assert store.acquire("key", {"requests": 1, "tokens": 100}, limits, now=0.0) == 0.0
+    assert documents.writes == 2
+
+def test_cosmos_store_returns_the_leftover_on_renewal(documents):
+    store = rate_limiter.CosmosBucketStore(lease_fraction=0.1, lease_seconds=5.0)
+    limits = {"tokens": 1000}
+    store.acquire("key", {"tokens": 10}, limits, now=0.0)
+    store.refund("key", {"tokens": 10}, limits)
+    # The lease has expired, so the next call renews and hands back all 100.
+    store.acquire("key", {"tokens": 10}, limits, now=10.0)
+    state, _ = documents.documents["key"]
+    assert state["tokens"]["tokens"] == pytest.approx(900)
+
+def test_cosmos_store_takes_only_the_cost_when_a_block_does_not_fit(documents):
+    store = rate_limiter.CosmosBucketStore(lease_fraction=0.5)
+    limits = {"tokens": 100}
+    assert store.acquire("key", {"tokens": 80}, limits, now=0.0) == 0.0
+    # 20 tokens are left, less than a block of 50 but enough for this call.
+    assert store.acquire("key", {"tokens": 15}, limits, now=0.0) == 0.0
+    assert store.acquire("key", {"tokens": 15}, limits, now=0.0) > 0
+
+def test_cosmos_store_contention_is_not_exhaustion(documents):
+    documents.conflict = True
+    store = rate_limiter.CosmosBucketStore(max_conflicts=3, contended_wait=0.25)
+    assert store.acquire("key", {"tokens": 1}, {"tokens": 1000}, now=0.0) == 0.25
+    assert documents.writes == 3
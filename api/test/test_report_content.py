@@ -0,0 +1,124 @@
+import asyncio
+import gzip
+import json
+import pytest
+import blob_utils
+import db_utils
+import function_app
+import report_content
+from benchmarks import loadgen
+
+ANALYSIS = json.dumps({"insights": ["x" * 40] * 100})
+SUMMARY = "A short summary."
+
+@pytest.fixture
+def report(fake_services):
+    # The analysis is large enough to be stored gzip encoded, the summary not.
+    def upload(name, data):
+        return blob_utils.upload_blob(blob_utils.get_client(), "reports", name, "application/json", data, compress=True)
+
+    report = {
+        "surveyName": "etag-survey",
+        "reportVersion": "2024-01-01T00:00:00",
+        "analysis": upload("etag-analysis.json", ANALYSIS),
+        "summary": upload("etag-summary.txt", SUMMARY)
+    }
+    db_utils.put_report_version(db_utils.get_client(), report["surveyName"], report["reportVersion"], report)
+    return report
+
+async def _read(content):
+    return b"".join([chunk async for chunk in content.body]) if content.body is not None else None
+
+def _open_part(report, part, **kwargs):
+    async def run():
+        content = await report_content.open_part(report, part, **kwargs)
+        return content, await _read(content)
+    return asyncio.run(run())
+
+def test_parse_range():
+    assert report_content.parse_range("bytes=0-99") == (0, 100)
+    assert report_content.parse_range("bytes=100-") == (100, None)
+    assert report_content.parse_range("bytes=-100") is None
+    assert report_content.parse_range("bytes=0-1,5-6") is None
+    assert report_content.parse_range("bytes=9-3") is None
+    assert report_content.parse_range(None) is None
+
+def test_accepts_gzip():
+    assert report_content.accepts_gzip("gzip, deflate, br")
+    assert report_content.accepts_gzip("*")
+    assert not report_content.accepts_gzip("gzip;q=0")
+    assert not report_content.accepts_gzip("identity")
+    assert not report_content.accepts_gzip(None)
+
+def test_single_etag():
+    assert report_content.single_etag('W/"abc"') == '"abc"'
+    assert report_content.single_etag('"abc", "def"') is None
+    assert report_content.single_etag("*") is None
+
+def test_encodings_get_their_own_etags():
+    assert report_content.content_etag('"abc"', "gzip") == '"abc-gzip"'
+    assert report_content.content_etag('"abc"', None) == '"abc"'
+    assert report_content._untagged('"abc-gzip"') == ('"abc"', "-gzip")
+    assert report_content._untagged('"abc-identity"') == ('"abc"', "-identity")
+    assert report_content._untagged('"abc"') == ('"abc"', None)
+
+def test_gzip_part_is_sent_encoded_or_decoded(report):
+    encoded, body = _open_part(report, "analysis", accept_encoding="gzip")
+    assert encoded.headers["Content-Encoding"] == "gzip"
+    assert encoded.headers["ETag"].endswith('-gzip"')
+    assert encoded.headers["Vary"] == "Accept-Encoding"
+    assert gzip.decompress(body).decode() == ANALYSIS
+    decoded, body = _open_part(report, "analysis")
+    assert "Content-Encoding" not in decoded.headers
+    assert decoded.headers["ETag"].endswith('-identity"')
+    assert body.decode() == ANALYSIS
+
+def test_part_not_modified_only_for_the_same_encoding(report):
+    encoded, _ = _open_part(report, "analysis", accept_encoding="gzip")
+    decoded, _ = _open_part(report, "analysis")
+    assert _open_part(report, "analysis", accept_encoding="gzip", if_none_match=encoded.headers["ETag"])[0].status_code == 304
+    assert _open_part(report, "analysis", if_none_match=decoded.headers["ETag"])[0].status_code == 304
+    assert _open_part(report, "analysis", accept_encoding="gzip", if_none_match=decoded.headers["ETag"])[0].status_code == 200
+    assert _open_part(report, "analysis", if_none_match=encoded.headers["ETag"])[0].status_code == 200
+
+def test_plain_part_has_one_etag(report):
+    encoded, _ = _open_part(report, "summary", accept_encoding="gzip")
+    decoded, body = _open_part(report, "summary")
+    assert encoded.headers["ETag"] == decoded.headers["ETag"]
+    assert body.decode() == SUMMARY
+    assert _open_part(report, "summary", accept_encoding="gzip", if_none_match=decoded.headers["ETag"])[0].status_code == 304
+
+def test_ranges_apply_to_the_stored_bytes(report):
+    content, body = _open_part(report, "summary", range_header="bytes=2-6")
+    assert content.status_code == 206
+    assert body.decode() == SUMMARY[2:7]
+    # A gzip blob cannot be decoded from the middle, so the range is ignored.
+    content, body = _open_part(report, "analysis", range_header="bytes=2-6")
+    assert content.status_code == 200
+    assert body.decode() == ANALYSIS
+
+def test_content_route_not_modified_per_encoding(report):
+    handler = function_app.get_report_content._function.get_user_function()
+    params = {"surveyName": report["surveyName"], "reportVersion": report["reportVersion"]}
+
+    async def get(headers):
+        response = await handler(loadgen._asgi_request("GET", "report/content", params, headers=headers))
+        status, body = await loadgen._read(response)
+        return response, status, body
+
+    async def run():
+        encoded, status, body = await get({"Accept-Encoding": "gzip"})
+        assert status == 200
+        assert json.loads(gzip.decompress(body))["summary"] == SUMMARY
+        plain, status, body = await get({})
+        assert json.loads(body)["analysis"] == json.loads(ANALYSIS)
+        assert encoded.headers["etag"] == report_content.content_etag(plain.headers["etag"], "gzip")
+        _, status, _ = await get({"Accept-Encoding": "gzip", "If-None-Match": encoded.headers["etag"]})
+        assert status == 304
+        _, status, _ = await get({"If-None-Match": encoded.headers["etag"]})
+        assert status == 200
+        not_modified, status, _ = await get({"If-None-Match": plain.headers["etag"]})
+        assert status == 304
+        assert not_modified.headers["vary"] == "Accept-Encoding"
+
+    asyncio.run(run())
@@ -0,0 +1,136 @@
+import asyncio
+import time
+from types import SimpleNamespace
+import pytest
+from azure.core.exceptions import ClientAuthenticationError, HttpResponseError, ServiceRequestError
+import retry
+
+def _policy(**kwargs):
+    return retry.RetryPolicy("test", is_retryable=lambda e: isinstance(e, ConnectionError), base_delay=0.0, **kwargs)
+
+def _flaky(failures, error=ConnectionError):
+    calls = []
+
+    def fn():
+        calls.append(1)
+        if len(calls) <= failures:
+            raise error("failed")
+        return "value"
+
+    return fn, calls
+
+def _http_error(status_code, headers=None):
+    e = HttpResponseError(message=f"status {status_code}")
+    e.status_code = status_code
+    e.response = SimpleNamespace(status_code=status_code, headers=headers or {})
+    return e
+
+def test_retries_transient_errors_until_success():
+    fn, calls = _flaky(2)
+    assert _policy(retries=3).call(fn) == "value"
+    assert len(calls) == 3
+
+def test_gives_up_after_the_last_attempt():
+    fn, calls = _flaky(5)
+    with pytest.raises(ConnectionError):
+        _policy(retries=3).call(fn)
+    assert len(calls) == 3
+
+def test_does_not_retry_other_errors():
+    fn, calls = _flaky(1, error=ValueError)
+    with pytest.raises(ValueError):
+        _policy(retries=3).call(fn)
+    assert len(calls) == 1
+
+def test_decorates_coroutines():
+    calls = []
+
+    @_policy(retries=3)
+    async def fn():
+        calls.append(1)
+        if len(calls) == 1:
+            raise ConnectionError("failed")
+        return "value"
+
+    assert asyncio.run(fn()) == "value"
+    assert len(calls) == 2
+
+def test_attempt_hooks_see_every_attempt():
+    attempts = []
+    retry.add_attempt_hook(attempts.append)
+    try:
+        fn, _ = _flaky(1)
+        _policy(retries=3).call(fn)
+    finally:
+        retry.remove_attempt_hook(attempts.append)
+    assert [(attempt.number, attempt.succeeded, attempt.will_retry) for attempt in attempts] == [(1, False, True), (2, True, False)]
+
+def test_transient_azure_errors():
+    assert retry.is_transient_azure_error(_http_error(429))
+    assert retry.is_transient_azure_error(_http_error(503))
+    assert retry.is_transient_azure_error(ServiceRequestError("connection reset"))
+    assert not retry.is_transient_azure_error(_http_error(400))
+    assert not retry.is_transient_azure_error(_http_error(404))
+    assert not retry.is_transient_azure_error(ClientAuthenticationError("denied"))
+    assert not retry.is_transient_azure_error(ValueError("bad"))
+
+def test_retry_after_hints():
+    assert retry.retry_after_of(_http_error(429, {"x-ms-retry-after-ms": "1500"})) == 1.5
+    assert retry.retry_after_of(_http_error(429, {"Retry-After": "3"})) == 3.0
+    assert retry.retry_after_of(_http_error(429, {"Retry-After": "soon"})) is None
+    assert retry.retry_after_of(_http_error(429)) is None
+
+def test_retry_after_hint_sets_the_delay():
+    attempts = []
+    e = _http_error(429, {"retry-after-ms": "10"})
+    calls = []
+
+    def fn():
+        calls.append(1)
+        if len(calls) == 1:
+            raise e
+        return "value"
+
+    retry.add_attempt_hook(attempts.append)
+    try:
+        retry.RetryPolicy("test", is_retryable=retry.is_transient_azure_error).call(fn)
+    finally:
+        retry.remove_attempt_hook(attempts.append)
+    assert attempts[0].delay == pytest.approx(0.01)
+
+def test_deadline_is_shared_and_only_shortens():
+    assert retry.remaining() is None
+    with retry.deadline(10):
+        assert 9 < retry.remaining() <= 10
+        with retry.deadline(60):
+            assert retry.remaining() <= 10
+        with retry.deadline(1):
+            assert retry.remaining() <= 1
+    assert retry.remaining() is None
+
+def test_expired_deadline_stops_before_the_call():
+    fn, calls = _flaky(0)
+    with retry.deadline(0):
+        with pytest.raises(retry.DeadlineExceededError):
+            _policy().call(fn)
+    assert calls == []
+
+def test_no_retry_when_the_wait_exceeds_the_deadline():
+    calls = []
+
+    def fn():
+        calls.append(1)
+        raise _http_error(429, {"Retry-After": "30"})
+
+    started = time.monotonic()
+    with retry.deadline(1):
+        with pytest.raises(HttpResponseError):
+            retry.RetryPolicy("test", is_retryable=retry.is_transient_azure_error).call(fn)
+    assert len(calls) == 1
+    assert time.monotonic() - started < 1
+
+def test_policy_timeout_bounds_each_call():
+    seen = []
+    _policy(timeout=5).call(lambda: seen.append(retry.remaining()))
+    assert 0 < seen[0] <= 5
+    assert retry.remaining() is None
@@ -0,0 +1,107 @@
+import asyncio
+import threading
+import time
+import pytest
+from single_flight import AsyncSingleFlight, SingleFlight
+
+def _run_concurrently(flights, fn, callers):
+    # `fn` blocks until released, so every caller joins the first one's flight.
+    results = []
+    errors = []
+
+    def call():
+        try:
+            results.append(flights.do("key", fn))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=call) for _ in range(callers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    return results, errors
+
+def test_concurrent_calls_share_one_result():
+    calls = []
+    release = threading.Event()
+
+    def fn():
+        calls.append(1)
+        release.wait(5)
+        return "value"
+
+    threading.Timer(0.1, release.set).start()
+    results, errors = _run_concurrently(SingleFlight(), fn, 4)
+    assert results == ["value"] * 4
+    assert errors == []
+    assert len(calls) == 1
+
+def test_concurrent_calls_share_one_error():
+    release = threading.Event()
+
+    def fn():
+        release.wait(5)
+        raise ValueError("failed")
+
+    threading.Timer(0.1, release.set).start()
+    results, errors = _run_concurrently(SingleFlight(), fn, 3)
+    assert results == []
+    assert len(errors) == 3 and all(isinstance(e, ValueError) for e in errors)
+
+def test_later_calls_start_a_new_flight():
+    flights = SingleFlight()
+    values = iter(["first", "second"])
+    assert flights.do("key", lambda: next(values)) == "first"
+    assert flights.do("key", lambda: next(values)) == "second"
+
+def test_async_concurrent_calls_share_one_result():
+    calls = []
+
+    async def fn():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return "value"
+
+    async def main():
+        flights = AsyncSingleFlight()
+        return await asyncio.gather(*(flights.do("key", fn) for _ in range(4)))
+
+    assert asyncio.run(main()) == ["value"] * 4
+    assert len(calls) == 1
+
+def test_async_concurrent_calls_share_one_error():
+    async def fn():
+        await asyncio.sleep(0.05)
+        raise ValueError("failed")
+
+    async def main():
+        flights = AsyncSingleFlight()
+        return await asyncio.gather(*(flights.do("key", fn) for _ in range(3)), return_exceptions=True)
+
+    results = asyncio.run(main())
+    assert all(isinstance(result, ValueError) for result in results)
+
+def test_async_cancelled_leader_does_not_cancel_followers():
+    calls = []
+
+    async def fn():
+        calls.append(1)
+        await asyncio.sleep(0.1)
+        return "value"
+
+    async def main():
+        flights = AsyncSingleFlight()
+        leader = asyncio.create_task(flights.do("key", fn))
+        await asyncio.sleep(0)
+        followers = [asyncio.create_task(flights.do("key", fn)) for _ in range(2)]
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await asyncio.gather(*followers), flights._flights
+
+    results, flights = asyncio.run(main())
+    assert results == ["value", "value"]
+    assert len(calls) == 1
+    assert flights == {}
@@ -0,0 +1,61 @@
+import asyncio
+import db_utils
+import survey_transfer
+
+async def _chunks(*chunks):
+    for chunk in chunks:
+        yield chunk
+
+def _lines(*chunks, max_line_bytes=100):
+    async def collect():
+        return [line async for line in survey_transfer.ndjson_lines(_chunks(*chunks), max_line_bytes)]
+    return asyncio.run(collect())
+
+def _import(body, **kwargs):
+    async def collect():
+        return [result async for result in survey_transfer.import_surveys_async(_chunks(body), **kwargs)]
+    return asyncio.run(collect())
+
+def test_lines_are_split_across_chunks():
+    assert _lines(b'{"a"', b': 1}\n{"b": 2}\n{"c"', b": 3}") == [b'{"a": 1}', b'{"b": 2}', b'{"c": 3}']
+
+def test_overlong_lines_are_skipped_as_none():
+    long_line = b"x" * 150
+    assert _lines(b"short\n" + long_line[:80], long_line[80:] + b"\nnext\n") == [b"short", None, b"next"]
+    assert _lines(b"x" * 101) == [None]
+
+def test_blank_trailing_data_is_dropped():
+    assert _lines(b"one\n", b"  ") == [b"one"]
+
+def test_survey_lines_are_validated():
+    assert survey_transfer.parse_survey_line(b'{"surveyName": "a", "survey": {"x": 1}}') == (("a", {"x": 1}), None)
+    for line in (b"not json", b"[]", b'{"survey": {"x": 1}}', b'{"surveyName": "a/b", "survey": {"x": 1}}', b'{"surveyName": "a", "survey": {}}'):
+        record, error = survey_transfer.parse_survey_line(line)
+        assert record is None and error.startswith("Malformed record")
+
+def _limited(ndjson_lines, max_line_bytes):
+    # The import reads lines with the module's default limit; tests lower it.
+    def lines(chunks):
+        return ndjson_lines(chunks, max_line_bytes)
+    return lines
+
+def test_import_reports_every_line_and_a_summary(fake_services, monkeypatch):
+    monkeypatch.setattr(survey_transfer, "SURVEY_IMPORT_MAX_LINE_BYTES", 200)
+    body = (
+        survey_transfer.survey_line("first", {"responses": {"q1": "yes"}}).encode()
+        + b"not json\n"
+        + b"\n"
+        + survey_transfer.survey_line("second", {"responses": {"q1": "x" * 300}}).encode()
+        + survey_transfer.survey_line("first", {"responses": {"q1": "no"}}).encode()
+    )
+    monkeypatch.setattr(survey_transfer, "ndjson_lines", _limited(survey_transfer.ndjson_lines, 200))
+    results = _import(body, chunk_size=1, concurrency=2)
+    by_line = {result["line"]: result for result in results if "line" in result}
+    assert by_line[1]["status"] == "ok"
+    assert by_line[2]["status"] == "error"
+    assert 3 not in by_line
+    assert "longer than 200 bytes" in by_line[4]["error"]
+    assert by_line[5]["status"] == "ok"
+    assert results[-1] == {"summary": {"imported": 2, "failed": 2}}
+    # The later copy of a repeated name wins.
+    assert db_utils.get_survey(db_utils.get_client(), "first") == {"responses": {"q1": "no"}}
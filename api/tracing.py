@@ -0,0 +1,257 @@
+import contextvars
+import functools
+import inspect
+import logging
+import os
+import threading
+import time
+import metrics
+import retry
+
+# Spans are also reported through the OpenTelemetry API when it is installed.
+# Without an SDK and exporter configured (e.g. the Azure Monitor distro) its
+# tracer is a no-op, so only the in-process metrics below are kept.
+TRACING_OPENTELEMETRY = os.environ.get("TRACING_OPENTELEMETRY", "true").lower() == "true"
+TRACER_NAME = "changeai"
+
+DEPENDENCY_DURATION = metrics.registry.histogram(
+    "changeai_dependency_duration_seconds",
+    "Duration of Cosmos DB, Blob Storage, Key Vault and OpenAI helper calls, retries included."
+)
+DEPENDENCY_ATTEMPTS = metrics.registry.histogram(
+    "changeai_dependency_attempts",
+    "Attempts made by one helper call.",
+    metrics.ATTEMPT_BUCKETS
+)
+COSMOS_REQUEST_UNITS = metrics.registry.histogram(
+    "changeai_cosmos_request_units",
+    "Request units charged by Cosmos DB per helper call.",
+    metrics.REQUEST_UNIT_BUCKETS
+)
+OPENAI_TOKENS = metrics.registry.histogram(
+    "changeai_openai_tokens",
+    "Prompt and completion tokens per OpenAI call.",
+    metrics.TOKEN_BUCKETS
+)
+PAYLOAD_BYTES = metrics.registry.histogram(
+    "changeai_payload_bytes",
+    "Bytes sent and received per helper call.",
+    metrics.BYTE_BUCKETS
+)
+ROUTE_DURATION = metrics.registry.histogram(
+    "changeai_route_duration_seconds",
+    "Time until an HTTP route returns its response; streamed bodies are not included."
+)
+RETRY_ATTEMPTS = metrics.registry.counter(
+    "changeai_retry_attempts_total",
+    "Attempts made under each retry policy, by outcome."
+)
+
+# Measurements a span accumulates, and the histogram (with extra labels) each
+# one is observed into when the span ends.
+MEASUREMENTS = {
+    "request_charge": (COSMOS_REQUEST_UNITS, {}),
+    "prompt_tokens": (OPENAI_TOKENS, {"kind": "prompt"}),
+    "completion_tokens": (OPENAI_TOKENS, {"kind": "completion"}),
+    "bytes_sent": (PAYLOAD_BYTES, {"direction": "sent"}),
+    "bytes_received": (PAYLOAD_BYTES, {"direction": "received"})
+}
+
+_current = contextvars.ContextVar("tracing_span", default=None)
+
+@functools.lru_cache(maxsize=None)
+def _tracer():
+    if not TRACING_OPENTELEMETRY:
+        return None
+    try:
+        from opentelemetry import trace
+    except ImportError:
+        return None
+    return trace.get_tracer(TRACER_NAME)
+
+class Span:
+    # Measurements roll up into the parent span when a span ends, so a route
+    # span totals the request units, tokens and bytes of everything under it.
+    def __init__(self, service, operation, parent=None):
+        self.service = service
+        self.operation = operation
+        self.parent = parent
+        self.attempts = 0
+        self.values = {}
+        self.outcome = "ok"
+        # Whether this request's verbose log records are kept; see log_utils.
+        self.log_sampled = None
+        self._lock = threading.Lock()
+        self._started = time.monotonic()
+        self._otel = None
+
+    def add(self, name, value):
+        # Worker threads of a parallel fan-out can share their caller's span.
+        with self._lock:
+            self.values[name] = self.values.get(name, 0) + value
+
+    def _start_otel(self):
+        # Spans the configured SDK does not record are dropped straight away.
+        tracer = _tracer()
+        if tracer is not None:
+            otel = tracer.start_span(f"{self.service} {self.operation}", attributes={"changeai.service": self.service})
+            if otel.is_recording():
+                self._otel = otel
+
+    def _finish(self, error=None):
+        elapsed = time.monotonic() - self._started
+        if error is not None:
+            self.outcome = "error"
+        labels = {"service": self.service, "operation": self.operation}
+        if self.service == "http":
+            ROUTE_DURATION.observe(elapsed, route=self.operation, outcome=self.outcome)
+        else:
+            DEPENDENCY_DURATION.observe(elapsed, outcome=self.outcome, **labels)
+            if self.attempts:
+                DEPENDENCY_ATTEMPTS.observe(self.attempts, **labels)
+        for name, value in self.values.items():
+            histogram, extra = MEASUREMENTS[name]
+            histogram.observe(value, **labels, **extra)
+            if self.parent is not None:
+                self.parent.add(name, value)
+        if self._otel is not None:
+            self._finish_otel(error)
+
+    def _finish_otel(self, error):
+        from opentelemetry.trace import Status, StatusCode
+        otel = self._otel
+        otel.set_attribute("changeai.outcome", self.outcome)
+        if self.attempts:
+            otel.set_attribute("changeai.attempts", self.attempts)
+        for name, value in self.values.items():
+            otel.set_attribute(f"changeai.{name}", value)
+        if error is not None:
+            otel.record_exception(error)
+            otel.set_status(Status(StatusCode.ERROR, repr(error)))
+        otel.end()
+
+class _SpanScope:
+    def __init__(self, service, operation):
+        self._span = Span(service, operation, _current.get())
+
+    def __enter__(self):
+        current = self._span
+        current._start_otel()
+        self._otel_scope = None
+        if current._otel is not None:
+            from opentelemetry import trace
+            self._otel_scope = trace.use_span(current._otel, end_on_exit=False, record_exception=False, set_status_on_exception=False)
+            self._otel_scope.__enter__()
+        self._token = _current.set(current)
+        return current
+
+    def __exit__(self, exc_type, exc, tb):
+        _current.reset(self._token)
+        if self._otel_scope is not None:
+            self._otel_scope.__exit__(exc_type, exc, tb)
+        self._span._finish(exc)
+        return False
+
+def span(service, operation):
+    # with tracing.span(service, operation) as current: makes a span current
+    # for the block, and for OpenTelemetry if it records spans.
+    return _SpanScope(service, operation)
+
+def route_span():
+    # The HTTP route span the current code runs under, if any.
+    current = _current.get()
+    while current is not None and current.service != "http":
+        current = current.parent
+    return current
+
+def add(name, value):
+    # Adds to a measurement of the innermost span, if any.
+    current = _current.get()
+    if current is not None and value:
+        current.add(name, value)
+
+def traced(service, operation=None):
+    # Wraps a helper in a span. Put it above the retry policy so one span
+    # covers every attempt. Async generators get a span that is not made
+    # current: their body runs in whichever context iterates them.
+    def decorator(func):
+        name = operation or func.__name__
+        if inspect.isasyncgenfunction(func):
+            @functools.wraps(func)
+            async def async_gen_wrapper(*args, **kwargs):
+                detached = Span(service, name)
+                detached._start_otel()
+                try:
+                    async for item in func(*args, **kwargs):
+                        yield item
+                except GeneratorExit:
+                    # The consumer stopped early, e.g. a closed client stream.
+                    detached._finish()
+                    raise
+                except BaseException as e:
+                    detached._finish(e)
+                    raise
+                detached._finish()
+            return async_gen_wrapper
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(service, name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(service, name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def _route_outcome(response):
+    # 4xx and 5xx responses count as errors without raising.
+    status_code = getattr(response, "status_code", None)
+    return "error" if isinstance(status_code, int) and status_code >= 400 else "ok"
+
+def traced_route(func):
+    # Wraps an HTTP route handler in a span named after the function; its
+    # helpers' spans nest under it. Place it below @app.route.
+    if inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            with span("http", func.__name__) as current:
+                response = await func(*args, **kwargs)
+                current.outcome = _route_outcome(response)
+                return response
+        return async_wrapper
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with span("http", func.__name__) as current:
+            response = func(*args, **kwargs)
+            current.outcome = _route_outcome(response)
+            return response
+    return wrapper
+
+def _body_size(body):
+    if isinstance(body, (bytes, bytearray, str)):
+        return len(body)
+    return 0
+
+def record_azure_response(response):
+    # raw_response_hook for Azure SDK clients: adds the Cosmos DB request
+    # charge and the request and response body sizes to the current span.
+    try:
+        headers = response.http_response.headers
+        charge = headers.get("x-ms-request-charge")
+        if charge:
+            add("request_charge", float(charge))
+        add("bytes_sent", _body_size(response.http_request.body))
+        add("bytes_received", int(headers.get("Content-Length") or 0))
+    except Exception as e:
+        logging.debug(f"Tracing could not read Azure response: {repr(e)}")
+
+def _record_attempt(attempt):
+    RETRY_ATTEMPTS.inc(policy=attempt.policy, outcome="ok" if attempt.succeeded else ("retried" if attempt.will_retry else "failed"))
+    current = _current.get()
+    if current is not None:
+        current.attempts = max(current.attempts, attempt.number)
+
+retry.add_attempt_hook(_record_attempt)
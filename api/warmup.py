@@ -0,0 +1,103 @@
+import asyncio
+import os
+import time
+import lazy_modules
+import log_utils
+from client_registry import registry
+
+# What a first request would otherwise pay for: importing the SDKs and helper
+# modules, building clients (the sync Cosmos client reads the account when it
+# is constructed), acquiring tokens, reading the OpenAI key and generating the
+# response schemas the OpenAI SDK sends with every call.
+WARMUP_MODULES = (
+    "analysis_pipeline",
+    "batch_analysis",
+    "report_content",
+    "survey_transfer",
+    "rate_limiter"
+)
+# Cosmos DB and Key Vault tokens are acquired by building the Cosmos client
+# and reading the OpenAI key.
+WARMUP_TOKEN_SCOPES = tuple(scope for scope in os.environ.get("WARMUP_TOKEN_SCOPES", "https://storage.azure.com/.default").split(",") if scope)
+WARMUP_TIMEOUT_SECONDS = float(os.environ.get("WARMUP_TIMEOUT_SECONDS", "60"))
+OPENAI_SECRET_NAME = "OpenAI"
+
+def _clients():
+    import blob_utils
+    import db_utils
+    import keyvault_utils
+    db_utils.get_client()
+    blob_utils.get_client()
+    keyvault_utils.get_client()
+
+def _tokens():
+    for scope in WARMUP_TOKEN_SCOPES:
+        registry.get_credential().get_token(scope)
+
+def _schemas():
+    import analysis_schema
+    # Pydantic builds validators when the classes are defined; the JSON
+    # schemas are generated on first use and again for every OpenAI call.
+    for model in (
+        analysis_schema.Response,
+        analysis_schema.NumericAnalysis,
+        analysis_schema.Insights,
+        analysis_schema.Recommendations,
+        analysis_schema.Summary,
+        analysis_schema.Extraction
+    ):
+        model.model_json_schema()
+    analysis_schema.Request.model_validate({"forms": []})
+
+async def _async_clients():
+    import blob_utils
+    import db_utils
+    import keyvault_utils
+    db_utils.get_async_client()
+    blob_utils.get_async_client()
+    keyvault_utils.get_async_client()
+
+async def _async_tokens():
+    for scope in WARMUP_TOKEN_SCOPES:
+        await registry.get_async_credential().get_token(scope)
+
+async def _openai():
+    import keyvault_utils
+    import openai_utils
+    api_key = await keyvault_utils.get_secret_async(keyvault_utils.get_async_client(), OPENAI_SECRET_NAME)
+    openai_utils.get_client(api_key=api_key)
+    openai_utils.get_async_client(api_key=api_key)
+    openai_utils.get_rate_limiter()
+
+async def _step(name, step):
+    # Returns (name, result); a failed step is reported rather than raised, so
+    # one unreachable service does not stop the rest from warming.
+    started = time.monotonic()
+    try:
+        if asyncio.iscoroutinefunction(step):
+            await step()
+        else:
+            await asyncio.to_thread(step)
+        return name, {"seconds": round(time.monotonic() - started, 4)}
+    except Exception as e:
+        log_utils.error("Warm-up step error", step=name, error=e)
+        return name, {"seconds": round(time.monotonic() - started, 4), "error": repr(e)}
+
+async def warm_async():
+    # Imports first, since every other step needs them; the network-bound
+    # steps then run concurrently. Returns the per-step timings.
+    started = time.monotonic()
+    imports = await asyncio.to_thread(lazy_modules.load, *WARMUP_MODULES)
+    steps = [("clients", _clients), ("tokens", _tokens), ("schemas", _schemas), ("asyncClients", _async_clients), ("asyncTokens", _async_tokens), ("openai", _openai)]
+    try:
+        results = await asyncio.wait_for(asyncio.gather(*(_step(name, step) for name, step in steps)), WARMUP_TIMEOUT_SECONDS)
+    except asyncio.TimeoutError:
+        results = [("timeout", {"seconds": WARMUP_TIMEOUT_SECONDS, "error": "Warm-up did not finish in time"})]
+    result = {
+        "seconds": round(time.monotonic() - started, 4),
+        "imports": imports,
+        "steps": dict(results)
+    }
+    result["ok"] = not any("error" in step for step in result["steps"].values())
+    log_utils.info("Warm-up finished", ok=result["ok"], seconds=result["seconds"], steps=result["steps"])
+    return result
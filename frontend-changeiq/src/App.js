@@ -88,6 +88,7 @@ function App() {
   const [analysisDialogOpen, setAnalysisDialogOpen] = useState(false);
   const [isGeneratingPDF, setIsGeneratingPDF] = useState(false);
   const [reportVersions, setReportVersions] = useState({});
+  const [reportVersionsToken, setReportVersionsToken] = useState({});
   const [menuAnchor, setMenuAnchor] = useState(null);
   const [selectedSurvey, setSelectedSurvey] = useState(null);
   const [versionsLoading, setVersionsLoading] = useState(false);
@@ -479,15 +480,23 @@ function App() {
     }
   };
 
-  const fetchReportVersions = async (surveyName) => {
+  // Loads the first page of versions, or the next one after continuationToken.
+  const fetchReportVersions = async (surveyName, continuationToken = null) => {
     try {
       setVersionsLoading(true);
-      const response = await ApiService.listReportVersions(surveyName);
+      const response = await ApiService.listReportVersions(surveyName, continuationToken);
       
       // Extract reportVersions array from the response
       setReportVersions(prev => ({
         ...prev,
-        [surveyName]: response.reportVersions || []
+        [surveyName]: [
+          ...(continuationToken ? prev[surveyName] || [] : []),
+          ...(response.reportVersions || [])
+        ]
+      }));
+      setReportVersionsToken(prev => ({
+        ...prev,
+        [surveyName]: response.continuationToken || null
       }));
     } catch (error) {
       console.error('Error fetching report versions:', error);
@@ -749,40 +758,45 @@ function App() {
                           horizontal: 'right',
                         }}
                       >
+                        {(reportVersions[survey.name] || []).map((timestamp, index) => {
+                          // Parse the timestamp
+                          const date = new Date(timestamp);
+                          // Format the date
+                          const formattedDate = date.toLocaleString('en-US', {
+                            year: 'numeric',
+                            month: 'numeric',
+                            day: 'numeric',
+                            hour: '2-digit',
+                            minute: '2-digit',
+                            second: '2-digit'
+                          });
+                    
+                          return (
+                            <MenuItem 
+                              key={timestamp}
+                              onClick={() => {
+                                handleLogsMenuClose();
+                                handleReportVersionSelectAndDownload(survey.name, timestamp);
+                              }}
+                            >
+                              <Typography variant="body2" color="text.secondary" sx={{ fontSize: '0.8rem' }}>
+                              Version {index + 1} - {formattedDate}
+                              </Typography>
+                            </MenuItem>
+                          );
+                        })}
                         {versionsLoading ? (
                           <MenuItem disabled>
                             <Box sx={{ display: 'flex', justifyContent: 'center', width: '100%' }}>
                               <CircularProgress size={20} />
                             </Box>
                           </MenuItem>
-                        ) : (
-                          (reportVersions[survey.name] || []).map((timestamp, index) => {
-                            // Parse the timestamp
-                            const date = new Date(timestamp);
-                            // Format the date
-                            const formattedDate = date.toLocaleString('en-US', {
-                              year: 'numeric',
-                              month: 'numeric',
-                              day: 'numeric',
-                              hour: '2-digit',
-                              minute: '2-digit',
-                              second: '2-digit'
-                            });
-                      
-                            return (
-                              <MenuItem 
-                                key={timestamp}
-                                onClick={() => {
-                                  handleLogsMenuClose();
-                                  handleReportVersionSelectAndDownload(survey.name, timestamp);
-                                }}
-                              >
-                                <Typography variant="body2" color="text.secondary" sx={{ fontSize: '0.8rem' }}>
-                                Version {index + 1} - {formattedDate}
-                                </Typography>
-                              </MenuItem>
-                            );
-                          })
+                        ) : reportVersionsToken[survey.name] && (
+                          <MenuItem onClick={() => fetchReportVersions(survey.name, reportVersionsToken[survey.name])}>
+                            <Typography variant="body2" color="primary" sx={{ fontSize: '0.8rem' }}>
+                              Load more versions
+                            </Typography>
+                          </MenuItem>
                         )}
                         {(reportVersions[survey.name] || []).length === 0 && !versionsLoading && (
                           <MenuItem disabled>
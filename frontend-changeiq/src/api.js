@@ -29,9 +29,19 @@ class ApiService {
         }
       }
       
-      const data = await response.json();
+      let data = await response.json();
       console.log('Received survey data:', JSON.stringify(data));
-      return data.surveyNames || [];
+      const surveyNames = [...(data.surveyNames || [])];
+      // Surveys are listed a page at a time; follow the continuation tokens.
+      while (data.continuationToken) {
+        const pageResponse = await fetch(`${API_BASE_URL}/surveys?continuationToken=${encodeURIComponent(data.continuationToken)}`);
+        if (!pageResponse.ok) {
+          throw new Error(`API error: ${await pageResponse.text()}`);
+        }
+        data = await pageResponse.json();
+        surveyNames.push(...(data.surveyNames || []));
+      }
+      return surveyNames;
     } catch (error) {
       console.error('Error fetching surveys:', error);
       throw error;
@@ -194,13 +204,16 @@ class ApiService {
         // Parse the response body ONCE
         const responseData = await response.json();
         
-        // Fetch the summary text file
-        const summaryResponse = await fetch(responseData.summary);
-        const summaryData = await summaryResponse.text();
-        
-        // Fetch the analysis JSON file
-        const analysisResponse = await fetch(responseData.analysis);
-        const analysisData = await analysisResponse.json();
+        // Fetch the analysis and summary together in one (gzip) response
+        const contentResponse = await fetch(
+          `${API_BASE_URL}/report/content?surveyName=${encodeURIComponent(responseData.surveyName)}&reportVersion=${encodeURIComponent(responseData.reportVersion)}`
+        );
+        if (!contentResponse.ok) {
+          throw new Error(`HTTP error ${contentResponse.status} fetching report content`);
+        }
+        const content = await contentResponse.json();
+        const summaryData = content.summary;
+        const analysisData = content.analysis;
         
         console.log("summaryData:", summaryData);
         console.log("analysisData:", analysisData);
@@ -217,14 +230,20 @@ class ApiService {
       throw error;
     }
   }
-  static async listReportVersions(surveyName) {
+  // Returns one page of versions; pass the continuationToken from the previous
+  // page to load the next one.
+  static async listReportVersions(surveyName, continuationToken = null) {
     if (!surveyName) {
       throw new Error('Survey name is required');
     }
   
     try {
       console.log(`Fetching report versions for survey: ${surveyName}`);
-      const response = await fetch(`${API_BASE_URL}/report/versions?surveyName=${encodeURIComponent(surveyName)}`, {
+      let url = `${API_BASE_URL}/report/versions?surveyName=${encodeURIComponent(surveyName)}`;
+      if (continuationToken) {
+        url += `&continuationToken=${encodeURIComponent(continuationToken)}`;
+      }
+      const response = await fetch(url, {
         method: 'GET',
         headers: {
           'Content-Type': 'application/json',